@@ -5,6 +5,7 @@ Handles transactions, verification, and refunds
 """
 
 import json
+import threading
 import uuid
 from datetime import datetime, timedelta
 from typing import Dict, Optional, List
@@ -81,6 +82,7 @@ class Wallet:
             amount=amount,
             gateway=source,
             user_id=self.user_id,
+            astrologer_id="",
             purpose="wallet_topup"
         )
         
@@ -151,7 +153,9 @@ class EnhancedPaymentSystem:
     def __init__(self, data_file: str = "transactions.json"):
         self.data_file = data_file
         self.wallets: Dict[str, Wallet] = {}
-        self.transactions: Dict[str, Transaction] = {}
+        self.transactions: Dict[str, Dict] = {}
+        # Gateway callbacks and the UI may verify the same transaction at once
+        self._verify_lock = threading.RLock()
         self.gateway_configs = {
             "khalti": {"fee_percent": 1.5, "test_mode": True},
             "esewa": {"fee_percent": 1.0, "test_mode": True},
@@ -209,7 +213,7 @@ class EnhancedPaymentSystem:
                 "total_with_fee": total_amount
             }
             
-            self.transactions[transaction.transaction_id] = transaction
+            self.transactions[transaction.transaction_id] = transaction.to_dict()
             
             return {
                 "success": True,
@@ -226,8 +230,13 @@ class EnhancedPaymentSystem:
                       gateway_reference: str = "") -> Dict:
         """
         Verify payment completion
-        Called after user completes payment on gateway
+        Called after user completes payment on gateway; verifying a
+        transaction again returns the first result without crediting twice
         """
+        with self._verify_lock:
+            return self._verify_payment(transaction_id, gateway_reference)
+    
+    def _verify_payment(self, transaction_id: str, gateway_reference: str) -> Dict:
         transaction = self.transactions.get(transaction_id)
         if not transaction:
             return {
@@ -235,6 +244,22 @@ class EnhancedPaymentSystem:
                 "error": "Transaction not found"
             }
         
+        if transaction["status"] == TransactionStatus.COMPLETED.value:
+            return {
+                "success": True,
+                "transaction_id": transaction_id,
+                "amount": transaction["amount"],
+                "gateway": transaction["gateway"],
+                "already_verified": True,
+                "message": "Payment already verified"
+            }
+        
+        if transaction["status"] not in (TransactionStatus.PENDING.value, TransactionStatus.PROCESSING.value):
+            return {
+                "success": False,
+                "error": f"Cannot verify transaction in {transaction['status']} status"
+            }
+        
         # Update transaction
         transaction["status"] = TransactionStatus.COMPLETED.value
         transaction["completed_at"] = datetime.now().isoformat()
@@ -242,7 +267,7 @@ class EnhancedPaymentSystem:
         
         # Add funds to wallet if it's a topup
         if transaction["purpose"] == "wallet_topup":
-            wallet = self.get_wallet(transaction["user_id"])
+            wallet = self.create_wallet(transaction["user_id"])
             wallet.add_funds(
                 transaction["amount"],
                 transaction["gateway"],
@@ -7,12 +7,19 @@ Endpoints:
 This keeps provider secrets off the desktop client. Set environment variables:
 - KHALTI_SECRET_KEY
 - ESEWA_MERCHANT_CODE
+- PAYMENT_VERIFIER_CACHE_TTL (optional, seconds a successful result is replayed)
+
+Requests are idempotent: a retry with the same Idempotency-Key header (or the
+same token/pid) while the first is running waits for it, and after a success
+gets the stored result instead of a second provider call.
 
 Run with: `python payment_verifier.py`
 """
 
 import os
+import time
 import logging
+import threading
 from flask import Flask, request, jsonify
 
 try:
@@ -23,6 +30,41 @@ except Exception:
 app = Flask(__name__)
 logging.basicConfig(level=logging.INFO)
 
+CACHE_TTL = int(os.environ.get('PAYMENT_VERIFIER_CACHE_TTL', '86400'))
+CACHE_SIZE = 10000
+
+# Keep-alive connections to the providers
+http = requests.Session() if requests else None
+
+# Successful results by idempotency key -> (expires_at, body, status)
+_results = {}
+# One verification per key at a time; striped so the lock table stays bounded
+_key_locks = [threading.Lock() for _ in range(64)]
+
+
+def idempotency_key(provider, reference):
+    """The client's Idempotency-Key header, otherwise one key per provider reference."""
+    return request.headers.get('Idempotency-Key') or f'{provider}:{reference}'
+
+
+def verify_once(key, verify):
+    """Run verify() -> (body, status) unless a success is stored for key; replay it otherwise."""
+    with _key_locks[hash(key) % len(_key_locks)]:
+        stored = _results.get(key)
+        if stored and stored[0] > time.time():
+            return jsonify({**stored[1], 'idempotent_replay': True}), stored[2]
+
+        body, status = verify()
+        if body.get('success'):
+            if len(_results) >= CACHE_SIZE:
+                now = time.time()
+                for expired in [k for k, v in _results.items() if v[0] <= now]:
+                    del _results[expired]
+                if len(_results) >= CACHE_SIZE:
+                    _results.pop(next(iter(_results)))
+            _results[key] = (time.time() + CACHE_TTL, body, status)
+        return jsonify(body), status
+
 
 @app.route('/verify/khalti', methods=['POST'])
 def verify_khalti():
@@ -45,18 +87,21 @@ def verify_khalti():
     headers = {'Authorization': f'Key {secret}'}
     payload = {'token': token, 'amount': int(amount)}
 
-    try:
-        resp = requests.post(verify_url, data=payload, headers=headers, timeout=10)
-        if resp.status_code == 200:
-            try:
-                body = resp.json()
-            except Exception:
-                body = resp.text
-            return jsonify({'success': True, 'provider': 'khalti', 'response': body})
-        else:
-            return jsonify({'success': False, 'provider': 'khalti', 'status_code': resp.status_code, 'response': resp.text}), 502
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 502
+    def verify():
+        try:
+            resp = http.post(verify_url, data=payload, headers=headers, timeout=10)
+            if resp.status_code == 200:
+                try:
+                    body = resp.json()
+                except Exception:
+                    body = resp.text
+                return {'success': True, 'provider': 'khalti', 'response': body}, 200
+            else:
+                return {'success': False, 'provider': 'khalti', 'status_code': resp.status_code, 'response': resp.text}, 502
+        except Exception as e:
+            return {'success': False, 'error': str(e)}, 502
+
+    return verify_once(idempotency_key('khalti', token), verify)
 
 
 @app.route('/verify/esewa', methods=['POST'])
@@ -80,14 +125,17 @@ def verify_esewa():
     verify_url = 'https://esewa.com.np/epay/transrec'
     params = {'pid': pid, 'scd': merchant, 'amt': amt}
 
-    try:
-        resp = requests.get(verify_url, params=params, timeout=10)
-        if resp.status_code == 200:
-            return jsonify({'success': True, 'provider': 'esewa', 'response': resp.text})
-        else:
-            return jsonify({'success': False, 'provider': 'esewa', 'status_code': resp.status_code, 'response': resp.text}), 502
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 502
+    def verify():
+        try:
+            resp = http.get(verify_url, params=params, timeout=10)
+            if resp.status_code == 200:
+                return {'success': True, 'provider': 'esewa', 'response': resp.text}, 200
+            else:
+                return {'success': False, 'provider': 'esewa', 'status_code': resp.status_code, 'response': resp.text}, 502
+        except Exception as e:
+            return {'success': False, 'error': str(e)}, 502
+
+    return verify_once(idempotency_key('esewa', pid), verify)
 
 
 if __name__ == '__main__':
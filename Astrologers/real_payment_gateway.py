@@ -13,6 +13,25 @@ from typing import Dict, Optional, Tuple
 import qrcode
 from io import BytesIO
 import base64
+import importlib.util
+import os
+
+
+def _load_token_cache():
+    """The backend's OAuth token cache; it only needs the standard library"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend", "token_cache.py")
+    try:
+        spec = importlib.util.spec_from_file_location("cosmos_token_cache", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module.paypal_tokens
+    except (OSError, ImportError) as e:
+        print(f"PayPal token cache unavailable, requesting a token per call: {e}")
+        return None
+
+
+# One token per set of PayPal credentials for the whole app
+paypal_tokens = _load_token_cache()
 
 
 class PaymentGateway(Enum):
@@ -272,7 +291,17 @@ class PayPalGateway:
     
     def get_access_token(self) -> Optional[str]:
         """
-        Get PayPal OAuth access token
+        Get PayPal OAuth access token, reused until shortly before it expires
+        """
+        if paypal_tokens is None:
+            token = self.fetch_access_token()
+            return token[0] if token else None
+        return paypal_tokens.get_sync((f"{self.base_url}/v1/oauth2/token", self.client_id),
+                                      self.fetch_access_token)
+    
+    def fetch_access_token(self) -> Optional[Tuple[str, float]]:
+        """
+        Request a new OAuth token - returns (access_token, expires_in)
         """
         auth = (self.client_id, self.client_secret)
         headers = {"Accept": "application/json"}
@@ -288,7 +317,8 @@ class PayPalGateway:
             )
             
             if response.status_code == 200:
-                return response.json().get("access_token")
+                token = response.json()
+                return token.get("access_token"), token.get("expires_in", 0)
         except Exception as e:
             print(f"PayPal Token Error: {e}")
         
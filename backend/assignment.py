@@ -0,0 +1,386 @@
+"""
+Assignment of pending questions to astrologers
+
+AssignmentEngine keeps, per question category, a min-heap of the astrologers
+tagged with any word of it (see backend.specializations), ordered by
+(open questions, -rating, id). Picking an astrologer pops stale entries
+until a live one is found and pushes the astrologer back with its new load,
+so each assignment costs O(log n).
+
+The index lives in process memory. Every worker rebuilds it from the database
+after ASSIGNMENT_REFRESH_SECONDS, so loads taken on other workers are picked
+up within that window.
+
+Loads follow the transaction that assigns or completes a question: a slot
+taken for a session is given back if it rolls back, and a slot freed by
+completing a question is only given back once that commits. Astrologer
+profile changes (activation, verification, specialization, rating) made
+through the ORM are applied to the index when their session commits; other
+workers rebuild their index.
+"""
+
+import heapq
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import event, func, inspect, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from backend.broadcast import broadcaster
+from backend.models import AstrologerQueue, Question, QuestionStatus, User, UserRole
+from backend.pagination import keyset_after, keyset_order
+from backend.specializations import specialization_tags
+
+ASSIGNMENT_MAX_LOAD = int(os.getenv("ASSIGNMENT_MAX_LOAD", 25))
+ASSIGNMENT_MINUTES_PER_QUESTION = int(os.getenv("ASSIGNMENT_MINUTES_PER_QUESTION", 30))
+ASSIGNMENT_REFRESH_SECONDS = float(os.getenv("ASSIGNMENT_REFRESH_SECONDS", 300))
+ASSIGNMENT_BATCH_SIZE = int(os.getenv("ASSIGNMENT_BATCH_SIZE", 500))
+
+# Backlog order - highest priority first, then oldest
+BACKLOG_KEYS = [(Question.priority, True), (Question.created_at, False), (Question.id, False)]
+
+# Heap used when no astrologer is tagged with a word of the category
+ANY_CATEGORY = "*"
+
+# User columns the index is built from
+ASSIGNMENT_FIELDS = ("role", "is_active", "is_verified", "specialization", "average_rating")
+
+
+class AssignmentEngine:
+    """Route questions to the least-loaded, best-rated matching astrologer"""
+
+    def __init__(self, max_load: int = ASSIGNMENT_MAX_LOAD, refresh_seconds: float = ASSIGNMENT_REFRESH_SECONDS):
+        self.max_load = max_load
+        self.refresh_seconds = refresh_seconds
+        self._tags: Dict[int, Set[str]] = {}
+        self._ratings: Dict[int, float] = {}
+        self._loads: Dict[int, int] = {}
+        self._heaps: Dict[str, List[Tuple[int, float, int]]] = {}
+        self._memberships: Dict[int, Set[str]] = {}
+        self._loaded_at: Optional[float] = None
+        self.assigned = 0
+
+    # ---- Index maintenance ----
+
+    def reset(self):
+        self._tags.clear()
+        self._ratings.clear()
+        self._loads.clear()
+        self._heaps.clear()
+        self._memberships.clear()
+        self._loaded_at = None
+
+    def add_astrologer(self, astrologer_id: int, specialization: Optional[str], rating: float = 0.0, load: int = 0):
+        """Add or update one astrologer in every heap it belongs to"""
+        self.remove_astrologer(astrologer_id)
+        self._tags[astrologer_id] = set(specialization_tags(specialization))
+        self._ratings[astrologer_id] = rating or 0.0
+        self._loads[astrologer_id] = load
+        self._memberships[astrologer_id] = set()
+        for category in self._heaps:
+            if self._matches(astrologer_id, category):
+                self._memberships[astrologer_id].add(category)
+        self._push(astrologer_id)
+
+    def remove_astrologer(self, astrologer_id: int):
+        """Forget an astrologer; its heap entries are dropped lazily"""
+        self._tags.pop(astrologer_id, None)
+        self._ratings.pop(astrologer_id, None)
+        self._loads.pop(astrologer_id, None)
+        self._memberships.pop(astrologer_id, None)
+
+    def release(self, astrologer_id: int):
+        """An assigned question was completed, or its assignment rolled back"""
+        if self._loads.get(astrologer_id, 0) > 0:
+            self._loads[astrologer_id] -= 1
+            self._push(astrologer_id)
+
+    def invalidate(self):
+        """Rebuild from the database on next use"""
+        self._loaded_at = None
+
+    def apply_profile(self, astrologer_id: int, eligible: bool, specialization: Optional[str],
+                      rating: float, load: int):
+        """Apply a committed profile change; a load already tracked here wins over the database's"""
+        if not eligible:
+            self.remove_astrologer(astrologer_id)
+        elif self._loaded_at is not None:
+            self.add_astrologer(astrologer_id, specialization, rating, self._loads.get(astrologer_id, load))
+
+    def _matches(self, astrologer_id: int, category: str) -> bool:
+        return category == ANY_CATEGORY or not self._tags[astrologer_id].isdisjoint(category.split())
+
+    def _entry(self, astrologer_id: int) -> Tuple[int, float, int]:
+        return (self._loads[astrologer_id], -self._ratings[astrologer_id], astrologer_id)
+
+    def _push(self, astrologer_id: int):
+        entry = self._entry(astrologer_id)
+        for category in self._memberships[astrologer_id]:
+            heap = self._heaps[category]
+            heapq.heappush(heap, entry)
+            if len(heap) > 4 * len(self._loads) + 64:
+                self._compact(heap)
+
+    def _compact(self, heap: List[Tuple[int, float, int]]):
+        """Drop stale entries once they outnumber the live ones"""
+        heap[:] = [entry for entry in set(heap) if self._is_live(entry)]
+        heapq.heapify(heap)
+
+    def _heap_for(self, category: str) -> List[Tuple[int, float, int]]:
+        """The heap for a category, built on first use"""
+        heap = self._heaps.get(category)
+        if heap is None:
+            heap = []
+            for astrologer_id in self._tags:
+                if self._matches(astrologer_id, category):
+                    heap.append(self._entry(astrologer_id))
+                    self._memberships[astrologer_id].add(category)
+            heapq.heapify(heap)
+            self._heaps[category] = heap
+        return heap
+
+    def _is_live(self, entry: Tuple[int, float, int]) -> bool:
+        load, negative_rating, astrologer_id = entry
+        return (
+            astrologer_id in self._loads
+            and self._loads[astrologer_id] == load
+            and self._ratings[astrologer_id] == -negative_rating
+        )
+
+    # ---- Assignment ----
+
+    def choose(self, category: Optional[str]) -> Optional[int]:
+        """Reserve the best astrologer for a category, or None if all are full"""
+        category = " ".join(specialization_tags(category)) or ANY_CATEGORY
+        astrologer_id = self._peek_best(self._heap_for(category))
+        if astrologer_id is None and category != ANY_CATEGORY:
+            astrologer_id = self._peek_best(self._heap_for(ANY_CATEGORY))
+        if astrologer_id is None:
+            return None
+
+        self._loads[astrologer_id] += 1
+        self._push(astrologer_id)
+        self.assigned += 1
+        return astrologer_id
+
+    def _peek_best(self, heap: List[Tuple[int, float, int]]) -> Optional[int]:
+        while heap:
+            if not self._is_live(heap[0]):
+                heapq.heappop(heap)
+                continue
+            load, _, astrologer_id = heap[0]
+            return astrologer_id if load < self.max_load else None
+        return None
+
+    def load_of(self, astrologer_id: int) -> int:
+        return self._loads.get(astrologer_id, 0)
+
+    def _queue_row(self, question_id: int, astrologer_id: int, now: datetime) -> dict:
+        position = self._loads[astrologer_id]
+        return {
+            "astrologer_id": astrologer_id,
+            "question_id": question_id,
+            "position": position,
+            "assigned_at": now,
+            "expected_completion": now + timedelta(minutes=ASSIGNMENT_MINUTES_PER_QUESTION * position),
+            "is_completed": False
+        }
+
+    # ---- Database ----
+
+    async def ensure_loaded(self, db: AsyncSession):
+        """Rebuild the index from the database when missing or older than the refresh window"""
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.refresh_seconds:
+            return
+
+        loads = dict((await db.execute(
+            select(AstrologerQueue.astrologer_id, func.count())
+            .where(AstrologerQueue.is_completed == False)
+            .group_by(AstrologerQueue.astrologer_id)
+        )).all())
+        astrologers = (await db.execute(
+            select(User.id, User.specialization, User.average_rating).where(
+                User.role == UserRole.ASTROLOGER,
+                User.is_verified == True,
+                User.is_active == True
+            )
+        )).all()
+
+        self.reset()
+        for astrologer_id, specialization, rating in astrologers:
+            self.add_astrologer(astrologer_id, specialization, rating or 0.0, loads.get(astrologer_id, 0))
+        self._loaded_at = time.monotonic()
+
+    async def assign_question(self, db: AsyncSession, question: Question) -> Optional[int]:
+        """Assign one pending question and queue it; the caller commits"""
+        await self.ensure_loaded(db)
+        astrologer_id = self.choose(question.category)
+        if astrologer_id is None:
+            return None
+
+        _reserve(db.sync_session, astrologer_id)
+        question.assigned_to = astrologer_id
+        question.status = QuestionStatus.ASSIGNED
+        db.add(AstrologerQueue(**self._queue_row(question.id, astrologer_id, datetime.utcnow())))
+        return astrologer_id
+
+    async def complete_question(self, db: AsyncSession, question: Question):
+        """Mark the question's queue entry done and free the astrologer's slot"""
+        result = await db.execute(
+            update(AstrologerQueue)
+            .where(AstrologerQueue.question_id == question.id, AstrologerQueue.is_completed == False)
+            .values(is_completed=True)
+        )
+        if result.rowcount and question.assigned_to:
+            db.sync_session.info.setdefault("assignment_released", []).append(question.assigned_to)
+
+    async def assign_backlog(self, db: AsyncSession, batch_size: int = ASSIGNMENT_BATCH_SIZE) -> int:
+        """Assign every pending, unassigned question, highest priority first
+
+        Used to catch up after an outage. Questions are read in keyset batches;
+        each batch costs one bulk UPDATE, one bulk INSERT into astrologer_queue
+        and one commit.
+        """
+        await self.ensure_loaded(db)
+        query = select(Question.id, Question.category, Question.priority, Question.created_at).where(
+            Question.status == QuestionStatus.PENDING,
+            Question.assigned_to == None,
+            Question.is_public == False
+        ).order_by(*keyset_order(BACKLOG_KEYS)).limit(batch_size)
+
+        assigned = 0
+        last = None
+        while True:
+            page = query.where(keyset_after(BACKLOG_KEYS, last)) if last else query
+            rows = (await db.execute(page)).all()
+            if not rows:
+                break
+
+            now = datetime.utcnow()
+            updates, queue_rows = [], []
+            for question_id, category, _, _ in rows:
+                astrologer_id = self.choose(category)
+                if astrologer_id is None:
+                    continue
+                _reserve(db.sync_session, astrologer_id)
+                updates.append({"id": question_id, "assigned_to": astrologer_id, "status": QuestionStatus.ASSIGNED})
+                queue_rows.append(self._queue_row(question_id, astrologer_id, now))
+
+            if updates:
+                await db.execute(update(Question), updates)
+                await db.execute(insert(AstrologerQueue), queue_rows)
+                await db.commit()
+            assigned += len(updates)
+
+            question_id, _, priority, created_at = rows[-1]
+            last = (priority, created_at, question_id)
+            if len(rows) < batch_size:
+                break
+
+        return assigned
+
+    def stats(self) -> dict:
+        loads = list(self._loads.values())
+        return {
+            "astrologers": len(loads),
+            "open_questions": sum(loads),
+            "max_load": max(loads, default=0),
+            "categories": len(self._heaps),
+            "heap_entries": sum(len(heap) for heap in self._heaps.values()),
+            "assigned": self.assigned
+        }
+
+
+# Global assignment engine instance
+assignment_engine = AssignmentEngine()
+
+
+# ---- Keeping the index in step with commits ----
+
+def _reserve(session: Session, astrologer_id: int):
+    """A slot taken by choose() for this session, given back if it rolls back"""
+    session.info.setdefault("assignment_reserved", []).append(astrologer_id)
+
+
+def mark_astrologer_changed(session: Optional[Session], connection, astrologer_id: int):
+    """Apply astrologer_id's profile, as flushed on connection, once session commits
+
+    For writes that change a users row without going through the User mapper.
+    """
+    if session is None:
+        return
+    open_questions = select(func.count()).where(
+        AstrologerQueue.astrologer_id == astrologer_id, AstrologerQueue.is_completed == False
+    ).scalar_subquery()
+    row = connection.execute(
+        select(User.role, User.is_active, User.is_verified, User.specialization, User.average_rating,
+               open_questions).where(User.id == astrologer_id)
+    ).first()
+    profiles = session.info.setdefault("astrologer_profiles", {})
+    if row is None:
+        profiles[astrologer_id] = (False, None, 0.0, 0)
+    else:
+        role, is_active, is_verified, specialization, rating, load = row
+        eligible = role == UserRole.ASTROLOGER and bool(is_active) and bool(is_verified)
+        profiles[astrologer_id] = (eligible, specialization, rating or 0.0, load)
+
+
+@event.listens_for(User, "after_insert")
+def _astrologer_added(mapper, connection, target):
+    if target.role == UserRole.ASTROLOGER:
+        mark_astrologer_changed(Session.object_session(target), connection, target.id)
+
+
+@event.listens_for(User, "after_update")
+def _astrologer_changed(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[field].history.has_changes() for field in ASSIGNMENT_FIELDS):
+        mark_astrologer_changed(Session.object_session(target), connection, target.id)
+
+
+@event.listens_for(User, "after_delete")
+def _astrologer_deleted(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault("astrologer_profiles", {})[target.id] = (False, None, 0.0, 0)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _rebuild_after_bulk_user_writes(orm_execute_state):
+    """Bulk UPDATE/DELETE statements skip mapper events"""
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) and \
+            orm_execute_state.bind_mapper is inspect(User):
+        orm_execute_state.session.info["assignment_stale"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_after_commit(session):
+    session.info.pop("assignment_reserved", None)
+    for astrologer_id in session.info.pop("assignment_released", ()):
+        assignment_engine.release(astrologer_id)
+    profiles = session.info.pop("astrologer_profiles", {})
+    for astrologer_id, profile in profiles.items():
+        assignment_engine.apply_profile(astrologer_id, *profile)
+    stale = session.info.pop("assignment_stale", False)
+    if stale:
+        assignment_engine.invalidate()
+    if (profiles or stale) and broadcaster.distributed:
+        broadcaster.publish_threadsafe("assignment:changed", "")
+
+
+@event.listens_for(Session, "after_rollback")
+def _undo_after_rollback(session):
+    for astrologer_id in session.info.pop("assignment_reserved", ()):
+        assignment_engine.release(astrologer_id)
+    for key in ("assignment_released", "astrologer_profiles", "assignment_stale"):
+        session.info.pop(key, None)
+
+
+async def _on_assignment_broadcast(channel: str, payload: str):
+    assignment_engine.invalidate()
+
+
+broadcaster.subscribe("assignment:", _on_assignment_broadcast)
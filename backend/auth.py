@@ -1,20 +1,56 @@
 """
 Authentication and security utilities - Simplified version
+
+Verified access tokens are kept in an LRU keyed by the token's SHA-256, so
+a repeat request skips the signature check and claim parsing until the
+token expires. Every token carries a jti; logout denylists it, and
+deactivating a user revokes everything issued to them before that moment.
+Revocations are published on the broadcaster so every worker applies them.
+They live in memory, so a restarted worker forgets them - access tokens
+expire in ACCESS_TOKEN_EXPIRE_MINUTES anyway, and refresh only succeeds for
+active users.
+
+Passwords are hashed with bcrypt at PASSWORD_HASH_ROUNDS. Each hash costs
+tens to hundreds of milliseconds of CPU, so the async endpoints run it on a
+pool of PASSWORD_HASH_WORKERS threads (bcrypt releases the GIL) instead of
+on the event loop. Hashes from the old HMAC-SHA256 scheme still verify and
+are replaced with bcrypt at the user's next login.
 """
 
 import os
+import asyncio
+import base64
 import hashlib
 import hmac
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, Optional
+import bcrypt
 from jose import JWTError, jwt
 from pydantic import BaseModel
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from backend.broadcast import broadcaster
+from backend.cache import TTLCache
+from backend.models import User
 
 # JWT Configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 7
+VERIFIED_TOKEN_CACHE_SIZE = int(os.getenv("VERIFIED_TOKEN_CACHE_SIZE", 10000))
+VERIFIED_TOKEN_CACHE_TTL = float(os.getenv("VERIFIED_TOKEN_CACHE_TTL", 300))
+PASSWORD_HASH_ROUNDS = int(os.getenv("PASSWORD_HASH_ROUNDS", 12))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+
+# HMAC-SHA256 hexdigests written before the move to bcrypt
+LEGACY_HASH = re.compile(r"[0-9a-f]{64}")
 
 
 class Token(BaseModel):
@@ -29,24 +65,13 @@ class TokenData(BaseModel):
     """Token payload data"""
     user_id: int
     username: str
-    role: str
-
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a password using HMAC"""
-    try:
-        expected_hash = hmac.new(
-            SECRET_KEY.encode(),
-            plain_password.encode(),
-            hashlib.sha256
-        ).hexdigest()
-        return hmac.compare_digest(expected_hash, hashed_password)
-    except:
-        return False
+    role: Optional[str] = None
+    jti: Optional[str] = None
+    issued_at: float = 0
+    expires_at: float = 0
 
 
-def get_password_hash(password: str) -> str:
-    """Hash a password using HMAC"""
+def _legacy_hash(password: str) -> str:
     return hmac.new(
         SECRET_KEY.encode(),
         password.encode(),
@@ -54,6 +79,86 @@ def get_password_hash(password: str) -> str:
     ).hexdigest()
 
 
+class PasswordHasher:
+    """bcrypt at a tunable cost, with async variants run on a bounded thread pool
+    
+    bcrypt reads at most 72 bytes, so passwords go through SHA-256 (base64,
+    no NUL bytes) first and long passphrases keep all their entropy.
+    """
+    
+    def __init__(self, rounds: int = PASSWORD_HASH_ROUNDS, workers: int = PASSWORD_HASH_WORKERS):
+        if not 4 <= rounds <= 31:
+            raise ValueError("bcrypt rounds must be between 4 and 31")
+        self.rounds = rounds
+        self.workers = workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._dummy: Dict[int, str] = {}
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def _prehash(password: str) -> bytes:
+        return base64.b64encode(hashlib.sha256(password.encode()).digest())
+    
+    def hash(self, password: str) -> str:
+        return bcrypt.hashpw(self._prehash(password), bcrypt.gensalt(self.rounds)).decode()
+    
+    def verify(self, password: str, hashed: str) -> bool:
+        if not hashed:
+            return False
+        if LEGACY_HASH.fullmatch(hashed):
+            return hmac.compare_digest(_legacy_hash(password), hashed)
+        try:
+            return bcrypt.checkpw(self._prehash(password), hashed.encode())
+        except ValueError:
+            return False
+    
+    def needs_rehash(self, hashed: str) -> bool:
+        """Legacy HMAC hashes, and bcrypt hashes below the current cost"""
+        if LEGACY_HASH.fullmatch(hashed):
+            return True
+        try:
+            return int(hashed.split("$")[2]) < self.rounds
+        except (IndexError, ValueError):
+            return True
+    
+    def dummy_hash(self) -> str:
+        """A hash at the current cost to verify against when there is no user, so timing doesn't reveal usernames"""
+        if self.rounds not in self._dummy:
+            self._dummy[self.rounds] = self.hash(uuid.uuid4().hex)
+        return self._dummy[self.rounds]
+    
+    def _pool(self) -> ThreadPoolExecutor:
+        with self.lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+            return self._executor
+    
+    async def hash_async(self, password: str) -> str:
+        return await asyncio.get_running_loop().run_in_executor(self._pool(), self.hash, password)
+    
+    async def verify_async(self, password: str, hashed: str) -> bool:
+        return await asyncio.get_running_loop().run_in_executor(self._pool(), self.verify, password, hashed)
+    
+    def shutdown(self):
+        with self.lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+    
+    def stats(self) -> dict:
+        return {"rounds": self.rounds, "workers": self.workers}
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password against a bcrypt or legacy HMAC hash"""
+    return password_hasher.verify(plain_password, hashed_password)
+
+
+def get_password_hash(password: str) -> str:
+    """Hash a password with bcrypt; blocks for the whole hash, so async code uses password_hasher.hash_async"""
+    return password_hasher.hash(password)
+
+
 def create_access_token(user_id: int, username: str, role: str, expires_delta: Optional[timedelta] = None) -> str:
     """Create JWT access token"""
     if expires_delta:
@@ -65,8 +170,11 @@ def create_access_token(user_id: int, username: str, role: str, expires_delta: O
         "user_id": user_id,
         "username": username,
         "role": role,
+        "type": "access",
+        "jti": uuid.uuid4().hex,
         "exp": expire,
-        "iat": datetime.utcnow()
+        # Sub-second so a token issued right after a revocation is not caught by it
+        "iat": time.time()
     }
     
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
@@ -80,25 +188,77 @@ def create_refresh_token(user_id: int, username: str) -> str:
         "user_id": user_id,
         "username": username,
         "type": "refresh",
-        "exp": expire
+        "jti": uuid.uuid4().hex,
+        "exp": expire,
+        "iat": time.time()
     }
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-def verify_token(token: str) -> Optional[TokenData]:
-    """Verify and decode JWT token"""
+def decode_token(token: str, token_type: str = "access") -> Optional[TokenData]:
+    """Verify the signature and claims of a token - the full, uncached path"""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: int = payload.get("user_id")
-        username: str = payload.get("username")
-        role: str = payload.get("role")
-        
-        if user_id is None or username is None:
-            return None
-        
-        return TokenData(user_id=user_id, username=username, role=role)
     except JWTError:
         return None
+    
+    # Access tokens issued before the type claim existed have none
+    if payload.get("type", "access") != token_type:
+        return None
+    user_id = payload.get("user_id")
+    username = payload.get("username")
+    if user_id is None or username is None:
+        return None
+    
+    return TokenData(
+        user_id=user_id,
+        username=username,
+        role=payload.get("role"),
+        jti=payload.get("jti"),
+        issued_at=payload.get("iat") or 0,
+        expires_at=payload["exp"]
+    )
+
+
+def verify_token(token: str) -> Optional[TokenData]:
+    """Verify and decode JWT token, from the verified-token cache when possible"""
+    key = hashlib.sha256(token.encode()).digest()
+    token_data = verified_tokens.get(key)
+    if token_data is None:
+        token_data = decode_token(token)
+        if token_data is None:
+            return None
+        ttl = min(token_data.expires_at - time.time(), VERIFIED_TOKEN_CACHE_TTL)
+        if ttl > 0:
+            verified_tokens.set(key, token_data, ttl=ttl)
+    elif token_data.expires_at <= time.time():
+        verified_tokens.invalidate(key)
+        return None
+    
+    if token_revocations.is_revoked(token_data):
+        return None
+    return token_data
+
+
+def rotate_refresh_token(token: str) -> Optional[TokenData]:
+    """Accept a refresh token once and revoke it
+
+    Presenting an already rotated token means it was copied, so every token
+    of that user is revoked and they have to log in again.
+    """
+    token_data = decode_token(token, "refresh")
+    if token_data is None or token_data.jti is None:
+        return None
+    
+    with token_revocations.lock:
+        reused = token_revocations.token_revoked(token_data.jti)
+        if not reused and not token_revocations.is_revoked(token_data):
+            revoke_token(token_data)
+            return token_data
+    
+    if reused:
+        revoke_user(token_data.user_id)
+    return None
 
 
 def get_tokens(user_id: int, username: str, role: str) -> Token:
@@ -113,3 +273,98 @@ def get_tokens(user_id: int, username: str, role: str) -> Token:
         token_type="bearer",
         expires_in=ACCESS_TOKEN_EXPIRE_MINUTES * 60
     )
+
+
+# ---- Revocation ----
+
+class TokenRevocations:
+    """Denylisted token ids and per-user "issued before" cut-offs"""
+    
+    def __init__(self):
+        self._tokens: Dict[str, float] = {}
+        self._users: Dict[int, float] = {}
+        self.lock = threading.Lock()
+    
+    def revoke_token(self, jti: str, expires_at: float):
+        self._tokens[jti] = expires_at
+        if len(self._tokens) > VERIFIED_TOKEN_CACHE_SIZE:
+            # Expired tokens are rejected by their signature check anyway
+            now = time.time()
+            self._tokens = {key: exp for key, exp in self._tokens.items() if exp > now}
+    
+    def revoke_user(self, user_id: int, before: float):
+        self._users[user_id] = max(before, self._users.get(user_id, 0))
+    
+    def token_revoked(self, jti: str) -> bool:
+        return jti in self._tokens
+    
+    def is_revoked(self, token_data: TokenData) -> bool:
+        if token_data.jti is not None and token_data.jti in self._tokens:
+            return True
+        revoked_before = self._users.get(token_data.user_id)
+        return revoked_before is not None and token_data.issued_at < revoked_before
+    
+    def clear(self):
+        self._tokens.clear()
+        self._users.clear()
+    
+    def stats(self) -> dict:
+        return {"revoked_tokens": len(self._tokens), "revoked_users": len(self._users)}
+
+
+def revoke_token(token_data: TokenData):
+    """Reject this token from now on, on every worker"""
+    if token_data.jti is None:
+        return
+    token_revocations.revoke_token(token_data.jti, token_data.expires_at)
+    if broadcaster.distributed:
+        broadcaster.publish_threadsafe("auth:token", f"{token_data.jti}:{token_data.expires_at}")
+
+
+def revoke_user(user_id: int):
+    """Reject every token issued to user_id until now, on every worker"""
+    before = time.time()
+    token_revocations.revoke_user(user_id, before)
+    if broadcaster.distributed:
+        broadcaster.publish_threadsafe("auth:user", f"{user_id}:{before}")
+
+
+async def _on_revocation_broadcast(channel: str, payload: str):
+    key, value = payload.rsplit(":", 1)
+    if channel == "auth:token":
+        token_revocations.revoke_token(key, float(value))
+    else:
+        token_revocations.revoke_user(int(key), float(value))
+
+
+broadcaster.subscribe("auth:", _on_revocation_broadcast)
+
+
+@event.listens_for(User, "after_update")
+def _user_deactivated(mapper, connection, target):
+    history = inspect(target).attrs.is_active.history
+    if history.has_changes() and not target.is_active:
+        session = Session.object_session(target)
+        if session is not None:
+            session.info.setdefault("deactivated_users", set()).add(target.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _revoke_after_commit(session):
+    for user_id in session.info.pop("deactivated_users", ()):
+        revoke_user(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_after_rollback(session):
+    session.info.pop("deactivated_users", None)
+
+
+# Verified access tokens keyed by SHA-256 of the token
+verified_tokens = TTLCache(maxsize=VERIFIED_TOKEN_CACHE_SIZE, ttl=VERIFIED_TOKEN_CACHE_TTL)
+
+# Global revocation lists
+token_revocations = TokenRevocations()
+
+# Global password hasher
+password_hasher = PasswordHasher()
@@ -0,0 +1,3 @@
+"""
+Load and micro benchmarks for the backend - run with python -m backend.benchmarks.<name>
+"""
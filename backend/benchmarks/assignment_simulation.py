@@ -0,0 +1,134 @@
+"""
+Assignment simulation - heap-indexed AssignmentEngine vs a linear scan
+
+Routes a backlog of pending questions in memory with both strategies, then
+runs AssignmentEngine.assign_backlog against a SQLite copy of the backlog.
+
+Usage: python -m backend.benchmarks.assignment_simulation [--questions 100000] [--astrologers 2000]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from backend.assignment import AssignmentEngine
+from backend.database import Base
+from backend.models import Question, User, UserRole
+
+CATEGORIES = ["love", "marriage", "career", "money", "health", "family", "travel", "education",
+              "property", "children", "spirituality", "business"]
+
+
+def make_astrologers(count: int, rng: random.Random):
+    return [
+        (astrologer_id, ", ".join(rng.sample(CATEGORIES, rng.randint(1, 3))), round(rng.uniform(3, 5), 1))
+        for astrologer_id in range(1, count + 1)
+    ]
+
+
+def linear_choose(astrologers, loads, category: str, max_load: int):
+    """What a query-per-question scheduler does - look at every candidate"""
+    best = None
+    for astrologer_id, specialization, rating in astrologers:
+        if category in specialization and loads[astrologer_id] < max_load:
+            key = (loads[astrologer_id], -rating, astrologer_id)
+            if best is None or key < best:
+                best = key
+    if best is None:
+        return None
+    loads[best[2]] += 1
+    return best[2]
+
+
+def simulate(astrologers, categories, max_load: int):
+    engine = AssignmentEngine(max_load=max_load)
+    for astrologer_id, specialization, rating in astrologers:
+        engine.add_astrologer(astrologer_id, specialization, rating)
+
+    start = time.perf_counter()
+    for category in categories:
+        engine.choose(category)
+    return time.perf_counter() - start, engine
+
+
+def simulate_linear(astrologers, categories, max_load: int) -> float:
+    loads = {astrologer_id: 0 for astrologer_id, _, _ in astrologers}
+    start = time.perf_counter()
+    for category in categories:
+        linear_choose(astrologers, loads, category, max_load)
+    return time.perf_counter() - start
+
+
+async def backlog(workdir: str, astrologers, categories, max_load: int, batch_size: int) -> float:
+    engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(insert(User), [
+            {
+                "id": astrologer_id, "username": f"astrologer{astrologer_id}",
+                "email": f"astrologer{astrologer_id}@example.com", "password_hash": "x",
+                "role": UserRole.ASTROLOGER, "specialization": specialization,
+                "average_rating": rating, "is_verified": True, "is_active": True
+            }
+            for astrologer_id, specialization, rating in astrologers
+        ])
+        now = datetime.utcnow()
+        await conn.execute(insert(Question), [
+            {"user_id": 1, "category": category.title(), "title": f"Question {i}",
+             "priority": i % 3, "created_at": now - timedelta(seconds=i), "is_public": False}
+            for i, category in enumerate(categories)
+        ])
+
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+    assignment = AssignmentEngine(max_load=max_load)
+    try:
+        async with session_factory() as db:
+            start = time.perf_counter()
+            assigned = await assignment.assign_backlog(db, batch_size=batch_size)
+            elapsed = time.perf_counter() - start
+    finally:
+        await engine.dispose()
+    print(f"assign_backlog, SQLite   : {elapsed:.2f}s for {assigned} questions "
+          f"({assigned / elapsed:.0f} questions/s, batches of {batch_size})")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--questions", type=int, default=100000)
+    parser.add_argument("--astrologers", type=int, default=2000)
+    parser.add_argument("--linear-sample", type=int, default=5000,
+                        help="questions routed by the linear scan; its total is extrapolated")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--skip-db", action="store_true")
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    astrologers = make_astrologers(args.astrologers, rng)
+    categories = [rng.choice(CATEGORIES) for _ in range(args.questions)]
+    max_load = args.questions // args.astrologers + 10
+
+    elapsed, engine = simulate(astrologers, categories, max_load)
+    print(f"heap index, in memory    : {elapsed:.3f}s for {args.questions} questions "
+          f"({elapsed / args.questions * 1e6:.1f}us each)")
+    print(f"  {engine.stats()}")
+
+    sample = categories[:args.linear_sample]
+    linear = simulate_linear(astrologers, sample, max_load)
+    print(f"linear scan, in memory   : {linear / len(sample) * 1e6:.1f}us each, "
+          f"~{linear / len(sample) * args.questions:.1f}s projected for {args.questions}")
+
+    if not args.skip_db:
+        with tempfile.TemporaryDirectory() as workdir:
+            asyncio.run(backlog(workdir, astrologers, categories, max_load, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
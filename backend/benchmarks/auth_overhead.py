@@ -0,0 +1,113 @@
+"""
+Auth overhead per request - full JWT decode vs the verified-token cache
+
+Also times a refresh-token exchange against a full login through the app.
+
+Usage: python -m backend.benchmarks.auth_overhead [--requests 20000] [--users 500]
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from backend.auth import decode_token, get_password_hash, get_tokens, verified_tokens, verify_token
+from backend.database import (
+    Base, create_async_db_engine, create_db_engine, get_async_database_url, get_async_db, get_db
+)
+from backend.models import User
+from backend.rate_limit import rate_limiter
+
+
+def per_call(fn, tokens, requests: int) -> float:
+    """Microseconds per call, cycling through tokens"""
+    start = time.perf_counter()
+    for i in range(requests):
+        fn(tokens[i % len(tokens)])
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def bench_verification(requests: int, users: int):
+    tokens = [get_tokens(user_id, f"user{user_id}", "user").access_token for user_id in range(1, users + 1)]
+    uncached = per_call(decode_token, tokens, requests)
+    verified_tokens.clear()
+    cold = per_call(verify_token, tokens, len(tokens))
+    warm = per_call(verify_token, tokens, requests)
+    print(f"full decode + TokenData : {uncached:7.1f} us/request")
+    print(f"verify_token, first use : {cold:7.1f} us/request")
+    print(f"verify_token, cached    : {warm:7.1f} us/request ({uncached / warm:.0f}x faster, "
+          f"hit ratio {verified_tokens.stats()['hit_ratio']})")
+
+
+def bench_refresh(rounds: int):
+    from backend.main import app
+
+    # Measure the endpoints themselves, not the login/refresh budgets
+    rate_limiter.enabled = False
+
+    with tempfile.TemporaryDirectory() as workdir:
+        url = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        sync_engine = create_db_engine(url)
+        async_engine = create_async_db_engine(get_async_database_url(url))
+        Base.metadata.create_all(bind=sync_engine)
+        session_factory = sessionmaker(bind=sync_engine)
+        async_session_factory = async_sessionmaker(bind=async_engine, class_=AsyncSession, expire_on_commit=False)
+
+        db = session_factory()
+        db.add(User(username="seeker", email="seeker@example.com", full_name="Seeker",
+                    password_hash=get_password_hash("password123"), is_active=True))
+        db.commit()
+        db.close()
+
+        def override_get_db():
+            db = session_factory()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        async def override_get_async_db():
+            async with async_session_factory() as db:
+                yield db
+
+        app.dependency_overrides[get_db] = override_get_db
+        app.dependency_overrides[get_async_db] = override_get_async_db
+        try:
+            client = TestClient(app)
+            credentials = {"username": "seeker", "password": "password123"}
+            start = time.perf_counter()
+            for _ in range(rounds):
+                refresh_token = client.post("/api/auth/login", json=credentials).json()["refresh_token"]
+            login = (time.perf_counter() - start) / rounds * 1e3
+
+            start = time.perf_counter()
+            for _ in range(rounds):
+                refresh_token = client.post("/api/auth/refresh",
+                                            json={"refresh_token": refresh_token}).json()["refresh_token"]
+            refresh = (time.perf_counter() - start) / rounds * 1e3
+        finally:
+            app.dependency_overrides.clear()
+            sync_engine.dispose()
+            asyncio.run(async_engine.dispose())
+
+        print(f"login                   : {login:7.2f} ms/request")
+        print(f"refresh token exchange  : {refresh:7.2f} ms/request")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+    bench_verification(args.requests, args.users)
+    bench_refresh(args.rounds)
+
+
+if __name__ == "__main__":
+    main()
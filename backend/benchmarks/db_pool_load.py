@@ -0,0 +1,72 @@
+"""
+Concurrent reader benchmark - StaticPool vs the configured pool profile
+
+Usage: python -m backend.benchmarks.db_pool_load [--readers 8] [--queries 40]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+
+from backend.database import create_db_engine, get_pool_profile
+
+READ_QUERY = text("SELECT COUNT(*), SUM(LENGTH(content)) FROM bench_messages WHERE content LIKE :pattern")
+
+
+def seed(url: str, rows: int):
+    """Create the benchmark table with enough rows to make each read measurable"""
+    seed_engine = create_engine(url)
+    with seed_engine.begin() as conn:
+        conn.execute(text("CREATE TABLE bench_messages (id INTEGER PRIMARY KEY, content TEXT)"))
+        conn.execute(
+            text("INSERT INTO bench_messages (content) VALUES (:content)"),
+            [{"content": f"message {i} about the moon in house {i % 12}"} for i in range(rows)]
+        )
+    seed_engine.dispose()
+
+
+def run_readers(db_engine, readers: int, queries: int) -> float:
+    """Run queries spread across reader threads and return elapsed seconds"""
+    def read(i):
+        with db_engine.connect() as conn:
+            conn.execute(READ_QUERY, {"pattern": f"%house {i % 12}%"}).one()
+
+    with db_engine.connect() as conn:
+        conn.execute(READ_QUERY, {"pattern": "%warmup%"}).one()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=readers) as pool:
+        list(pool.map(read, range(queries)))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--queries", type=int, default=40)
+    parser.add_argument("--rows", type=int, default=200000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        url = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        seed(url, args.rows)
+
+        # The previous configuration - one connection shared by every request
+        static_engine = create_engine(url, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        profile = get_pool_profile()
+        profile_engine = create_db_engine(url, profile)
+
+        print(f"{args.readers} readers, {args.queries} queries over {args.rows} rows")
+        for label, db_engine in (("StaticPool", static_engine), ("pool profile + WAL", profile_engine)):
+            elapsed = run_readers(db_engine, args.readers, args.queries)
+            print(f"  {label:<20} {elapsed:7.3f}s  {args.queries / elapsed:8.1f} queries/s")
+            db_engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Notification throughput - connect-per-email inline sends vs the queued dispatcher
+
+Usage: python -m backend.benchmarks.notification_throughput [--emails 500]
+"""
+
+import argparse
+import asyncio
+import os
+import smtplib
+import tempfile
+import time
+from email.mime.text import MIMEText
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from backend.database import Base
+from backend.models import Question, User
+from backend.notifications import NotificationService
+from backend.testing.smtp_server import LocalSMTPServer
+
+
+def send_inline(smtp: LocalSMTPServer, emails: int) -> float:
+    """The previous behaviour - a new SMTP session for every email, on the caller"""
+    start = time.perf_counter()
+    for i in range(emails):
+        message = MIMEText(f"<p>notification {i}</p>", "html")
+        message["Subject"] = "Your Astrology Question Received"
+        message["To"] = "seeker@example.com"
+        with smtplib.SMTP(smtp.host, smtp.port) as server:
+            server.login("mailer", "secret")
+            server.send_message(message, "noreply@cosmosastrology.com")
+    return time.perf_counter() - start
+
+
+async def send_queued(service: NotificationService, emails: int):
+    """Return (seconds spent in notify calls, seconds until everything is delivered)"""
+    user = User(id=1, username="seeker", email="seeker@example.com", full_name="Seeker")
+    question = Question(id=1, user_id=1, title="Will we meet again?")
+
+    start = time.perf_counter()
+    for _ in range(emails):
+        service.notify_question_received(user, question)
+    enqueued = time.perf_counter() - start
+    await service.dispatcher.stop()
+    return enqueued, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--emails", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir, LocalSMTPServer() as smtp:
+        os.environ.update({
+            "SMTP_SERVER": smtp.host,
+            "SMTP_PORT": str(smtp.port),
+            "SMTP_USE_TLS": "false",
+            "EMAIL_USER": "mailer",
+            "EMAIL_PASSWORD": "secret"
+        })
+
+        inline = send_inline(smtp, args.emails)
+        print(f"inline, connect per email : {inline:.3f}s ({args.emails / inline:.0f} emails/s, "
+              f"{smtp.connections} connections)")
+
+        async def run():
+            engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}")
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            service = NotificationService(async_sessionmaker(engine, expire_on_commit=False))
+            service.dispatcher.workers = args.workers
+            try:
+                return await send_queued(service, args.emails), service.dispatcher.stats()
+            finally:
+                await engine.dispose()
+
+        connections_before = smtp.connections
+        (enqueued, drained), stats = asyncio.run(run())
+        print(f"queued, pooled connections: {drained:.3f}s ({args.emails / drained:.0f} emails/s, "
+              f"{smtp.connections - connections_before} connections)")
+        print(f"time spent in notify calls: {enqueued * 1000:.1f}ms total, "
+              f"{enqueued / args.emails * 1e6:.0f}us per call")
+        print(f"rows written: {stats['rows_written']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Login throughput per core at several bcrypt costs
+
+For each cost, times password verification (the CPU a login spends) on one
+thread, then through the hashing pool with one worker per core, and
+records how long the event loop went without running while the pool was
+busy. It repeats that last measurement with the verification run inline
+on the loop, as login did before, for comparison.
+
+Usage: python -m backend.benchmarks.password_hashing [--rounds 8 10 12] [--logins 32]
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+from backend.auth import PasswordHasher, _legacy_hash
+
+
+async def loop_lag(work) -> float:
+    """Longest stretch, in ms, the loop went without running a 1 ms ticker while work ran"""
+    worst, last = 0.0, time.perf_counter()
+
+    async def ticker():
+        nonlocal worst, last
+        while True:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            worst, last = max(worst, now - last), now
+
+    ticking = asyncio.create_task(ticker())
+    await asyncio.sleep(0)
+    await work()
+    ticking.cancel()
+    return worst * 1e3
+
+
+def bench(rounds: int, logins: int, cores: int):
+    hasher = PasswordHasher(rounds=rounds, workers=cores)
+    hashed = hasher.hash("correct horse battery staple")
+
+    start = time.perf_counter()
+    for _ in range(logins):
+        hasher.verify("correct horse battery staple", hashed)
+    serial = logins / (time.perf_counter() - start)
+
+    async def pooled():
+        await asyncio.gather(*(hasher.verify_async("correct horse battery staple", hashed) for _ in range(logins)))
+
+    async def inline():
+        for _ in range(logins // cores or 1):
+            hasher.verify("correct horse battery staple", hashed)
+            await asyncio.sleep(0)
+
+    async def scenario():
+        start = time.perf_counter()
+        pooled_lag = await loop_lag(pooled)
+        elapsed = time.perf_counter() - start
+        return logins / elapsed, pooled_lag, await loop_lag(inline)
+
+    parallel, pooled_lag, inline_lag = asyncio.run(scenario())
+    hasher.shutdown()
+    print(f"rounds {rounds:2d}: {1e3 / serial:7.1f} ms/login, {serial:7.1f} logins/s/core, "
+          f"pool of {cores}: {parallel:7.1f} logins/s ({parallel / cores:6.1f}/core), "
+          f"loop stalled {pooled_lag:6.1f} ms pooled vs {inline_lag:7.1f} ms inline")
+
+
+def bench_legacy(logins: int):
+    start = time.perf_counter()
+    for _ in range(logins):
+        _legacy_hash("correct horse battery staple")
+    per_login = (time.perf_counter() - start) / logins
+    print(f"legacy HMAC: {per_login * 1e6:7.1f} us/login - fast for the server, and for offline guessing")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rounds", type=int, nargs="+", default=[8, 10, 12])
+    parser.add_argument("--logins", type=int, default=32)
+    parser.add_argument("--cores", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    bench_legacy(10000)
+    for rounds in args.rounds:
+        bench(rounds, args.logins, args.cores)
+
+
+if __name__ == "__main__":
+    main()
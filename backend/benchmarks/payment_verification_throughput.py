@@ -0,0 +1,73 @@
+"""
+Payment verification throughput - verifications per second by worker count
+
+Every gateway call takes --latency seconds at the fake gateway, as a real
+gateway round trip would, so throughput should grow with the worker count
+until the database becomes the bottleneck.
+
+Usage: python -m backend.benchmarks.payment_verification_throughput [--jobs 200] [--workers 1 4 16]
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import httpx
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from backend.database import Base, create_async_db_engine
+from backend.http_client import GatewayClient
+from backend.models import User
+from backend.payment_verification import PaymentVerificationQueue, enqueue_verification
+from backend.payments import PaymentGateway, PaymentProcessor
+from backend.testing.fake_gateway import FakeGateway
+from backend.token_cache import AccessTokenCache
+
+
+async def run(workdir: str, jobs: int, workers: int, latency: float) -> float:
+    """Seconds for `workers` workers to verify `jobs` queued payments"""
+    engine = create_async_db_engine(f"sqlite+aiosqlite:///{os.path.join(workdir, f'bench-{workers}.db')}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    fake = FakeGateway()
+    fake.delay = latency
+    processor = PaymentProcessor(GatewayClient(transport=httpx.ASGITransport(app=fake.app)), AccessTokenCache())
+    queue = PaymentVerificationQueue(processor, session_factory, workers=workers, poll_interval=0.05)
+
+    async with session_factory() as db:
+        db.add(User(id=1, username="seeker", email="seeker@example.com", password_hash="x"))
+        await db.commit()
+        for n in range(jobs):
+            await enqueue_verification(db, 1, PaymentGateway.KHALTI, f"txn-{n}", {"token": f"tok-{n}"})
+
+    start = time.perf_counter()
+    await queue.start()
+    while queue.verified < jobs:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    await queue.stop()
+    await processor.client.aclose()
+    await engine.dispose()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    os.environ.update({"KHALTI_API_URL": "http://gateway.test/khalti"})
+    with tempfile.TemporaryDirectory() as workdir:
+        for workers in args.workers:
+            elapsed = asyncio.run(run(workdir, args.jobs, workers, args.latency))
+            print(f"{workers:3d} workers: {elapsed:.2f}s ({args.jobs / elapsed:.0f} verifications/s)")
+
+
+if __name__ == "__main__":
+    main()
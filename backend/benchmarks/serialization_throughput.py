@@ -0,0 +1,114 @@
+"""
+Listing serialization - ORM objects through Pydantic vs row tuples through orjson
+
+Times the queue, notification and message listings end to end from query to
+JSON bytes, against a seeded SQLite file.
+
+Usage: python -m backend.benchmarks.serialization_throughput [--rows 100] [--repeat 300]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from backend.database import Base
+from backend.main import MESSAGE_ROWS, NOTIFICATION_ROWS, QUESTION_ROWS
+from backend.models import Message, MessageType, Notification, NotificationType, Question, User, UserRole
+from backend.schemas import MessageResponse, NotificationResponse, QuestionResponse
+from backend.serialization import dumps
+
+
+async def seed(session_factory, rows: int):
+    async with session_factory() as db:
+        user = User(username="seeker", email="seeker@example.com", full_name="Seeker", password_hash="x")
+        astrologer = User(username="guru", email="guru@example.com", full_name="Guru", password_hash="x",
+                          role=UserRole.ASTROLOGER, is_verified=True)
+        db.add_all([user, astrologer])
+        await db.flush()
+        start = datetime(2024, 1, 1)
+        question = None
+        for i in range(rows):
+            question = Question(user_id=user.id, assigned_to=astrologer.id, category="Love",
+                                title=f"Question number {i}", description="Will we meet again?" * 5,
+                                priority=i % 3, created_at=start + timedelta(minutes=i))
+            db.add(question)
+            db.add(Notification(user_id=user.id, type=NotificationType.FOLLOW_UP, subject=f"Update {i}",
+                                message="Your astrologer replied", created_at=start + timedelta(minutes=i)))
+        await db.flush()
+        db.add_all([
+            Message(question_id=question.id, user_id=astrologer.id, astrologer_id=astrologer.id,
+                    message_type=MessageType.ANSWER, content="The stars align " * 10,
+                    created_at=start + timedelta(minutes=i))
+            for i in range(rows)
+        ])
+        await db.commit()
+        return astrologer.id, user.id, question.id
+
+
+def listings(astrologer_id: int, user_id: int, question_id: int, rows: int):
+    """(name, ORM query, response schema, row serializer, row query) per listing"""
+    return [
+        ("queue", select(Question).where(Question.assigned_to == astrologer_id), QuestionResponse,
+         QUESTION_ROWS, QUESTION_ROWS.select().where(Question.assigned_to == astrologer_id)),
+        ("notifications", select(Notification).where(Notification.user_id == user_id), NotificationResponse,
+         NOTIFICATION_ROWS, NOTIFICATION_ROWS.select().where(Notification.user_id == user_id)),
+        ("messages", select(Message).where(Message.question_id == question_id), MessageResponse,
+         MESSAGE_ROWS, MESSAGE_ROWS.select().where(Message.question_id == question_id)),
+    ]
+
+
+async def orm_path(db, query, schema, limit: int) -> bytes:
+    """The previous behaviour - hydrate ORM objects, validate each into the schema"""
+    items = (await db.scalars(query.limit(limit))).all()
+    return json.dumps([schema.model_validate(item).model_dump(mode="json") for item in items]).encode()
+
+
+async def row_path(db, serializer, query, limit: int) -> bytes:
+    return dumps(serializer.rows((await db.execute(query.limit(limit))).all()))
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as workdir:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}")
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            session_factory = async_sessionmaker(engine, expire_on_commit=False)
+            ids = await seed(session_factory, args.rows)
+
+            for name, orm_query, schema, serializer, row_query in listings(*ids, args.rows):
+                timings = {}
+                for label, page in (
+                    ("orm + pydantic", lambda db: orm_path(db, orm_query, schema, args.rows)),
+                    ("rows + orjson", lambda db: row_path(db, serializer, row_query, args.rows)),
+                ):
+                    start = time.perf_counter()
+                    for _ in range(args.repeat):
+                        # A fresh session per page, as each request gets
+                        async with session_factory() as db:
+                            await page(db)
+                    timings[label] = time.perf_counter() - start
+                for label, seconds in timings.items():
+                    print(f"{name:13} {label:15}: {args.repeat / seconds:7.0f} pages/s "
+                          f"({args.rows} rows per page)")
+                print(f"{name:13} speedup        : {timings['orm + pydantic'] / timings['rows + orjson']:.2f}x")
+        finally:
+            await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=300)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Cross-worker broadcast for WebSocket fan-out and cache invalidation
+
+Configure with BROADCAST_URL:
+    (unset)            in-process delivery, for a single worker
+    redis://host:6379  Redis pub/sub, for several workers or nodes
+    memory://          in-process stand-in for Redis, for tests and development
+"""
+
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict, List, Optional
+
+Handler = Callable[[str, str], Awaitable[None]]
+
+CHANNEL_PREFIX = os.getenv("BROADCAST_CHANNEL_PREFIX", "cosmos:")
+
+
+class InProcessBackend:
+    """Deliver published messages straight to this process's handlers"""
+
+    distributed = False
+
+    async def start(self, deliver: Handler):
+        self._deliver = deliver
+
+    async def publish(self, channel: str, payload: str):
+        await self._deliver(channel, payload)
+
+    async def stop(self):
+        pass
+
+
+class PubSubBackend:
+    """Deliver through a Redis-compatible pub/sub client shared by every worker"""
+
+    distributed = True
+
+    def __init__(self, client):
+        self.client = client
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+
+    async def start(self, deliver: Handler):
+        self._pubsub = self.client.pubsub()
+        await self._pubsub.psubscribe(CHANNEL_PREFIX + "*")
+        self._listener = asyncio.create_task(self._listen(deliver))
+
+    async def _listen(self, deliver: Handler):
+        async for message in self._pubsub.listen():
+            if message.get("type") != "pmessage":
+                continue
+            channel = _text(message["channel"])[len(CHANNEL_PREFIX):]
+            try:
+                await deliver(channel, _text(message["data"]))
+            except Exception as e:
+                print(f"Broadcast handler error on {channel}: {e}")
+
+    async def publish(self, channel: str, payload: str):
+        await self.client.publish(CHANNEL_PREFIX + channel, payload)
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._pubsub:
+            await self._pubsub.punsubscribe()
+            await self._pubsub.close()
+            self._pubsub = None
+
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class LocalPubSubHub:
+    """In-memory stand-in for the subset of redis.asyncio used by PubSubBackend
+
+    Every PubSubBackend built on the same hub behaves like a separate worker
+    connected to one Redis server.
+    """
+
+    def __init__(self):
+        self._subscribers: List["_LocalPubSub"] = []
+
+    def pubsub(self) -> "_LocalPubSub":
+        return _LocalPubSub(self)
+
+    async def publish(self, channel: str, payload: str) -> int:
+        receivers = [sub for sub in self._subscribers if sub.matches(channel)]
+        for sub in receivers:
+            sub.queue.put_nowait({"type": "pmessage", "channel": channel, "data": payload})
+        return len(receivers)
+
+
+class _LocalPubSub:
+    def __init__(self, hub: LocalPubSubHub):
+        self.hub = hub
+        self.patterns: List[str] = []
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    def matches(self, channel: str) -> bool:
+        return any(channel.startswith(pattern.rstrip("*")) for pattern in self.patterns)
+
+    async def psubscribe(self, *patterns: str):
+        self.patterns.extend(patterns)
+        if self not in self.hub._subscribers:
+            self.hub._subscribers.append(self)
+
+    async def punsubscribe(self, *patterns: str):
+        self.patterns = [p for p in self.patterns if patterns and p not in patterns]
+        if not self.patterns and self in self.hub._subscribers:
+            self.hub._subscribers.remove(self)
+
+    async def listen(self):
+        while True:
+            yield await self.queue.get()
+
+    async def close(self):
+        await self.punsubscribe()
+
+
+_local_hub = LocalPubSubHub()
+
+
+def create_backend(url: Optional[str] = None):
+    """Build the backend named by BROADCAST_URL"""
+    url = url if url is not None else os.getenv("BROADCAST_URL", "")
+    if not url:
+        return InProcessBackend()
+    if url.startswith("memory://"):
+        return PubSubBackend(_local_hub)
+    if url.startswith(("redis://", "rediss://")):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("BROADCAST_URL uses Redis but the 'redis' package is not installed")
+        return PubSubBackend(redis.from_url(url))
+    raise ValueError(f"Unsupported BROADCAST_URL '{url}'")
+
+
+class Broadcaster:
+    """Route published messages to handlers subscribed by channel prefix"""
+
+    def __init__(self, backend=None):
+        self.backend = backend or create_backend()
+        self._handlers: Dict[str, Handler] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._started = False
+
+    @property
+    def distributed(self) -> bool:
+        return self.backend.distributed
+
+    def subscribe(self, prefix: str, handler: Handler):
+        """Call handler(channel, payload) for every channel starting with prefix"""
+        self._handlers[prefix] = handler
+
+    async def start(self):
+        if self._started:
+            return
+        self._loop = asyncio.get_running_loop()
+        await self.backend.start(self._deliver)
+        self._started = True
+
+    async def stop(self):
+        if self._started:
+            await self.backend.stop()
+            self._started = False
+
+    async def publish(self, channel: str, payload: str):
+        if not self._started:
+            await self.start()
+        await self.backend.publish(channel, payload)
+
+    def publish_threadsafe(self, channel: str, payload: str):
+        """Publish from synchronous code on any thread without waiting"""
+        loop = self._loop
+        if loop is None or loop.is_closed() or not self._started:
+            return
+        if _running_loop() is loop:
+            loop.create_task(self.publish(channel, payload))
+        else:
+            asyncio.run_coroutine_threadsafe(self.publish(channel, payload), loop)
+
+    async def _deliver(self, channel: str, payload: str):
+        for prefix, handler in self._handlers.items():
+            if channel.startswith(prefix):
+                await handler(channel, payload)
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+# Global broadcaster instance
+broadcaster = Broadcaster()
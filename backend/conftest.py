@@ -0,0 +1,115 @@
+"""
+Shared pytest fixtures - every test runs against its own SQLite file
+"""
+
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from backend.database import (
+    Base, create_db_engine, create_async_db_engine, get_async_database_url,
+    get_db, get_async_db
+)
+from backend.models import User, UserRole
+from backend.auth import get_password_hash, get_tokens, password_hasher, token_revocations, verified_tokens
+from backend.assignment import assignment_engine
+from backend.principal_cache import principal_cache
+import backend.search  # noqa: F401 - installs the full-text index alongside create_all
+from backend.specializations import directory_cache
+from backend.http_cache import response_cache
+from backend.unread import unread_counter
+from backend.rate_limit import rate_limiter
+from backend.message_sink import message_sink
+
+# bcrypt's minimum cost - fixture users are created by the hundred
+password_hasher.rounds = 4
+
+
+@pytest.fixture
+def database(tmp_path):
+    """Sync and async session factories bound to a throwaway database"""
+    url = f"sqlite:///{tmp_path / 'test.db'}"
+    sync_engine = create_db_engine(url)
+    async_engine = create_async_db_engine(get_async_database_url(url))
+    Base.metadata.create_all(bind=sync_engine)
+    # In-memory indexes must not carry ids over from another test's database
+    assignment_engine.reset()
+    principal_cache.clear()
+    directory_cache.clear()
+    response_cache.clear()
+    unread_counter.clear()
+    verified_tokens.clear()
+    token_revocations.clear()
+    rate_limiter.reset()
+
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=sync_engine)
+    async_session_factory = async_sessionmaker(
+        bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+    )
+    yield session_factory, async_session_factory
+
+    sync_engine.dispose()
+    # Closing aiosqlite connections needs the event loop, otherwise their worker threads keep pytest alive
+    asyncio.run(async_engine.dispose())
+
+
+@pytest.fixture
+def client(database):
+    """TestClient with the database dependencies pointed at the test database"""
+    from backend.main import app
+
+    session_factory, async_session_factory = database
+
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def override_get_async_db():
+        async with async_session_factory() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def make_user(database):
+    """Create a user and return (id, auth headers)"""
+    session_factory, _ = database
+
+    def _make_user(username, role=UserRole.USER, **fields):
+        db = session_factory()
+        try:
+            user = User(
+                username=username,
+                email=f"{username}@example.com",
+                password_hash=get_password_hash("password123"),
+                full_name=username.title(),
+                role=role,
+                is_active=True,
+                **fields
+            )
+            db.add(user)
+            db.commit()
+            tokens = get_tokens(user.id, user.username, user.role.value)
+            return user.id, {"Authorization": f"Bearer {tokens.access_token}"}
+        finally:
+            db.close()
+
+    return _make_user
+
+
+@pytest.fixture
+def test_sink(database, monkeypatch):
+    """The global message sink writing to the test database"""
+    _, async_session_factory = database
+    monkeypatch.setattr(message_sink, "session_factory", async_session_factory)
+    return message_sink
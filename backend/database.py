@@ -4,38 +4,195 @@ Database configuration and session management
 
 import os
 from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool, StaticPool
 
 # Database URL - use SQLite for simplicity, easily switchable to PostgreSQL
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./astrology_consultation.db")
 
-# Create engine with proper configuration
-if "sqlite" in DATABASE_URL:
-    # For SQLite, we need special configuration
-    engine = create_engine(
-        DATABASE_URL,
-        connect_args={"check_same_thread": False},
-        poolclass=StaticPool,
-        echo=os.getenv("SQL_ECHO", "False").lower() == "true"
+SQL_ECHO = os.getenv("SQL_ECHO", "False").lower() == "true"
+
+
+def get_async_database_url(url: str) -> str:
+    """Map a synchronous database URL onto its asyncio driver"""
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    if url.startswith("postgres://"):
+        return "postgresql+asyncpg://" + url[len("postgres://"):]
+    if url.startswith("postgresql://") or url.startswith("postgresql+psycopg2://"):
+        return "postgresql+asyncpg://" + url.split("://", 1)[1]
+    if "+aiosqlite" in url or "+asyncpg" in url:
+        return url
+    raise ValueError(
+        f"No asyncio driver is known for DATABASE_URL '{url.split('://', 1)[0]}://...'; "
+        "set ASYNC_DATABASE_URL to an async URL for this database"
     )
-    
-    # Enable foreign keys for SQLite
-    @event.listens_for(engine, "connect")
+
+
+# Async URL - derived from DATABASE_URL unless explicitly configured
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or get_async_database_url(DATABASE_URL)
+
+
+def _is_memory_sqlite(url: str) -> bool:
+    return ":memory:" in url or url.rstrip("/").endswith("sqlite:") or url.endswith(":///")
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes", "on")
+
+
+# Connection pool profiles - pick one with DB_POOL_PROFILE, then override
+# individual settings with DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+# DB_POOL_RECYCLE, DB_POOL_PRE_PING and DB_STATEMENT_TIMEOUT_MS
+POOL_PROFILES = {
+    "small": {
+        "pool_size": 2,
+        "max_overflow": 3,
+        "pool_timeout": 10,
+        "pool_recycle": 1800,
+        "pool_pre_ping": True,
+        "statement_timeout_ms": 15000,
+    },
+    "default": {
+        "pool_size": 5,
+        "max_overflow": 10,
+        "pool_timeout": 30,
+        "pool_recycle": 1800,
+        "pool_pre_ping": True,
+        "statement_timeout_ms": 30000,
+    },
+    "high_concurrency": {
+        "pool_size": 20,
+        "max_overflow": 40,
+        "pool_timeout": 5,
+        "pool_recycle": 900,
+        "pool_pre_ping": True,
+        "statement_timeout_ms": 10000,
+    },
+}
+
+# SQLite profile - applied with PRAGMAs on every new connection
+SQLITE_PROFILE = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+    "busy_timeout_ms": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000)),
+}
+
+
+def get_pool_profile(name: str = None) -> dict:
+    """Resolve the active pool profile with environment overrides applied"""
+    name = name or os.getenv("DB_POOL_PROFILE", "default")
+    if name not in POOL_PROFILES:
+        raise ValueError(f"Unknown DB_POOL_PROFILE '{name}', expected one of {sorted(POOL_PROFILES)}")
+
+    profile = dict(POOL_PROFILES[name])
+    for key, env_name in (
+        ("pool_size", "DB_POOL_SIZE"),
+        ("max_overflow", "DB_MAX_OVERFLOW"),
+        ("pool_timeout", "DB_POOL_TIMEOUT"),
+        ("pool_recycle", "DB_POOL_RECYCLE"),
+        ("statement_timeout_ms", "DB_STATEMENT_TIMEOUT_MS"),
+    ):
+        if os.getenv(env_name):
+            profile[key] = int(os.getenv(env_name))
+    profile["pool_pre_ping"] = _env_flag("DB_POOL_PRE_PING", profile["pool_pre_ping"])
+    return profile
+
+
+def _pool_options(profile: dict) -> dict:
+    """Keyword arguments for create_engine from a pool profile"""
+    return {
+        "pool_size": profile["pool_size"],
+        "max_overflow": profile["max_overflow"],
+        "pool_timeout": profile["pool_timeout"],
+        "pool_recycle": profile["pool_recycle"],
+        "pool_pre_ping": profile["pool_pre_ping"],
+    }
+
+
+def _sqlite_pragma_listener(memory: bool):
+    """Build the connect listener applying the SQLite profile"""
     def set_sqlite_pragma(dbapi_conn, connection_record):
         cursor = dbapi_conn.cursor()
         cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_PROFILE['busy_timeout_ms']}")
+        if not memory:
+            # WAL lets readers proceed while a single writer commits
+            cursor.execute(f"PRAGMA journal_mode={SQLITE_PROFILE['journal_mode']}")
+            cursor.execute(f"PRAGMA synchronous={SQLITE_PROFILE['synchronous']}")
+            cursor.execute(f"PRAGMA mmap_size={SQLITE_PROFILE['mmap_size']}")
         cursor.close()
-else:
+    return set_sqlite_pragma
+
+
+def _statement_timeout_listener(timeout_ms: int):
+    """Build the connect listener applying a server-side statement timeout"""
+    def set_statement_timeout(dbapi_conn, connection_record):
+        cursor = dbapi_conn.cursor()
+        cursor.execute(f"SET statement_timeout = {int(timeout_ms)}")
+        cursor.close()
+    return set_statement_timeout
+
+
+def _configure_engine(sync_engine, url: str, profile: dict):
+    """Attach per-connection setup for the database dialect"""
+    if "sqlite" in url:
+        event.listen(sync_engine, "connect", _sqlite_pragma_listener(_is_memory_sqlite(url)))
+    elif url.startswith("postgres") and profile["statement_timeout_ms"]:
+        event.listen(sync_engine, "connect", _statement_timeout_listener(profile["statement_timeout_ms"]))
+
+
+def create_db_engine(url: str, profile: dict = None):
+    """Create the synchronous engine used by sync sessions and init_db"""
+    profile = profile or get_pool_profile()
+
+    if "sqlite" in url:
+        # For SQLite, we need special configuration
+        options = {"connect_args": {"check_same_thread": False}, "echo": SQL_ECHO}
+        if _is_memory_sqlite(url):
+            # An in-memory database only exists on a single connection
+            options["poolclass"] = StaticPool
+        else:
+            options["poolclass"] = QueuePool
+            options.update(_pool_options(profile))
+        sqlite_engine = create_engine(url, **options)
+        _configure_engine(sqlite_engine, url, profile)
+        return sqlite_engine
+
     # PostgreSQL or other database
-    engine = create_engine(
-        DATABASE_URL,
-        echo=os.getenv("SQL_ECHO", "False").lower() == "true",
-        pool_pre_ping=True
-    )
+    db_engine = create_engine(url, echo=SQL_ECHO, **_pool_options(profile))
+    _configure_engine(db_engine, url, profile)
+    return db_engine
+
+
+def create_async_db_engine(url: str, profile: dict = None):
+    """Create the asyncio engine used by AsyncSession endpoints"""
+    profile = profile or get_pool_profile()
+
+    options = {"echo": SQL_ECHO}
+    if "sqlite" in url and _is_memory_sqlite(url):
+        options["poolclass"] = StaticPool
+    else:
+        # aiosqlite would otherwise default to NullPool and reconnect per checkout
+        options["poolclass"] = AsyncAdaptedQueuePool
+        options.update(_pool_options(profile))
+    db_engine = create_async_engine(url, **options)
+    _configure_engine(db_engine.sync_engine, url, profile)
+    return db_engine
+
 
-# Session factory
+# Create engines with proper configuration
+engine = create_db_engine(DATABASE_URL)
+async_engine = create_async_db_engine(ASYNC_DATABASE_URL)
+
+# Session factories
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Objects stay readable after commit so responses can be built without a lazy refresh
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
 
 # Base class for all models
 Base = declarative_base()
@@ -50,6 +207,12 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    """Dependency for getting an asyncio database session"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 def init_db():
     """Initialize database - create all tables"""
     Base.metadata.create_all(bind=engine)
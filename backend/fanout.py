@@ -0,0 +1,93 @@
+"""
+Fan-out of public questions to every matching astrologer
+"""
+
+import os
+from datetime import datetime
+
+from sqlalchemy import insert, select
+
+from backend.database import AsyncSessionLocal
+from backend.models import Notification, NotificationType, User, UserRole
+from backend.specializations import specialization_tags, with_any_tag
+from backend.unread import unread_counter
+from backend.websocket_manager import ConnectionManager, manager as default_manager
+
+FANOUT_CHUNK_SIZE = int(os.getenv("FANOUT_CHUNK_SIZE", 500))
+
+
+def matching_astrologers(category: str):
+    """Verified, active astrologers tagged with any word of the category"""
+    query = select(User.id).where(
+        User.role == UserRole.ASTROLOGER,
+        User.is_verified == True,
+        User.is_active == True
+    )
+    tags = specialization_tags(category)
+    return query.where(with_any_tag(tags)) if tags else query
+
+
+async def fan_out_public_question(
+    question_id: int,
+    category: str,
+    title: str,
+    session_factory=None,
+    connection_manager: ConnectionManager = None,
+    chunk_size: int = FANOUT_CHUNK_SIZE
+) -> int:
+    """Notify matching astrologers about a new public question
+
+    Astrologer ids are streamed in id order one chunk at a time, so memory
+    stays flat however many astrologers match. Each chunk is one bulk insert
+    and one commit, followed by the real-time pushes. Returns the number of
+    astrologers notified.
+    """
+    session_factory = session_factory or AsyncSessionLocal
+    connection_manager = connection_manager or default_manager
+    query = matching_astrologers(category).order_by(User.id).limit(chunk_size)
+    now = datetime.utcnow()
+    alert = {
+        "type": "new_public_question",
+        "question_id": question_id,
+        "category": category,
+        "title": title
+    }
+
+    notified = 0
+    last_id = 0
+    while True:
+        async with session_factory() as db:
+            astrologer_ids = (await db.scalars(query.where(User.id > last_id))).all()
+            if not astrologer_ids:
+                break
+            await db.execute(insert(Notification), [
+                {
+                    "user_id": astrologer_id,
+                    "type": NotificationType.QUESTION_RECEIVED,
+                    "subject": f"New Public Question: {category}",
+                    "message": title,
+                    "related_question_id": question_id,
+                    "is_read": False,
+                    "created_at": now
+                }
+                for astrologer_id in astrologer_ids
+            ])
+            await db.commit()
+
+            # Another worker may hold the socket when broadcasting is distributed
+            online = [
+                astrologer_id for astrologer_id in astrologer_ids
+                if connection_manager.broadcaster.distributed
+                or connection_manager.get_user_active_questions(astrologer_id)
+            ]
+            counts = await unread_counter.get_many(db, online) if online else {}
+
+        for astrologer_id in online:
+            await connection_manager.send_to_user(astrologer_id, dict(alert, unread_count=counts[astrologer_id]))
+
+        notified += len(astrologer_ids)
+        last_id = astrologer_ids[-1]
+        if len(astrologer_ids) < chunk_size:
+            break
+
+    return notified
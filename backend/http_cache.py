@@ -0,0 +1,289 @@
+"""
+HTTP caching for public read endpoints and the static pages
+
+ResponseCacheMiddleware keeps whole responses of matching anonymous GET
+requests for a per-route TTL and answers If-None-Match with 304. Every
+cached response carries a strong ETag (a hash of its body). Entries are
+grouped by tag ("astrologers", "user:<id>") and committed writes to the rows
+behind them invalidate those tags, here and on other workers through the
+broadcaster.
+
+StaticAsset serves a file from memory, precompressed with gzip and, when the
+brotli package is installed, brotli.
+"""
+
+import gzip
+import hashlib
+import os
+import re
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from backend.broadcast import broadcaster
+from backend.cache import TTLCache
+from backend.models import User, UserRole
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+HTTP_CACHE_SIZE = int(os.getenv("HTTP_CACHE_SIZE", 4096))
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", 300))
+
+
+def make_etag(body: bytes, suffix: str = "") -> str:
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}{suffix}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """RFC 7232 weak comparison, as If-None-Match requires"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+class CacheRule:
+    """Cache GET responses for paths matching pattern, tagged for invalidation"""
+
+    def __init__(self, pattern: str, ttl: float, tags: Callable[[re.Match], Iterable[str]]):
+        self.pattern = re.compile(pattern)
+        self.ttl = ttl
+        self.tags = tags
+
+
+class ResponseCache:
+    """Response store with tag-based invalidation"""
+
+    def __init__(self, rules: List[CacheRule], maxsize: int = HTTP_CACHE_SIZE):
+        self.rules = rules
+        self._entries = TTLCache(maxsize=maxsize)
+        self._keys_by_tag: Dict[str, Set[tuple]] = {}
+        # Bumped on invalidation so a response computed before a write is not stored after it
+        self._generations: Dict[str, int] = {}
+
+    def match(self, path: str) -> Optional[Tuple[CacheRule, List[str]]]:
+        for rule in self.rules:
+            found = rule.pattern.match(path)
+            if found:
+                return rule, list(rule.tags(found))
+        return None
+
+    def get(self, key: tuple):
+        return self._entries.get(key)
+
+    def generation(self, tags: List[str]) -> tuple:
+        return tuple(self._generations.get(tag, 0) for tag in tags)
+
+    def put(self, key: tuple, entry: tuple, rule: CacheRule, tags: List[str], generation: tuple):
+        if self.generation(tags) != generation:
+            return
+        self._entries.set(key, entry, ttl=rule.ttl)
+        for tag in tags:
+            keys = self._keys_by_tag.setdefault(tag, set())
+            if len(keys) > self._entries.maxsize:
+                keys.clear()
+            keys.add(key)
+
+    def invalidate(self, tags: Iterable[str]):
+        for tag in tags:
+            self._generations[tag] = self._generations.get(tag, 0) + 1
+            for key in self._keys_by_tag.pop(tag, ()):
+                self._entries.invalidate(key)
+
+    def clear(self):
+        self._entries.clear()
+        self._keys_by_tag.clear()
+
+    def stats(self) -> dict:
+        return self._entries.stats()
+
+
+class ResponseCacheMiddleware:
+    """ASGI middleware serving ResponseCache hits and filling it on misses"""
+
+    def __init__(self, app, cache: "ResponseCache"):
+        self.app = app
+        self.cache = cache
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            return await self.app(scope, receive, send)
+
+        matched = self.cache.match(scope["path"])
+        headers = dict(scope["headers"])
+        # Authenticated requests may be personalised - never share them
+        if matched is None or b"authorization" in headers:
+            return await self.app(scope, receive, send)
+
+        rule, tags = matched
+        if_none_match = headers.get(b"if-none-match", b"").decode("latin-1")
+        key = (scope["path"], scope["query_string"])
+        entry = self.cache.get(key)
+        if entry is not None:
+            return await self._send(send, scope, entry, if_none_match)
+
+        generation = self.cache.generation(tags)
+        start, chunks = None, []
+
+        async def capture(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive, capture)
+        body = b"".join(chunks)
+        response_headers = [(k, v) for k, v in start["headers"] if k.lower() != b"content-length"]
+        entry = (start["status"], response_headers, body, make_etag(body), rule.ttl)
+        if start["status"] == 200:
+            self.cache.put(key, entry, rule, tags, generation)
+        await self._send(send, scope, entry, if_none_match)
+
+    @staticmethod
+    async def _send(send, scope, entry: tuple, if_none_match: str):
+        status, headers, body, etag, ttl = entry
+        extra = [(b"etag", etag.encode())]
+        if status == 200:
+            extra.append((b"cache-control", f"public, max-age={int(ttl)}".encode()))
+        if status == 200 and etag_matches(if_none_match, etag):
+            status, body = 304, b""
+            headers = [(k, v) for k, v in headers if k.lower() != b"content-type"]
+        if status != 304:
+            extra.append((b"content-length", str(len(body)).encode()))
+        await send({"type": "http.response.start", "status": status, "headers": headers + extra})
+        await send({"type": "http.response.body", "body": b"" if scope["method"] == "HEAD" else body})
+
+
+# ---- Invalidation from committed writes ----
+
+def mark_changed(session: Optional[Session], *tags: str):
+    """Invalidate the tagged responses once session commits"""
+    if session is not None:
+        session.info.setdefault("http_cache_tags", set()).update(tags)
+
+
+def user_tags(user_id: int, astrologer: bool) -> List[str]:
+    return [f"user:{user_id}", "astrologers"] if astrologer else [f"user:{user_id}"]
+
+
+@event.listens_for(User, "after_insert")
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _user_changed(mapper, connection, target):
+    history = inspect(target).attrs.role.history
+    was_astrologer = UserRole.ASTROLOGER in (history.deleted or ())
+    astrologer = target.role == UserRole.ASTROLOGER or was_astrologer
+    mark_changed(Session.object_session(target), *user_tags(target.id, astrologer))
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _bulk_user_writes(orm_execute_state):
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) and \
+            orm_execute_state.bind_mapper is inspect(User):
+        orm_execute_state.session.info["http_cache_clear"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    if session.info.pop("http_cache_clear", False):
+        session.info.pop("http_cache_tags", None)
+        response_cache.clear()
+        if broadcaster.distributed:
+            broadcaster.publish_threadsafe("httpcache:clear", "")
+        return
+
+    tags = session.info.pop("http_cache_tags", None)
+    if tags:
+        response_cache.invalidate(tags)
+        if broadcaster.distributed:
+            broadcaster.publish_threadsafe("httpcache:invalidate", ",".join(sorted(tags)))
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_after_rollback(session):
+    session.info.pop("http_cache_tags", None)
+    session.info.pop("http_cache_clear", None)
+
+
+async def _on_cache_broadcast(channel: str, payload: str):
+    if channel == "httpcache:clear":
+        response_cache.clear()
+    else:
+        response_cache.invalidate(payload.split(","))
+
+
+broadcaster.subscribe("httpcache:", _on_cache_broadcast)
+
+
+# ---- Precompressed static files ----
+
+class StaticAsset:
+    """A file held in memory in identity, gzip and brotli form, reloaded when it changes"""
+
+    def __init__(self, path: str, media_type: str, max_age: int = STATIC_MAX_AGE):
+        self.path = path
+        self.media_type = media_type
+        self.max_age = max_age
+        self._mtime = None
+        self._variants: Dict[str, Tuple[bytes, str]] = {}
+
+    def _load(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self._mtime:
+            return
+        with open(self.path, "rb") as f:
+            body = f.read()
+        variants = {"identity": (body, make_etag(body))}
+        variants["gzip"] = (gzip.compress(body, compresslevel=9, mtime=0), make_etag(body, "-gz"))
+        if brotli is not None:
+            variants["br"] = (brotli.compress(body, quality=11), make_etag(body, "-br"))
+        self._variants = variants
+        self._mtime = mtime
+
+    def _encoding_for(self, accept_encoding: str) -> str:
+        accepted = {part.split(";")[0].strip() for part in accept_encoding.lower().split(",")}
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self._variants:
+                return encoding
+        return "identity"
+
+    def response(self, request: Request) -> Response:
+        self._load()
+        encoding = self._encoding_for(request.headers.get("accept-encoding", ""))
+        body, etag = self._variants[encoding]
+        headers = {
+            "ETag": etag,
+            "Cache-Control": f"public, max-age={self.max_age}",
+            "Vary": "Accept-Encoding"
+        }
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type=self.media_type, headers=headers)
+
+
+# Public read endpoints and how long their responses may be reused
+CACHE_RULES = [
+    CacheRule(r"^/api/astrologers$", float(os.getenv("HTTP_CACHE_ASTROLOGERS_TTL", 30)),
+              lambda match: ["astrologers"]),
+    CacheRule(r"^/api/users/(\d+)$", float(os.getenv("HTTP_CACHE_USER_TTL", 60)),
+              lambda match: [f"user:{match.group(1)}"]),
+]
+
+# Global response cache instance
+response_cache = ResponseCache(CACHE_RULES)
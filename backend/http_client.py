@@ -0,0 +1,231 @@
+"""
+Shared async HTTP client for payment gateway calls
+
+One httpx.AsyncClient per process keeps connections to each gateway alive,
+so a payment call reuses an open TLS session instead of paying for a new
+handshake. Every gateway has its own policy:
+
+    timeouts       PAYMENT_TIMEOUT_<GATEWAY> seconds, e.g. PAYMENT_TIMEOUT_PAYPAL=15
+    circuit        after PAYMENT_BREAKER_FAILURES failures in a row calls fail
+                   fast with GatewayUnavailable for PAYMENT_BREAKER_RESET seconds,
+                   then one trial call decides whether the gateway is back
+    retry budget   retries may add at most PAYMENT_RETRY_RATIO of the recent
+                   request volume, so retries cannot multiply load on a gateway
+                   that is already struggling
+
+Only calls marked retry=True are retried after a response or timeout; a
+failed connect never reached the gateway and is always safe to retry.
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Dict, Optional
+
+import httpx
+
+from backend.metrics import registry as metrics_registry
+
+# Seconds allowed for the whole call, per gateway
+DEFAULT_TIMEOUTS = {
+    "paypal": 15.0,
+    "khalti": 10.0,
+    "esewa": 10.0,
+    "stripe": 20.0,
+}
+DEFAULT_TIMEOUT = float(os.getenv("PAYMENT_TIMEOUT", 10))
+CONNECT_TIMEOUT = float(os.getenv("PAYMENT_CONNECT_TIMEOUT", 3))
+
+BREAKER_FAILURES = int(os.getenv("PAYMENT_BREAKER_FAILURES", 5))
+BREAKER_RESET = float(os.getenv("PAYMENT_BREAKER_RESET", 30))
+RETRY_RATIO = float(os.getenv("PAYMENT_RETRY_RATIO", 0.2))
+RETRY_MIN_PER_SECOND = float(os.getenv("PAYMENT_RETRY_MIN_PER_SECOND", 1))
+MAX_RETRIES = int(os.getenv("PAYMENT_MAX_RETRIES", 2))
+RETRY_BACKOFF = float(os.getenv("PAYMENT_RETRY_BACKOFF", 0.2))
+
+MAX_CONNECTIONS = int(os.getenv("PAYMENT_MAX_CONNECTIONS", 100))
+MAX_KEEPALIVE = int(os.getenv("PAYMENT_MAX_KEEPALIVE", 20))
+KEEPALIVE_EXPIRY = float(os.getenv("PAYMENT_KEEPALIVE_EXPIRY", 60))
+
+gateway_requests = metrics_registry.counter(
+    "payment_gateway_requests_total", "Payment gateway calls by outcome", ("gateway", "outcome")
+)
+
+
+class GatewayUnavailable(Exception):
+    """The gateway's circuit is open, or it could not be reached"""
+
+
+class CircuitBreaker:
+    """Closed -> open after `failures` consecutive failures -> half-open after `reset_timeout`"""
+
+    def __init__(self, failures: int = BREAKER_FAILURES, reset_timeout: float = BREAKER_RESET):
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """May a call go out now? In half-open state only one trial call is let through"""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._consecutive = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive += 1
+            if self.state == "half_open" or self._consecutive >= self.failures:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+class RetryBudget:
+    """Tokens earned by requests (ratio each) and by time (min_per_second), spent by retries"""
+
+    def __init__(self, ratio: float = RETRY_RATIO, min_per_second: float = RETRY_MIN_PER_SECOND,
+                 capacity: float = 10):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.min_per_second)
+        self._updated_at = now
+
+    def deposit(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.capacity, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class GatewayPolicy:
+    """Timeouts, breaker and retry budget of one gateway"""
+
+    def __init__(self, timeout: float, max_retries: int = MAX_RETRIES, breaker: CircuitBreaker = None,
+                 budget: RetryBudget = None):
+        self.timeout = httpx.Timeout(timeout, connect=min(CONNECT_TIMEOUT, timeout))
+        # httpx times each connect/read/write on its own; this bounds the whole call
+        self.deadline = timeout
+        self.max_retries = max_retries
+        self.breaker = breaker or CircuitBreaker()
+        self.budget = budget or RetryBudget()
+
+    @classmethod
+    def for_gateway(cls, gateway: str) -> "GatewayPolicy":
+        default = DEFAULT_TIMEOUTS.get(gateway, DEFAULT_TIMEOUT)
+        return cls(float(os.getenv(f"PAYMENT_TIMEOUT_{gateway.upper()}", default)))
+
+
+class GatewayClient:
+    """Pooled HTTP client with a policy per gateway"""
+
+    def __init__(self, transport: Optional[httpx.AsyncBaseTransport] = None,
+                 policies: Dict[str, GatewayPolicy] = None, backoff: float = RETRY_BACKOFF):
+        self.transport = transport
+        self.policies = dict(policies or {})
+        self.backoff = backoff
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Created on first use, inside the event loop that will drive it
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                transport=self.transport,
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_KEEPALIVE,
+                    keepalive_expiry=KEEPALIVE_EXPIRY
+                )
+            )
+        return self._client
+
+    def policy(self, gateway: str) -> GatewayPolicy:
+        policy = self.policies.get(gateway)
+        if policy is None:
+            policy = self.policies[gateway] = GatewayPolicy.for_gateway(gateway)
+        return policy
+
+    async def request(self, gateway: str, method: str, url: str, retry: bool = False,
+                      **kwargs) -> httpx.Response:
+        """Send one gateway call under its policy
+
+        5xx and 429 responses are returned once retries are exhausted; other
+        responses are returned as they are. Raises GatewayUnavailable when the
+        circuit is open or the gateway could not be reached.
+        """
+        policy = self.policy(gateway)
+        if not policy.breaker.allow():
+            gateway_requests.inc(gateway, "rejected")
+            raise GatewayUnavailable(f"{gateway} is unavailable, try again shortly")
+        policy.budget.deposit()
+
+        attempt = 0
+        while True:
+            try:
+                response = await asyncio.wait_for(
+                    self.client.request(method, url, timeout=policy.timeout, **kwargs), policy.deadline
+                )
+            except (httpx.TransportError, asyncio.TimeoutError) as e:
+                failure, retryable = e, retry or isinstance(e, httpx.ConnectError)
+            else:
+                if response.status_code < 500 and response.status_code != 429:
+                    policy.breaker.record_success()
+                    gateway_requests.inc(gateway, "ok")
+                    return response
+                failure, retryable = response, retry
+
+            policy.breaker.record_failure()
+            if not retryable or attempt >= policy.max_retries or not policy.budget.withdraw() \
+                    or not policy.breaker.allow():
+                gateway_requests.inc(gateway, "error")
+                if isinstance(failure, httpx.Response):
+                    return failure
+                raise GatewayUnavailable(f"{gateway} could not be reached: {failure!r}") from failure
+
+            gateway_requests.inc(gateway, "retried")
+            # Full jitter, so retries from many requests do not arrive together
+            await asyncio.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+            attempt += 1
+
+    async def post(self, gateway: str, url: str, **kwargs) -> httpx.Response:
+        return await self.request(gateway, "POST", url, **kwargs)
+
+    async def get(self, gateway: str, url: str, **kwargs) -> httpx.Response:
+        return await self.request(gateway, "GET", url, retry=True, **kwargs)
+
+    def stats(self) -> dict:
+        return {gateway: policy.breaker.state for gateway, policy in self.policies.items()}
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+# Global gateway client instance
+gateway_client = GatewayClient()
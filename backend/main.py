@@ -3,22 +3,59 @@ Main FastAPI application - Astrology Consultation Platform Backend
 """
 
 import os
-from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect, status
+import json
+import asyncio
+from urllib.parse import parse_qs
+from typing import Optional
+from fastapi import FastAPI, BackgroundTasks, Depends, Header, HTTPException, Query, Request, WebSocket, WebSocketDisconnect, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import JSONResponse, Response
+from pydantic import ValidationError
+from sqlalchemy import exists, func, or_, select, update
+from sqlalchemy.exc import IntegrityError, TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.orm.attributes import set_committed_value
 from datetime import datetime, timedelta
 
-from backend.database import Base, engine, get_db, init_db
-from backend.models import User, Question, Message, Notification, UserRole, QuestionStatus, MessageType, NotificationType
-from backend.auth import get_password_hash, verify_password, verify_token, get_tokens
+from backend.database import Base, engine, async_engine, get_db, get_async_db, init_db
+from backend.models import (
+    User, Question, Message, Notification, Rating, Consultation, PaymentVerification, UserRole, QuestionStatus,
+    MessageType, NotificationType
+)
+from backend.auth import (
+    TokenData, verify_token, get_tokens, revoke_token, revoke_user, rotate_refresh_token, decode_token,
+    password_hasher, token_revocations, verified_tokens
+)
 from backend.schemas import (
     UserRegister, UserLogin, UserResponse, QuestionCreate, QuestionResponse, 
     QuestionDetailResponse, MessageCreate, MessageResponse, NotificationResponse,
-    AstrologerResponse, ConsultationResponse, RatingResponse
+    AstrologerResponse, ConsultationResponse, RatingCreate, RatingResponse, NotificationReadRequest,
+    TokenRefresh, LogoutRequest, PaymentVerificationRequest, PaymentVerificationResponse, WalletAdjustment,
+    WalletEntryResponse, WalletResponse
 )
 from backend.websocket_manager import manager
+from backend.principal_cache import principal_cache
+from backend.pagination import decode_cursor, keyset_after, keyset_order, page_cursor
+from backend.message_sink import message_sink
+from backend.notifications import notification_service
+from backend.fanout import fan_out_public_question
+from backend.assignment import assignment_engine
+from backend.ratings import reconcile_aggregates
+from backend.search import search
+from backend.specializations import directory_cache, specialization_tags, with_all_tags
+from backend.http_cache import ResponseCacheMiddleware, StaticAsset, response_cache
+from backend.serialization import ORJSONResponse, RowSerializer, json_response
+from backend.unread import mark_unread_changed, push_unread_counts, unread_counter
+from backend.metrics import MetricsMiddleware, instrument_engine, pool_checked_out, registry as metrics_registry
+from backend.rate_limit import AdmissionControlMiddleware, limit_by_ip, rate_limiter
+from backend.http_client import gateway_client
+from backend.payments import PaymentGateway
+from backend import wallet
+from backend.payment_verification import (
+    PaymentStateError, enqueue_verification, verification_queue, webhook_authorized
+)
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -27,6 +64,9 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Cache public reads - added before CORS so CORS headers are never stored
+app.add_middleware(ResponseCacheMiddleware, cache=response_cache)
+
 # Configure CORS
 origins = [
     "http://localhost",
@@ -44,6 +84,42 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Shed load while every database connection is busy rather than queueing for pool_timeout
+app.add_middleware(AdmissionControlMiddleware, engines=(engine, async_engine))
+
+# Outermost, so cached responses, shed requests and CORS preflights are timed too
+app.add_middleware(MetricsMiddleware)
+
+# Count and time every statement against the request that ran it
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+
+metrics_registry.gauge(
+    "websocket_connections", "Open WebSocket connections on this worker",
+    lambda: manager.get_connection_count()["total_connections"]
+)
+metrics_registry.gauge(
+    "websocket_active_users", "Users with at least one open WebSocket on this worker",
+    lambda: manager.get_connection_count()["active_users"]
+)
+metrics_registry.gauge(
+    "websocket_queued_messages", "Frames waiting in WebSocket send queues",
+    lambda: manager.get_connection_count()["queued_messages"]
+)
+metrics_registry.gauge(
+    "notification_queue_depth", "Notification rows and emails waiting to be processed",
+    lambda: {
+        ("rows",): notification_service.dispatcher.stats()["queued_rows"],
+        ("emails",): notification_service.dispatcher.stats()["queued_emails"]
+    },
+    labelnames=("queue",)
+)
+metrics_registry.gauge(
+    "db_pool_checked_out", "Database connections currently checked out",
+    lambda: {("sync",): pool_checked_out(engine), ("async",): pool_checked_out(async_engine)},
+    labelnames=("engine",)
+)
+
 # Security - Simple Bearer token authentication
 
 
@@ -55,12 +131,35 @@ async def startup_event():
     print("Initializing database...")
     init_db()
     print("Database ready!")
+    await manager.start()
+    await verification_queue.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background listeners"""
+    await message_sink.flush()
+    await notification_service.dispatcher.stop()
+    await manager.stop()
+    await verification_queue.stop()
+    await gateway_client.aclose()
+    password_hasher.shutdown()
+
+
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_handler(request: Request, exc: PoolTimeoutError):
+    """No database connection became free within pool_timeout"""
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Server busy, try again shortly"},
+        headers={"Retry-After": "1"}
+    )
 
 
 # ==================== Utility Functions ====================
 
-async def get_current_user(authorization: str = None, db: Session = Depends(get_db)) -> User:
-    """Get current authenticated user from JWT token"""
+async def get_token_data(authorization: Optional[str] = Header(None)) -> TokenData:
+    """Verify the bearer token of the request"""
     if not authorization:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -85,11 +184,28 @@ async def get_current_user(authorization: str = None, db: Session = Depends(get_
             headers={"WWW-Authenticate": "Bearer"}
         )
     
-    user = db.query(User).filter(User.id == token_data.user_id).first()
-    if not user:
+    return token_data
+
+
+async def get_current_user(
+    token_data: TokenData = Depends(get_token_data),
+    db: AsyncSession = Depends(get_async_db)
+) -> User:
+    """Get current authenticated user from JWT token"""
+    user = await principal_cache.get(token_data.user_id, db)
+    if user is None:
+        user = await db.get(User, token_data.user_id)
+        if not user:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="User not found"
+            )
+        principal_cache.put(user)
+    
+    if not user.is_active:
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="User not found"
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="User account is inactive"
         )
     
     return user
@@ -117,7 +233,7 @@ async def get_current_admin(current_user: User = Depends(get_current_user)) -> U
 
 # ==================== Authentication Endpoints ====================
 
-@app.post("/api/auth/register", response_model=UserResponse)
+@app.post("/api/auth/register", response_model=UserResponse, dependencies=[limit_by_ip("register")])
 async def register(user_data: UserRegister, db: Session = Depends(get_db)):
     """Register a new user"""
     # Check if user exists
@@ -133,7 +249,7 @@ async def register(user_data: UserRegister, db: Session = Depends(get_db)):
         username=user_data.username,
         email=user_data.email,
         full_name=user_data.full_name,
-        password_hash=get_password_hash(user_data.password),
+        password_hash=await password_hasher.hash_async(user_data.password),
         role=UserRole.USER,
         is_active=True,
         created_at=datetime.utcnow()
@@ -146,12 +262,16 @@ async def register(user_data: UserRegister, db: Session = Depends(get_db)):
     return new_user
 
 
-@app.post("/api/auth/login")
+@app.post("/api/auth/login", dependencies=[limit_by_ip("login")])
 async def login(credentials: UserLogin, db: Session = Depends(get_db)):
     """Login user and return JWT tokens"""
     user = db.query(User).filter(User.username == credentials.username).first()
     
-    if not user or not verify_password(credentials.password, user.password_hash):
+    # Unknown usernames cost a full hash too, so response time doesn't reveal which exist
+    hashed = user.password_hash if user else password_hasher.dummy_hash()
+    valid = await password_hasher.verify_async(credentials.password, hashed)
+    
+    if not user or not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid username or password"
@@ -163,6 +283,10 @@ async def login(credentials: UserLogin, db: Session = Depends(get_db)):
             detail="User account is inactive"
         )
     
+    # Upgrade legacy HMAC hashes and older bcrypt costs while we have the password
+    if password_hasher.needs_rehash(user.password_hash):
+        user.password_hash = await password_hasher.hash_async(credentials.password)
+    
     # Update last login
     user.last_login = datetime.utcnow()
     db.commit()
@@ -174,6 +298,47 @@ async def login(credentials: UserLogin, db: Session = Depends(get_db)):
     }
 
 
+@app.post("/api/auth/refresh", dependencies=[limit_by_ip("refresh")])
+async def refresh_tokens(refresh_data: TokenRefresh, db: AsyncSession = Depends(get_async_db)):
+    """Exchange a refresh token for a new access and refresh token pair
+
+    Each refresh token works once; replaying a used one logs the user out everywhere.
+    """
+    token_data = rotate_refresh_token(refresh_data.refresh_token)
+    if token_data is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid refresh token",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    
+    user = await principal_cache.get(token_data.user_id, db) or await db.get(User, token_data.user_id)
+    if not user or not user.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User not found or inactive"
+        )
+    
+    return get_tokens(user.id, user.username, user.role.value).model_dump()
+
+
+@app.post("/api/auth/logout")
+async def logout(
+    logout_data: Optional[LogoutRequest] = None,
+    token_data: TokenData = Depends(get_token_data)
+):
+    """Revoke the access token, and the refresh token or every token of the user when given"""
+    revoke_token(token_data)
+    if logout_data and logout_data.all_devices:
+        revoke_user(token_data.user_id)
+    elif logout_data and logout_data.refresh_token:
+        refresh_token = decode_token(logout_data.refresh_token, "refresh")
+        if refresh_token and refresh_token.user_id == token_data.user_id:
+            revoke_token(refresh_token)
+    
+    return {"status": "success"}
+
+
 # ==================== User Endpoints ====================
 
 @app.get("/api/users/me", response_model=UserResponse)
@@ -193,23 +358,63 @@ async def get_user(user_id: int, db: Session = Depends(get_db)):
 
 @app.get("/api/astrologers", response_model=list[AstrologerResponse])
 async def list_astrologers(
-    skip: int = 0,
-    limit: int = 20,
+    response: Response,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
     specialization: str = None,
+    min_rating: Optional[float] = Query(None, ge=0, le=5),
+    sort: str = Query("id", pattern="^(id|rating)$"),
     db: Session = Depends(get_db)
 ):
-    """List available astrologers"""
+    """List available astrologers - the next page cursor is sent in X-Next-Cursor
+    
+    sort=rating lists the best rated first; both sorts are served by an index on users.
+    specialization matches astrologers tagged with every word of it. Pages are
+    cached until an astrologer profile changes.
+    """
+    tags = specialization_tags(specialization)
+    cache_key = (tuple(tags), sort, min_rating, limit, cursor)
+    cached = directory_cache.get(cache_key)
+    if cached is not None:
+        astrologers, next_cursor = cached
+        _set_next_cursor(response, next_cursor)
+        return astrologers
+    
     query = db.query(User).filter(
         User.role == UserRole.ASTROLOGER,
         User.is_active == True,
-        User.is_verified == True
+        User.is_verified == True,
+        *with_all_tags(tags)
     )
     
-    if specialization:
-        query = query.filter(User.specialization.contains(specialization))
+    if min_rating is not None:
+        query = query.filter(User.average_rating >= min_rating)
+    
+    keys, key_types, key_of = ASTROLOGER_SORTS[sort]
+    after = decode_cursor(cursor, key_types)
+    if after:
+        query = query.filter(keyset_after(keys, after))
     
-    astrologers = query.offset(skip).limit(limit).all()
-    return astrologers
+    astrologers = query.order_by(*keyset_order(keys)).limit(limit + 1).all()
+    next_cursor = page_cursor(astrologers, limit, key_of)
+    
+    page = [AstrologerResponse.model_validate(user).model_dump() for user in astrologers]
+    directory_cache.set(cache_key, (page, next_cursor))
+    _set_next_cursor(response, next_cursor)
+    return page
+
+
+ASTROLOGER_SORTS = {
+    "id": ([(User.id, False)], [int], lambda user: (user.id,)),
+    "rating": ([(User.average_rating, True), (User.id, False)], [float, int],
+               lambda user: (user.average_rating, user.id)),
+}
+
+
+def _set_next_cursor(response: Response, next_cursor: Optional[str]):
+    """List endpoints that return a bare array expose the cursor as a header"""
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
 
 
 # ==================== Question Endpoints ====================
@@ -217,10 +422,13 @@ async def list_astrologers(
 @app.post("/api/questions", response_model=QuestionResponse)
 async def create_question(
     question_data: QuestionCreate,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Create a new question"""
+    await rate_limiter.check("create_question", f"user:{current_user.id}")
+    
     new_question = Question(
         user_id=current_user.id,
         category=question_data.category,
@@ -236,13 +444,17 @@ async def create_question(
     )
     
     db.add(new_question)
-    db.commit()
-    db.refresh(new_question)
+    if not question_data.is_public:
+        # Route private questions straight to an astrologer's queue
+        await db.flush()
+        await assignment_engine.assign_question(db, new_question)
+    await db.commit()
     
-    # Notify astrologers if public question
+    # Notify astrologers if public question - runs after the response is sent
     if question_data.is_public:
-        # TODO: Send notification to all astrologers
-        pass
+        background_tasks.add_task(
+            fan_out_public_question, new_question.id, new_question.category, new_question.title
+        )
     
     return new_question
 
@@ -251,70 +463,168 @@ async def create_question(
 async def get_question(
     question_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    message_limit: int = Query(50, ge=1, le=200),
+    message_cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Get question details with all messages"""
-    question = db.query(Question).filter(Question.id == question_id).first()
+    """Get question details with the first page of messages"""
+    question = await db.scalar(
+        select(Question).options(joinedload(Question.user)).where(Question.id == question_id)
+    )
+    _check_question_access(question, current_user)
     
+    messages, next_cursor = await _message_page(db, question_id, message_limit, message_cursor)
+    # Attach the page without loading the full relationship
+    set_committed_value(question, "messages", messages)
+    
+    detail = QuestionDetailResponse.model_validate(question)
+    detail.next_message_cursor = next_cursor
+    return detail
+
+
+@app.get("/api/questions/{question_id}/messages")
+async def list_question_messages(
+    question_id: int,
+    current_user: User = Depends(get_current_user),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Page through a question thread in chronological order"""
+    question = await db.get(Question, question_id)
+    _check_question_access(question, current_user)
+    
+    query = _message_query(MESSAGE_ROWS.select(), question_id, cursor)
+    messages = MESSAGE_ROWS.rows((await db.execute(query.limit(limit + 1))).all())
+    next_cursor = page_cursor(messages, limit, lambda message: (message["created_at"], message["id"]))
+    return ORJSONResponse({"items": messages, "next_cursor": next_cursor})
+
+
+def _check_question_access(question: Optional[Question], current_user: User):
+    """Raise unless current_user may read the question thread"""
     if not question:
         raise HTTPException(status_code=404, detail="Question not found")
     
     # Check authorization
     if question.user_id != current_user.id and current_user.role not in [UserRole.ASTROLOGER, UserRole.ADMIN]:
         raise HTTPException(status_code=403, detail="Not authorized to view this question")
-    
-    return question
+
+
+MESSAGE_KEYS = [(Message.created_at, False), (Message.id, False)]
+
+# Listings select only the columns they return and skip ORM hydration
+MESSAGE_ROWS = RowSerializer.for_schema(Message, MessageResponse)
+NOTIFICATION_ROWS = RowSerializer.for_schema(Notification, NotificationResponse)
+QUESTION_ROWS = RowSerializer.for_entity(Question)
+
+
+def _message_query(query, question_id: int, cursor: Optional[str]):
+    """Keyset page query of a thread - a single indexed query regardless of thread length"""
+    query = query.where(Message.question_id == question_id)
+    after = decode_cursor(cursor, [datetime, int])
+    if after:
+        query = query.where(keyset_after(MESSAGE_KEYS, after))
+    return query.order_by(*keyset_order(MESSAGE_KEYS))
+
+
+async def _message_page(db: AsyncSession, question_id: int, limit: int, cursor: Optional[str]):
+    """One page of a thread as ORM objects, for the question detail"""
+    query = _message_query(select(Message), question_id, cursor)
+    messages = list((await db.scalars(query.limit(limit + 1))).all())
+    next_cursor = page_cursor(messages, limit, lambda message: (message.created_at, message.id))
+    return messages, next_cursor
 
 
 @app.get("/api/questions")
 async def list_user_questions(
     current_user: User = Depends(get_current_user),
-    skip: int = 0,
-    limit: int = 20,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
     status_filter: str = None,
-    db: Session = Depends(get_db)
+    include_total: bool = False,
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """List user's questions"""
-    query = db.query(Question).filter(Question.user_id == current_user.id)
+    """List user's questions, newest first"""
+    query = QUESTION_ROWS.select().where(Question.user_id == current_user.id)
     
     if status_filter:
-        query = query.filter(Question.status == status_filter)
-    
-    total = query.count()
-    questions = query.offset(skip).limit(limit).all()
+        query = query.where(Question.status == status_filter)
     
-    return {
-        "total": total,
-        "skip": skip,
-        "limit": limit,
-        "items": questions
-    }
+    return await _keyset_listing(
+        db, query, USER_QUESTION_KEYS, limit, cursor, include_total,
+        key_types=[datetime, int], key_of=lambda q: (q["created_at"], q["id"])
+    )
 
 
 @app.get("/api/astrologer/queue")
 async def get_astrologer_queue(
     current_user: User = Depends(get_current_astrologer),
-    skip: int = 0,
-    limit: int = 20,
-    db: Session = Depends(get_db)
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    include_total: bool = False,
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Get questions assigned to astrologer"""
-    questions = db.query(Question).filter(
+    """Get questions assigned to astrologer, highest priority first"""
+    query = QUESTION_ROWS.select().where(
         Question.assigned_to == current_user.id,
         Question.status != QuestionStatus.CLOSED
-    ).offset(skip).limit(limit).all()
+    )
     
-    total = db.query(Question).filter(
-        Question.assigned_to == current_user.id,
-        Question.status != QuestionStatus.CLOSED
-    ).count()
+    return await _keyset_listing(
+        db, query, QUEUE_KEYS, limit, cursor, include_total,
+        key_types=[int, datetime, int], key_of=lambda q: (q["priority"], q["created_at"], q["id"])
+    )
+
+
+USER_QUESTION_KEYS = [(Question.created_at, True), (Question.id, True)]
+QUEUE_KEYS = [(Question.priority, True), (Question.created_at, False), (Question.id, False)]
+
+
+async def _keyset_listing(db: AsyncSession, query, keys, limit, cursor, include_total, key_types, key_of):
+    """Run one keyset page of a QUESTION_ROWS query; the count is only run when asked for"""
+    total = None
+    if include_total:
+        total = await db.scalar(select(func.count()).select_from(query.subquery()))
     
-    return {
+    after = decode_cursor(cursor, key_types)
+    if after:
+        query = query.where(keyset_after(keys, after))
+    
+    items = QUESTION_ROWS.rows((await db.execute(query.order_by(*keyset_order(keys)).limit(limit + 1))).all())
+    next_cursor = page_cursor(items, limit, key_of)
+    
+    return ORJSONResponse({
         "total": total,
-        "skip": skip,
         "limit": limit,
-        "items": questions
-    }
+        "next_cursor": next_cursor,
+        "items": items
+    })
+
+
+@app.post("/api/admin/assignments/backlog")
+async def assign_question_backlog(
+    current_user: User = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Assign every pending question, e.g. after an outage"""
+    assigned = await assignment_engine.assign_backlog(db)
+    return {"assigned": assigned, "engine": assignment_engine.stats()}
+
+
+# ==================== Search Endpoints ====================
+
+@app.get("/api/search")
+async def search_questions_and_messages(
+    q: str = Query(..., min_length=1, max_length=200),
+    scope: str = Query("questions", pattern="^(questions|messages)$"),
+    sort: str = Query("rank", pattern="^(rank|recent)$"),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Full-text search of question titles/descriptions or message content"""
+    return await search(db, current_user, q, scope=scope, sort=sort, limit=limit, cursor=cursor)
 
 
 # ==================== Message Endpoints ====================
@@ -324,10 +634,12 @@ async def send_message(
     question_id: int,
     message_data: MessageCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Send a message in a question thread"""
-    question = db.query(Question).filter(Question.id == question_id).first()
+    await rate_limiter.check("send_message", f"user:{current_user.id}")
+    
+    question = await db.get(Question, question_id)
     
     if not question:
         raise HTTPException(status_code=404, detail="Question not found")
@@ -352,65 +664,365 @@ async def send_message(
     if current_user.id == question.assigned_to and message_data.message_type == "answer":
         question.status = QuestionStatus.ANSWERED
         question.answered_at = datetime.utcnow()
+        await assignment_engine.complete_question(db, question)
     
-    db.commit()
-    db.refresh(new_message)
+    await db.commit()
     
     # Broadcast via WebSocket
     await manager.broadcast_to_question(
         question_id,
         {
             "type": "new_message",
-            "message": MessageResponse.from_orm(new_message).dict()
+            "message": MESSAGE_ROWS.from_object(new_message)
         }
     )
     
     return new_message
 
 
+# ==================== Rating Endpoints ====================
+
+@app.post("/api/ratings", response_model=RatingResponse)
+async def create_rating(
+    rating_data: RatingCreate,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Rate an astrologer on one of your questions they were assigned to, answered or consulted on
+    
+    One rating per question; the astrologer's aggregates are updated in the same transaction.
+    """
+    astrologer = await db.get(User, rating_data.astrologer_id)
+    if not astrologer or astrologer.role != UserRole.ASTROLOGER:
+        raise HTTPException(status_code=404, detail="Astrologer not found")
+    
+    question = await db.get(Question, rating_data.question_id)
+    if not question or question.user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized to rate this question")
+    
+    served = question.assigned_to == astrologer.id or await db.scalar(select(or_(
+        exists().where(Message.question_id == question.id, Message.astrologer_id == astrologer.id),
+        exists().where(Consultation.question_id == question.id, Consultation.astrologer_id == astrologer.id)
+    )))
+    if not served:
+        raise HTTPException(status_code=403, detail="This astrologer has not worked on this question")
+    
+    already_rated = await db.scalar(
+        select(Rating.id).where(Rating.user_id == current_user.id, Rating.question_id == question.id)
+    )
+    if already_rated:
+        raise HTTPException(status_code=409, detail="You have already rated this question")
+    
+    rating = Rating(
+        user_id=current_user.id,
+        astrologer_id=rating_data.astrologer_id,
+        question_id=rating_data.question_id,
+        rating=rating_data.rating,
+        review=rating_data.review,
+        created_at=datetime.utcnow()
+    )
+    db.add(rating)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # A concurrent request rated the same question first
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="You have already rated this question")
+    
+    return rating
+
+
+@app.delete("/api/ratings/{rating_id}")
+async def delete_rating(
+    rating_id: int,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Delete one of your ratings"""
+    rating = await db.get(Rating, rating_id)
+    if not rating:
+        raise HTTPException(status_code=404, detail="Rating not found")
+    
+    if rating.user_id != current_user.id and current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Not authorized to delete this rating")
+    
+    await db.delete(rating)
+    await db.commit()
+    
+    return {"status": "deleted"}
+
+
+@app.post("/api/admin/ratings/reconcile")
+async def reconcile_rating_aggregates(
+    current_user: User = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Recompute astrologer rating and consultation aggregates from scratch"""
+    astrologers = await reconcile_aggregates(db)
+    await db.commit()
+    return {"astrologers": astrologers}
+
+
+# ==================== Payment Endpoints ====================
+
+@app.post("/api/payments/verify", response_model=PaymentVerificationResponse, status_code=202)
+async def request_payment_verification(
+    request_data: PaymentVerificationRequest,
+    idempotency_key: Optional[str] = Header(None, max_length=100),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Queue verification of a gateway payment and return the job to poll
+    
+    Repeating the request - with the same Idempotency-Key header, or for the
+    same gateway transaction - returns the job already queued.
+    """
+    if request_data.consultation_id is not None:
+        consultation = await db.get(Consultation, request_data.consultation_id)
+        if not consultation or consultation.user_id != current_user.id:
+            raise HTTPException(status_code=404, detail="Consultation not found")
+    
+    try:
+        job = await enqueue_verification(
+            db,
+            current_user.id,
+            PaymentGateway(request_data.gateway),
+            request_data.transaction_id,
+            request_data.verification_data,
+            consultation_id=request_data.consultation_id,
+            # Client keys are only unique per user
+            key=f"user:{current_user.id}:{idempotency_key}" if idempotency_key else None
+        )
+    except PaymentStateError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    if job.user_id != current_user.id:
+        raise HTTPException(status_code=409, detail="This payment is already being verified for another account")
+    
+    verification_queue.wake()
+    return job
+
+
+@app.get("/api/payments/verifications/{verification_id}", response_model=PaymentVerificationResponse)
+async def get_payment_verification(
+    verification_id: int,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """State of one of your verification jobs"""
+    job = await db.get(PaymentVerification, verification_id)
+    if not job or (job.user_id != current_user.id and current_user.role != UserRole.ADMIN):
+        raise HTTPException(status_code=404, detail="Verification not found")
+    return job
+
+
+@app.api_route("/api/payments/webhooks/{gateway}", methods=["GET", "POST"], status_code=202)
+async def payment_webhook(gateway: str, request: Request, x_webhook_token: Optional[str] = Header(None)):
+    """Gateway callback - makes the verification job it refers to due now
+    
+    The callback is not trusted on its own; the job still confirms the payment with the gateway.
+    """
+    try:
+        gateway = PaymentGateway(gateway)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Unknown gateway")
+    
+    if not webhook_authorized(x_webhook_token or request.query_params.get("webhook_token")):
+        raise HTTPException(status_code=401, detail="Invalid webhook token")
+    
+    payload = dict(request.query_params)
+    body = await request.body()
+    if body:
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = {key: values[-1] for key, values in parse_qs(body.decode(errors="replace")).items()}
+        if isinstance(data, dict):
+            payload.update(data)
+    
+    return {"verification_id": await verification_queue.ingest_webhook(gateway, payload)}
+
+
+@app.post("/api/admin/payments/reconcile")
+async def reconcile_payments(current_user: User = Depends(get_current_admin)):
+    """Run the payment reconciliation sweep now"""
+    return await verification_queue.reconcile()
+
+
+def _wallet_entry(entry) -> WalletEntryResponse:
+    return WalletEntryResponse(
+        id=entry.id,
+        version=entry.version,
+        amount=wallet.from_minor(entry.amount),
+        balance_after=wallet.from_minor(entry.balance_after),
+        kind=entry.kind,
+        reference=entry.reference,
+        created_at=entry.created_at
+    )
+
+
+@app.get("/api/wallet", response_model=WalletResponse)
+async def get_wallet(
+    before_version: Optional[int] = Query(None, ge=1),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Your wallet balance and ledger, newest first - page with before_version"""
+    balance, version = await wallet.snapshot(db, current_user.id)
+    entries = await wallet.entries(db, current_user.id, limit, before_version)
+    return WalletResponse(
+        balance=wallet.from_minor(balance),
+        version=version,
+        entries=[_wallet_entry(entry) for entry in entries]
+    )
+
+
+@app.post("/api/admin/wallets/{user_id}/adjustments", response_model=WalletEntryResponse)
+async def adjust_wallet(
+    user_id: int,
+    adjustment: WalletAdjustment,
+    current_user: User = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Credit or debit a wallet; repeating a reference returns the first entry"""
+    if not await db.get(User, user_id):
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    amount = wallet.to_minor(adjustment.amount)
+    if amount == 0:
+        raise HTTPException(status_code=400, detail="Amount must not be zero")
+    
+    try:
+        entry = await wallet.post(db, user_id, amount, adjustment.kind, adjustment.reference)
+    except wallet.WalletError as e:
+        # Insufficient funds, or the reference was used for another amount
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    return _wallet_entry(entry)
+
+
+@app.get("/api/admin/wallets/{user_id}/audit")
+async def audit_wallet(
+    user_id: int,
+    current_user: User = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Compare a wallet's balance snapshot with its ledger"""
+    return await wallet.audit(db, user_id)
+
+
 # ==================== Notification Endpoints ====================
 
 @app.get("/api/notifications", response_model=list[NotificationResponse])
 async def get_notifications(
     current_user: User = Depends(get_current_user),
-    skip: int = 0,
-    limit: int = 20,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
     unread_only: bool = False,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Get user notifications"""
-    query = db.query(Notification).filter(Notification.user_id == current_user.id)
+    """Get user notifications, newest first - the next page cursor is sent in X-Next-Cursor"""
+    query = NOTIFICATION_ROWS.select().where(Notification.user_id == current_user.id)
     
     if unread_only:
-        query = query.filter(Notification.is_read == False)
+        query = query.where(Notification.is_read == False)
     
-    total = query.count()
-    notifications = query.order_by(Notification.created_at.desc()).offset(skip).limit(limit).all()
+    after = decode_cursor(cursor, [datetime, int])
+    if after:
+        query = query.where(keyset_after(NOTIFICATION_KEYS, after))
     
-    return notifications
+    notifications = NOTIFICATION_ROWS.rows((await db.execute(
+        query.order_by(*keyset_order(NOTIFICATION_KEYS)).limit(limit + 1)
+    )).all())
+    next_cursor = page_cursor(notifications, limit, lambda n: (n["created_at"], n["id"]))
+    
+    return json_response(notifications, next_cursor)
+
+
+NOTIFICATION_KEYS = [(Notification.created_at, True), (Notification.id, True)]
 
 
 @app.patch("/api/notifications/{notification_id}/read")
 async def mark_notification_read(
     notification_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Mark notification as read"""
-    notification = db.query(Notification).filter(
-        Notification.id == notification_id,
-        Notification.user_id == current_user.id
-    ).first()
-    
-    if not notification:
-        raise HTTPException(status_code=404, detail="Notification not found")
+    marked = await _mark_read(db, current_user.id, Notification.id == notification_id)
     
-    notification.is_read = True
-    db.commit()
+    if not marked:
+        exists = await db.scalar(select(Notification.id).where(
+            Notification.id == notification_id,
+            Notification.user_id == current_user.id
+        ))
+        if not exists:
+            raise HTTPException(status_code=404, detail="Notification not found")
     
     return {"status": "success"}
 
 
+@app.post("/api/notifications/read-all")
+async def mark_all_notifications_read(
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Mark every notification of the user as read"""
+    marked = await _mark_read(db, current_user.id)
+    return {"status": "success", "marked": marked, "unread_count": await unread_counter.get(db, current_user.id)}
+
+
+@app.post("/api/notifications/read")
+async def mark_notifications_read(
+    read_data: NotificationReadRequest,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Mark a list of notifications, or everything up to an id or timestamp, as read"""
+    criteria = [
+        value for value in (read_data.ids, read_data.up_to_id, read_data.before) if value is not None
+    ]
+    if len(criteria) != 1:
+        raise HTTPException(status_code=400, detail="Give exactly one of ids, up_to_id or before")
+    
+    if read_data.ids is not None:
+        condition = Notification.id.in_(read_data.ids)
+    elif read_data.up_to_id is not None:
+        condition = Notification.id <= read_data.up_to_id
+    else:
+        condition = Notification.created_at <= read_data.before
+    
+    marked = await _mark_read(db, current_user.id, condition)
+    return {"status": "success", "marked": marked, "unread_count": await unread_counter.get(db, current_user.id)}
+
+
+@app.get("/api/notifications/unread-count")
+async def get_unread_count(
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Unread badge count - also pushed over WebSocket as "unread_count" whenever it changes"""
+    return {"unread_count": await unread_counter.get(db, current_user.id)}
+
+
+async def _mark_read(db: AsyncSession, user_id: int, *conditions) -> int:
+    """Mark the user's matching unread notifications read in one UPDATE and push the new count"""
+    result = await db.execute(
+        update(Notification)
+        .where(Notification.user_id == user_id, Notification.is_read == False, *conditions)
+        .values(is_read=True)
+        .execution_options(synchronize_session=False, unread_counted=True)
+    )
+    marked = result.rowcount
+    mark_unread_changed(db.sync_session, user_id, -marked)
+    await db.commit()
+    
+    if marked:
+        await push_unread_counts(db, [user_id])
+    return marked
+
+
 # ==================== WebSocket Endpoints ====================
 
 @app.websocket("/ws/questions/{question_id}/{user_id}")
@@ -418,44 +1030,41 @@ async def websocket_endpoint(
     websocket: WebSocket,
     question_id: int,
     user_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """WebSocket endpoint for real-time messaging"""
     # Verify question and user exist
-    question = db.query(Question).filter(Question.id == question_id).first()
-    user = db.query(User).filter(User.id == user_id).first()
+    question = await db.get(Question, question_id)
+    user = await db.get(User, user_id)
+    is_assigned = question is not None and question.assigned_to == user_id
+    username = user.username if user else None
+    authorized = question is not None and user is not None and user_id in (question.user_id, question.assigned_to)
+    # Messages are written by the batch sink, so release the connection now
+    await db.close()
     
     if not question or not user:
         await websocket.close(code=4004)
         return
     
     # Check authorization
-    if question.user_id != user_id and question.assigned_to != user_id:
+    if not authorized:
         await websocket.close(code=4003)
         return
     
     await manager.connect(websocket, question_id, user_id)
     
-    try:
+    # Saves complete in batches; broadcast them in the order they were received
+    saved_messages: asyncio.Queue = asyncio.Queue()
+    
+    async def broadcast_saved():
         while True:
-            data = await websocket.receive_json()
-            
-            # Process received message
-            if data.get("type") == "message":
-                message_content = data.get("content")
-                
-                # Save to database
-                new_message = Message(
-                    question_id=question_id,
-                    user_id=user_id,
-                    astrologer_id=user_id if question.assigned_to == user_id else None,
-                    message_type=MessageType.ANSWER if question.assigned_to == user_id else MessageType.FOLLOW_UP,
-                    content=message_content,
-                    created_at=datetime.utcnow()
-                )
-                
-                db.add(new_message)
-                db.commit()
+            pending, message_content, client_id = await saved_messages.get()
+            try:
+                try:
+                    message_id, created_at = await pending
+                except Exception:
+                    await websocket.send_json({"type": "error", "detail": "Message could not be saved", "client_id": client_id})
+                    continue
                 
                 # Broadcast to all connected users
                 await manager.broadcast_to_question(
@@ -463,43 +1072,110 @@ async def websocket_endpoint(
                     {
                         "type": "message",
                         "user_id": user_id,
-                        "username": user.username,
+                        "username": username,
                         "content": message_content,
-                        "message_id": new_message.id
+                        "message_id": message_id,
+                        "created_at": created_at,
+                        "client_id": client_id
                     }
                 )
+            finally:
+                saved_messages.task_done()
+    
+    broadcaster_task = asyncio.create_task(broadcast_saved())
+    
+    try:
+        while True:
+            data = await websocket.receive_json()
+            
+            # Process received message
+            if data.get("type") == "message":
+                allowed, retry_after = await rate_limiter.hit("ws_message", f"user:{user_id}")
+                if not allowed:
+                    await websocket.send_json({
+                        "type": "error",
+                        "detail": "Rate limit exceeded",
+                        "retry_after": retry_after,
+                        "client_id": data.get("client_id")
+                    })
+                    continue
+                
+                # Same rules as messages posted over HTTP
+                try:
+                    message_content = MessageCreate(content=data.get("content")).content
+                except ValidationError:
+                    await websocket.send_json({
+                        "type": "error",
+                        "detail": "Message content must be text of at least 5 characters",
+                        "client_id": data.get("client_id")
+                    })
+                    continue
+                
+                # Queue for the next batch insert
+                pending = message_sink.submit(
+                    question_id=question_id,
+                    user_id=user_id,
+                    astrologer_id=user_id if is_assigned else None,
+                    message_type=MessageType.ANSWER if is_assigned else MessageType.FOLLOW_UP,
+                    content=message_content
+                )
+                saved_messages.put_nowait((pending, message_content, data.get("client_id")))
     
     except WebSocketDisconnect:
+        # Let messages already received finish saving before announcing the disconnect
+        await saved_messages.join()
         manager.disconnect(question_id, user_id)
         await manager.broadcast_to_question(
             question_id,
             {"type": "user_disconnected", "user_id": user_id}
         )
+    finally:
+        broadcaster_task.cancel()
 
 
 # ==================== Health Check ====================
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(content=metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {
         "status": "healthy",
         "timestamp": datetime.utcnow(),
-        "connections": manager.get_connection_count()
+        "connections": manager.get_connection_count(),
+        "principal_cache": principal_cache.stats(),
+        "notifications": notification_service.dispatcher.stats(),
+        "assignment": assignment_engine.stats(),
+        "http_cache": response_cache.stats(),
+        "unread_counts": unread_counter.stats(),
+        "auth": {"verified_tokens": verified_tokens.stats(), **token_revocations.stats(),
+                 "password_hashing": password_hasher.stats()},
+        "rate_limit": rate_limiter.stats(),
+        "payment_gateways": gateway_client.stats(),
+        "payment_verifications": verification_queue.stats()
     }
 
 
 # ==================== Root ====================
 
+dashboard_page = StaticAsset("frontend/dashboard/index.html", media_type="text/html")
+index_page = StaticAsset("frontend/index.html", media_type="text/html")
+
+
 @app.get("/frontend/dashboard/")
-async def dashboard():
+async def dashboard(request: Request):
     """Serve dashboard HTML"""
-    return FileResponse("frontend/dashboard/index.html", media_type="text/html")
+    return dashboard_page.response(request)
 
 @app.get("/")
-async def root():
+async def root(request: Request):
     """Root endpoint - serve main app"""
-    return FileResponse("frontend/index.html", media_type="text/html")
+    return index_page.response(request)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,133 @@
+"""
+Write-behind sink that persists live chat messages in small batches
+"""
+
+import asyncio
+import os
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import insert
+
+from backend.database import AsyncSessionLocal
+from backend.models import Message
+
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", 100))
+MESSAGE_BATCH_DELAY = float(os.getenv("MESSAGE_BATCH_DELAY", 0.02))
+
+
+class MessageSink:
+    """Group incoming messages into time/size-bounded batches inserted with one commit
+
+    submit() returns a future resolving to (message_id, created_at). Futures
+    resolve in submission order and ids increase in that order. A batch the
+    database rejects is retried one row at a time, so only the offending
+    rows' futures fail.
+    """
+
+    def __init__(
+        self,
+        session_factory=None,
+        batch_size: int = MESSAGE_BATCH_SIZE,
+        batch_delay: float = MESSAGE_BATCH_DELAY
+    ):
+        self.session_factory = session_factory or AsyncSessionLocal
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.batches_written = 0
+        self.messages_written = 0
+        self.messages_failed = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._runner: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def submit(self, **fields) -> "asyncio.Future[Tuple[int, datetime]]":
+        """Queue a message row; await the returned future for its id"""
+        self._ensure_running()
+        fields.setdefault("created_at", datetime.utcnow())
+        future = self._loop.create_future()
+        self._queue.put_nowait((fields, future))
+        return future
+
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self._runner is None or self._runner.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._runner = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = self._loop.time() + self.batch_delay
+            while len(batch) < self.batch_size:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._write(batch)
+
+    async def _insert(self, rows: List[dict]) -> list:
+        # A short-lived session per batch - nothing is held open between batches
+        async with self.session_factory() as db:
+            result = await db.execute(
+                insert(Message).returning(Message.id, Message.created_at, sort_by_parameter_order=True),
+                rows
+            )
+            saved = result.all()
+            await db.commit()
+        return saved
+
+    async def _write(self, batch: List[tuple]):
+        try:
+            saved = await self._insert([fields for fields, _ in batch])
+        except Exception as e:
+            if len(batch) > 1:
+                # One bad row fails the whole insert; write the rest without it
+                print(f"Error writing message batch, retrying {len(batch)} rows one at a time: {e}")
+                for item in batch:
+                    await self._write([item])
+                return
+            print(f"Error writing message: {e}")
+            self.messages_failed += 1
+            _, future = batch[0]
+            if not future.done():
+                future.set_exception(e)
+            return
+
+        self.batches_written += 1
+        self.messages_written += len(batch)
+        for (_, future), (message_id, created_at) in zip(batch, saved):
+            if not future.done():
+                future.set_result((message_id, created_at))
+
+    async def flush(self):
+        """Write everything queued so far and stop the runner"""
+        if self._runner is None or self._runner.done():
+            return
+        pending = []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        self._runner.cancel()
+        try:
+            await self._runner
+        except asyncio.CancelledError:
+            pass
+        self._runner = None
+        for start in range(0, len(pending), self.batch_size):
+            await self._write(pending[start:start + self.batch_size])
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "batches_written": self.batches_written,
+            "messages_written": self.messages_written,
+            "messages_failed": self.messages_failed
+        }
+
+
+# Global message sink instance
+message_sink = MessageSink()
@@ -0,0 +1,317 @@
+"""
+Request, database and WebSocket metrics in the Prometheus text format
+
+MetricsMiddleware times every HTTP request by route template. Engine
+listeners count each statement and its time against the request that ran
+it, through a context variable that follows the request into the threadpool
+and into SQLAlchemy's async greenlets. Gauges are read from their sources
+when /metrics is scraped.
+
+Set SLOW_QUERY_MS to log statements slower than that, with the stack that
+issued them, on the "backend.slow_query" logger.
+"""
+
+import bisect
+import logging
+import os
+import sysconfig
+import threading
+import time
+import traceback
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence
+
+from sqlalchemy import event
+from starlette.routing import Match
+
+try:
+    import greenlet
+except ImportError:
+    greenlet = None
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 0))
+SLOW_QUERY_STACK_DEPTH = int(os.getenv("SLOW_QUERY_STACK_DEPTH", 12))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+slow_query_log = logging.getLogger("backend.slow_query")
+
+_LIBRARY_PATHS = tuple({sysconfig.get_paths()["stdlib"], sysconfig.get_paths()["purelib"]})
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per label set"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in values]
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label set"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Per-bucket counts, then sum and count
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return series[-1] if series else 0
+
+    def sum(self, *labels: str) -> float:
+        series = self._series.get(labels)
+        return series[-2] if series else 0.0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            all_series = [(labels, list(series)) for labels, series in self._series.items()]
+        lines = []
+        for labels, series in all_series:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float("inf"),), series):
+                cumulative += bucket
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(series[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    """Values read from a callback at scrape time - a number, or {label values tuple: number}"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, read: Callable, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.labelnames = tuple(labelnames)
+
+    def samples(self) -> List[str]:
+        value = self.read()
+        values = value.items() if isinstance(value, dict) else [((), value)]
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(number)}" for labels, number in values]
+
+
+class MetricsRegistry:
+    """Named metrics rendered together for a scrape"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, read: Callable, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, read, labelnames))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                print(f"Error collecting metric {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+# Global registry and the metrics recorded by this module
+registry = MetricsRegistry()
+
+request_latency = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status")
+)
+request_queries = registry.histogram(
+    "http_request_db_queries", "Database statements run per HTTP request", ("method", "route"),
+    buckets=QUERY_COUNT_BUCKETS
+)
+request_db_time = registry.histogram(
+    "http_request_db_seconds", "Time spent in database statements per HTTP request", ("method", "route")
+)
+query_latency = registry.histogram("db_query_duration_seconds", "Database statement latency")
+slow_queries = registry.counter("db_slow_queries_total", "Statements slower than SLOW_QUERY_MS")
+
+
+# ---- Per-request database accounting ----
+
+class RequestStats:
+    """Statements and database time of one request"""
+
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("query_started")
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    query_latency.observe(elapsed)
+
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        slow_queries.inc()
+        slow_query_log.warning("Slow query (%.1f ms): %s\n%s", elapsed * 1000, statement, _application_stack())
+
+
+def _application_stack() -> str:
+    """The application frames that led to the statement, innermost last"""
+    frames = traceback.extract_stack()
+    current = greenlet.getcurrent() if greenlet is not None else None
+    if current is not None and current.parent is not None and current.parent.gr_frame is not None:
+        # AsyncSession runs statements in a child greenlet; the awaiting coroutines are on its parent
+        frames = traceback.extract_stack(current.parent.gr_frame) + frames
+    frames = [frame for frame in frames if not frame.filename.startswith(_LIBRARY_PATHS)]
+    frames = [frame for frame in frames if frame.filename != __file__]
+    return "".join(traceback.format_list(frames[-SLOW_QUERY_STACK_DEPTH:]))
+
+
+def _handle_error(exception_context):
+    started = exception_context.connection.info.get("query_started") if exception_context.connection else None
+    if started:
+        started.pop()
+
+
+def pool_checked_out(db_engine) -> int:
+    """Connections in use; pools without a limit (StaticPool) report 0"""
+    checkedout = getattr(db_engine.pool, "checkedout", None)
+    return checkedout() if checkedout else 0
+
+
+def instrument_engine(sync_engine):
+    """Time every statement run on sync_engine (pass async_engine.sync_engine for asyncio engines)"""
+    if event.contains(sync_engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
+
+
+# ---- HTTP timing ----
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and database use per route template"""
+
+    def __init__(self, app):
+        self.app = app
+        self._paths: Dict[object, str] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_stats.reset(token)
+            method, route = scope["method"], self._route_of(scope)
+            request_latency.observe(elapsed, method, route, str(status))
+            request_queries.observe(stats.queries, method, route)
+            request_db_time.observe(stats.db_seconds, method, route)
+
+    def _route_of(self, scope) -> str:
+        """The path template, so /api/questions/1 and /api/questions/2 share one series"""
+        endpoint = scope.get("endpoint")
+        if endpoint in self._paths:
+            return self._paths[endpoint]
+
+        routes = getattr(getattr(scope.get("app"), "router", None), "routes", ())
+        for route in routes:
+            if endpoint is not None:
+                if getattr(route, "endpoint", None) is endpoint:
+                    self._paths[endpoint] = route.path
+                    return route.path
+            elif hasattr(route, "path") and route.matches(scope)[0] == Match.FULL:
+                # Answered before routing, e.g. from the response cache
+                return route.path
+        return "unmatched"
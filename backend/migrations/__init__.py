@@ -0,0 +1,3 @@
+"""
+Alembic migrations - see alembic.ini at the repository root
+"""
@@ -0,0 +1,47 @@
+"""
+Alembic environment - migrates the database named by DATABASE_URL (or sqlalchemy.url)
+
+init_db() still creates a fresh database with create_all. Revisions only
+bring databases created by an older release up to date, so each one skips
+tables, columns and indexes that already exist.
+"""
+
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import create_engine, pool
+
+from backend.database import Base, DATABASE_URL
+import backend.models  # noqa: F401 - registers the tables on Base.metadata
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+target_metadata = Base.metadata
+database_url = config.get_main_option("sqlalchemy.url") or DATABASE_URL
+
+
+def run_migrations_offline():
+    """Emit the SQL instead of running it (alembic upgrade head --sql)"""
+    context.configure(url=database_url, target_metadata=target_metadata, literal_binds=True,
+                      render_as_batch=database_url.startswith("sqlite"))
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    connectable = create_engine(database_url, poolclass=pool.NullPool)
+    with connectable.connect() as connection:
+        # SQLite cannot ALTER most constraints, so those changes rebuild the table
+        context.configure(connection=connection, target_metadata=target_metadata,
+                          render_as_batch=connection.dialect.name == "sqlite")
+        with context.begin_transaction():
+            context.run_migrations()
+    connectable.dispose()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,44 @@
+"""
+Idempotent schema operations for revisions
+
+A database may have been created by init_db() from the current models, or
+by an older release, so every operation first checks what is already there.
+"""
+
+from alembic import op
+from sqlalchemy import inspect
+
+
+def has_table(table: str) -> bool:
+    return inspect(op.get_bind()).has_table(table)
+
+
+def has_column(table: str, column: str) -> bool:
+    return column in {c["name"] for c in inspect(op.get_bind()).get_columns(table)}
+
+
+def has_index(table: str, name: str) -> bool:
+    return name in {index["name"] for index in inspect(op.get_bind()).get_indexes(table)}
+
+
+def create_index_if_missing(name: str, table: str, columns, **kw):
+    # A missing table is created whole, indexes included, by init_db()
+    if has_table(table) and not has_index(table, name):
+        op.create_index(name, table, columns, **kw)
+
+
+def drop_index_if_present(name: str, table: str):
+    if has_table(table) and has_index(table, name):
+        op.drop_index(name, table_name=table)
+
+
+def add_column_if_missing(table: str, column):
+    if has_table(table) and not has_column(table, column.name):
+        with op.batch_alter_table(table) as batch:
+            batch.add_column(column)
+
+
+def drop_column_if_present(table: str, column: str):
+    if has_table(table) and has_column(table, column):
+        with op.batch_alter_table(table) as batch:
+            batch.drop_column(column)
@@ -0,0 +1,32 @@
+"""
+Indexes behind keyset pagination and astrologer fan-out
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+
+from backend.migrations.helpers import create_index_if_missing, drop_index_if_present
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_messages_question_created_id", "messages", ["question_id", "created_at", "id"]),
+    ("ix_questions_user_created_id", "questions", ["user_id", "created_at", "id"]),
+    ("ix_questions_queue", "questions", ["assigned_to", "status", "priority", "created_at"]),
+    ("ix_notifications_user_created_id", "notifications", ["user_id", "created_at", "id"]),
+    ("ix_users_role_verified_id", "users", ["role", "is_verified", "id"]),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        create_index_if_missing(name, table, columns)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        drop_index_if_present(name, table)
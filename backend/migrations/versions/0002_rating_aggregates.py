@@ -0,0 +1,52 @@
+"""
+Astrologer rating aggregates and one rating per question
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+from backend.migrations.helpers import (
+    add_column_if_missing, create_index_if_missing, drop_column_if_present, drop_index_if_present, has_table
+)
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def _has_unique(table: str, name: str) -> bool:
+    return name in {c["name"] for c in sa.inspect(op.get_bind()).get_unique_constraints(table)}
+
+
+def upgrade():
+    add_column_if_missing("users", sa.Column("rating_sum", sa.Integer(), nullable=False, server_default="0"))
+    add_column_if_missing("users", sa.Column("rating_count", sa.Integer(), nullable=False, server_default="0"))
+    create_index_if_missing("ix_users_role_verified_rating", "users",
+                            ["role", "is_verified", "average_rating", "id"])
+
+    if has_table("ratings") and not _has_unique("ratings", "uq_ratings_user_question"):
+        # Keep each user's latest rating of a question before enforcing one per question
+        op.execute(
+            "DELETE FROM ratings WHERE question_id IS NOT NULL AND id NOT IN ("
+            "SELECT MAX(id) FROM ratings WHERE question_id IS NOT NULL GROUP BY user_id, question_id)"
+        )
+        with op.batch_alter_table("ratings") as batch:
+            batch.create_unique_constraint("uq_ratings_user_question", ["user_id", "question_id"])
+
+    if has_table("users") and has_table("ratings") and has_table("consultations"):
+        from backend.ratings import reconcile_statement
+        op.get_bind().execute(reconcile_statement())
+
+
+def downgrade():
+    if has_table("ratings") and _has_unique("ratings", "uq_ratings_user_question"):
+        with op.batch_alter_table("ratings") as batch:
+            batch.drop_constraint("uq_ratings_user_question", type_="unique")
+    drop_index_if_present("ix_users_role_verified_rating", "users")
+    drop_column_if_present("users", "rating_count")
+    drop_column_if_present("users", "rating_sum")
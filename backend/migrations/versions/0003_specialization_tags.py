@@ -0,0 +1,37 @@
+"""
+Normalized astrologer specialization tags
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+from sqlalchemy import exists, select
+
+from backend.migrations.helpers import create_index_if_missing, has_table
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not has_table("users"):
+        return
+    from backend.models import Specialization, astrologer_specializations
+    from backend.specializations import rebuild_tags
+
+    bind = op.get_bind()
+    Specialization.__table__.create(bind, checkfirst=True)
+    astrologer_specializations.create(bind, checkfirst=True)
+    create_index_if_missing("ix_astrologer_specializations_tag", "astrologer_specializations",
+                            ["specialization_id", "user_id"])
+    if not bind.execute(select(exists().select_from(astrologer_specializations))).scalar():
+        rebuild_tags(bind)
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS astrologer_specializations")
+    op.execute("DROP TABLE IF EXISTS specializations")
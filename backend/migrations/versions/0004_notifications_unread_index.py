@@ -0,0 +1,22 @@
+"""
+Index for unread counts and bulk mark-read
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+"""
+
+from backend.migrations.helpers import create_index_if_missing, drop_index_if_present
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    create_index_if_missing("ix_notifications_user_read", "notifications", ["user_id", "is_read"])
+
+
+def downgrade():
+    drop_index_if_present("ix_notifications_user_read", "notifications")
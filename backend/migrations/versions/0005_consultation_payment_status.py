@@ -0,0 +1,38 @@
+"""
+Consultation payment state for the verification queue
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+
+The payment_verifications table is new and is created by init_db().
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+from backend.migrations.helpers import (
+    add_column_if_missing, create_index_if_missing, drop_column_if_present, drop_index_if_present, has_column,
+    has_table
+)
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    added = has_table("consultations") and not has_column("consultations", "payment_status")
+    add_column_if_missing(
+        "consultations", sa.Column("payment_status", sa.String(20), nullable=False, server_default="unpaid")
+    )
+    if added:
+        # Consultations were only given a payment reference once the payment had gone through
+        op.execute("UPDATE consultations SET payment_status = 'paid' WHERE payment_id IS NOT NULL")
+    create_index_if_missing("ix_consultations_payment_status", "consultations", ["payment_status", "updated_at"])
+
+
+def downgrade():
+    drop_index_if_present("ix_consultations_payment_status", "consultations")
+    drop_column_if_present("consultations", "payment_status")
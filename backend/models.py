@@ -3,7 +3,10 @@ SQLAlchemy models for the consultation platform
 """
 
 from datetime import datetime
-from sqlalchemy import Column, String, Integer, Text, DateTime, Boolean, Enum, ForeignKey, Float, JSON
+from sqlalchemy import (
+    Column, String, Integer, Text, DateTime, Boolean, Enum, ForeignKey, Float, JSON, Index, Table, UniqueConstraint,
+    CheckConstraint
+)
 from sqlalchemy.orm import relationship
 from backend.database import Base
 import enum
@@ -43,6 +46,33 @@ class NotificationType(str, enum.Enum):
     PAYMENT_CONFIRMED = "payment_confirmed"
 
 
+class PaymentStatus(str, enum.Enum):
+    """Payment state of a consultation - transitions are enforced by backend.payment_verification"""
+    UNPAID = "unpaid"
+    PENDING = "pending"  # payment_id set, waiting for the gateway to confirm it
+    PAID = "paid"
+    FAILED = "failed"
+    REFUNDED = "refunded"
+
+
+# Normalized astrologer specializations, kept in step with User.specialization by backend.specializations
+astrologer_specializations = Table(
+    "astrologer_specializations",
+    Base.metadata,
+    Column("user_id", Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True),
+    Column("specialization_id", Integer, ForeignKey("specializations.id", ondelete="CASCADE"), primary_key=True),
+    Index("ix_astrologer_specializations_tag", "specialization_id", "user_id"),
+)
+
+
+class Specialization(Base):
+    """Normalized specialization tag - one row per distinct lower-cased word"""
+    __tablename__ = "specializations"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(100), unique=True, nullable=False)
+
+
 class User(Base):
     """User model - represents both regular users and astrologers"""
     __tablename__ = "users"
@@ -60,7 +90,9 @@ class User(Base):
     bio = Column(Text)
     experience_years = Column(Integer)
     hourly_rate = Column(Float, default=50.0)  # For future consultation fees
-    average_rating = Column(Float, default=0.0)
+    average_rating = Column(Float, default=0.0)  # rating_sum / rating_count, kept by backend.ratings
+    rating_sum = Column(Integer, default=0, nullable=False)
+    rating_count = Column(Integer, default=0, nullable=False)
     total_consultations = Column(Integer, default=0)
     is_verified = Column(Boolean, default=False)
     
@@ -75,6 +107,14 @@ class User(Base):
     ratings = relationship("Rating", back_populates="astrologer", foreign_keys="Rating.astrologer_id")
     notifications = relationship("Notification", back_populates="user")
     consultations = relationship("Consultation", back_populates="user", foreign_keys="Consultation.user_id")
+    specialization_tags = relationship("Specialization", secondary=astrologer_specializations, viewonly=True)
+    
+    __table_args__ = (
+        # Streaming verified astrologers in id order for fan-out
+        Index("ix_users_role_verified_id", "role", "is_verified", "id"),
+        # Listing astrologers by rating without touching ratings
+        Index("ix_users_role_verified_rating", "role", "is_verified", "average_rating", "id"),
+    )
 
 
 class Question(Base):
@@ -107,6 +147,12 @@ class Question(Base):
     user = relationship("User", back_populates="questions", foreign_keys=[user_id])
     messages = relationship("Message", back_populates="question", cascade="all, delete-orphan")
     consultation = relationship("Consultation", back_populates="question", uselist=False)
+    
+    __table_args__ = (
+        # Keyset pagination of a user's questions and an astrologer's queue
+        Index("ix_questions_user_created_id", "user_id", "created_at", "id"),
+        Index("ix_questions_queue", "assigned_to", "status", "priority", "created_at"),
+    )
 
 
 class Message(Base):
@@ -129,6 +175,11 @@ class Message(Base):
     # Relationships
     question = relationship("Question", back_populates="messages")
     astrologer = relationship("User", back_populates="answers", foreign_keys=[astrologer_id])
+    
+    __table_args__ = (
+        # Keyset pagination of a thread: question_id, then (created_at, id)
+        Index("ix_messages_question_created_id", "question_id", "created_at", "id"),
+    )
 
 
 class Consultation(Base):
@@ -145,6 +196,7 @@ class Consultation(Base):
     status = Column(String(50), default="scheduled")  # scheduled, ongoing, completed, cancelled
     amount = Column(Float, nullable=False)
     payment_id = Column(String(150), index=True)  # Reference to payment gateway
+    payment_status = Column(String(20), default=PaymentStatus.UNPAID.value, server_default="unpaid", nullable=False)
     
     # Scheduling
     scheduled_at = Column(DateTime)
@@ -161,6 +213,79 @@ class Consultation(Base):
     # Relationships
     user = relationship("User", back_populates="consultations", foreign_keys=[user_id])
     question = relationship("Question", back_populates="consultation")
+    
+    __table_args__ = (
+        # Reconciliation sweep over pending payments
+        Index("ix_consultations_payment_status", "payment_status", "updated_at"),
+    )
+
+
+class PaymentVerification(Base):
+    """A gateway verification job - one per idempotency key, run by backend.payment_verification"""
+    __tablename__ = "payment_verifications"
+
+    id = Column(Integer, primary_key=True, index=True)
+    idempotency_key = Column(String(200), unique=True, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    consultation_id = Column(Integer, ForeignKey("consultations.id"), nullable=True, index=True)
+    
+    gateway = Column(String(20), nullable=False)
+    transaction_id = Column(String(150), nullable=False)
+    verification_data = Column(JSON)
+    
+    # Job state: queued, running, verified, failed
+    status = Column(String(20), default="queued", nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    locked_by = Column(String(100))  # Worker holding the lease while status is running
+    locked_until = Column(DateTime)
+    last_error = Column(Text)
+    
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    verified_at = Column(DateTime)
+    
+    __table_args__ = (
+        # Workers claim due jobs in next_attempt_at order
+        Index("ix_payment_verifications_due", "status", "next_attempt_at"),
+        # Webhooks find the job by the gateway's reference
+        Index("ix_payment_verifications_transaction", "gateway", "transaction_id"),
+    )
+
+
+class WalletAccount(Base):
+    """A user's wallet balance as of their latest ledger entry - kept by backend.wallet"""
+    __tablename__ = "wallet_accounts"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    balance = Column(Integer, default=0, nullable=False)  # Minor units (paisa/cents)
+    version = Column(Integer, default=0, nullable=False)  # Ledger entries posted so far
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        CheckConstraint("balance >= 0", name="ck_wallet_accounts_balance"),
+    )
+
+
+class WalletEntry(Base):
+    """Append-only wallet ledger - one row per balance change"""
+    __tablename__ = "wallet_ledger"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    version = Column(Integer, nullable=False)  # Account version this entry produced
+    amount = Column(Integer, nullable=False)  # Signed minor units: credits positive, debits negative
+    balance_after = Column(Integer, nullable=False)
+    kind = Column(String(30), nullable=False)  # topup, consultation, refund, adjustment
+    reference = Column(String(150), nullable=False)  # Idempotency reference, unique per user
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # One entry per account version - the ledger is a gap-free chain per user
+        UniqueConstraint("user_id", "version", name="uq_wallet_ledger_user_version"),
+        # Posting a reference twice must not move money twice
+        UniqueConstraint("user_id", "reference", name="uq_wallet_ledger_user_reference"),
+    )
 
 
 class Rating(Base):
@@ -178,6 +303,11 @@ class Rating(Base):
     
     # Relationships
     astrologer = relationship("User", back_populates="ratings", foreign_keys=[astrologer_id])
+    
+    __table_args__ = (
+        # One rating per question - the directory's sort=rating must not be stuffable
+        UniqueConstraint("user_id", "question_id", name="uq_ratings_user_question"),
+    )
 
 
 class Notification(Base):
@@ -197,6 +327,13 @@ class Notification(Base):
     
     # Relationships
     user = relationship("User", back_populates="notifications")
+    
+    __table_args__ = (
+        # Keyset pagination of a user's notifications
+        Index("ix_notifications_user_created_id", "user_id", "created_at", "id"),
+        # Unread counts and bulk mark-read
+        Index("ix_notifications_user_read", "user_id", "is_read"),
+    )
 
 
 class AstrologerQueue(Base):
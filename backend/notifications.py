@@ -3,56 +3,141 @@ Notification system for async email/SMS sending
 """
 
 import os
+import queue
+import random
 import smtplib
+import asyncio
+import threading
+from contextlib import contextmanager
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from typing import Optional, List
 from datetime import datetime
+from sqlalchemy import insert, inspect
 from sqlalchemy.orm import Session
 
+from backend.database import AsyncSessionLocal
+from backend.metrics import registry as metrics_registry
 from backend.models import Notification, User, Question, NotificationType
+from backend.unread import push_unread_counts
+
+NOTIFICATION_WORKERS = int(os.getenv("NOTIFICATION_WORKERS", 4))
+NOTIFICATION_QUEUE_SIZE = int(os.getenv("NOTIFICATION_QUEUE_SIZE", 10000))
+NOTIFICATION_MAX_RETRIES = int(os.getenv("NOTIFICATION_MAX_RETRIES", 3))
+NOTIFICATION_RETRY_DELAY = float(os.getenv("NOTIFICATION_RETRY_DELAY", 1.0))
+NOTIFICATION_BATCH_SIZE = int(os.getenv("NOTIFICATION_BATCH_SIZE", 200))
+NOTIFICATION_BATCH_DELAY = float(os.getenv("NOTIFICATION_BATCH_DELAY", 0.05))
+
+_NOTIFICATION_COLUMNS = [column.key for column in inspect(Notification).column_attrs if column.key != "id"]
+
+notifications_dropped = metrics_registry.counter(
+    "notifications_dropped_total", "Notification emails and rows given up on", ("kind", "reason")
+)
+
+
+class SMTPConnectionPool:
+    """Reuse logged-in SMTP connections instead of connecting per email"""
+    
+    def __init__(self, host: str, port: int, username: str = None, password: str = None,
+                 use_tls: bool = True, max_size: int = NOTIFICATION_WORKERS, timeout: float = 30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[smtplib.SMTP]" = queue.LifoQueue(maxsize=max_size)
+        self._lock = threading.Lock()
+        self.opened = 0
+    
+    def _open(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.use_tls:
+            server.starttls()
+        if self.username and self.password:
+            server.login(self.username, self.password)
+        with self._lock:
+            self.opened += 1
+        return server
+    
+    @contextmanager
+    def connection(self):
+        """Check out a connection; it is discarded instead of returned if sending fails"""
+        try:
+            server = self._idle.get_nowait()
+        except queue.Empty:
+            server = self._open()
+        
+        try:
+            yield server
+        except Exception:
+            self._discard(server)
+            raise
+        
+        try:
+            self._idle.put_nowait(server)
+        except queue.Full:
+            self._discard(server)
+    
+    def _discard(self, server: smtplib.SMTP):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+    
+    def close(self):
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                return
 
 
 class NotificationService:
     """Handle all notification operations"""
     
-    def __init__(self):
+    def __init__(self, session_factory=None):
         self.smtp_server = os.getenv("SMTP_SERVER", "smtp.gmail.com")
         self.smtp_port = int(os.getenv("SMTP_PORT", 587))
+        self.smtp_use_tls = os.getenv("SMTP_USE_TLS", "True").lower() == "true"
         self.email_user = os.getenv("EMAIL_USER")
         self.email_password = os.getenv("EMAIL_PASSWORD")
         self.from_email = os.getenv("FROM_EMAIL", "noreply@cosmosastrology.com")
+        self.smtp_pool = SMTPConnectionPool(
+            self.smtp_server, self.smtp_port, self.email_user, self.email_password, self.smtp_use_tls
+        )
+        self.dispatcher = NotificationDispatcher(self, session_factory)
+    
+    def deliver_email(self, to_email: str, subject: str, html_content: str):
+        """Send email over a pooled SMTP connection, raising on failure"""
+        if not self.email_user or not self.email_password:
+            print(f"Email credentials not configured. Would send to {to_email}: {subject}")
+            return
+        
+        message = MIMEMultipart("alternative")
+        message["Subject"] = subject
+        message["From"] = self.from_email
+        message["To"] = to_email
+        
+        # Attach HTML
+        part = MIMEText(html_content, "html")
+        message.attach(part)
+        
+        # Send email
+        with self.smtp_pool.connection() as server:
+            server.send_message(message)
     
     def send_email(self, to_email: str, subject: str, html_content: str) -> bool:
         """Send email via SMTP"""
         try:
-            if not self.email_user or not self.email_password:
-                print(f"Email credentials not configured. Would send to {to_email}: {subject}")
-                return True
-            
-            message = MIMEMultipart("alternative")
-            message["Subject"] = subject
-            message["From"] = self.from_email
-            message["To"] = to_email
-            
-            # Attach HTML
-            part = MIMEText(html_content, "html")
-            message.attach(part)
-            
-            # Send email
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls()
-                server.login(self.email_user, self.email_password)
-                server.send_message(message)
-            
-            print(f"Email sent to {to_email}")
+            self.deliver_email(to_email, subject, html_content)
             return True
         
         except Exception as e:
             print(f"Error sending email: {e}")
             return False
     
-    def notify_question_received(self, user: User, question: Question, db: Session):
+    def notify_question_received(self, user: User, question: Question, db: Session = None):
         """Notify user that their question was received"""
         notification = Notification(
             user_id=user.id,
@@ -61,8 +146,6 @@ class NotificationService:
             message=f"Your question '{question.title}' has been received and is in our queue.",
             related_question_id=question.id
         )
-        db.add(notification)
-        db.commit()
         
         # Send email
         html_content = f"""
@@ -80,9 +163,9 @@ class NotificationService:
         </html>
         """
         
-        self.send_email(user.email, notification.subject, html_content)
+        self.dispatcher.enqueue(notification, user.email, html_content, db)
     
-    def notify_question_assigned(self, user: User, question: Question, astrologer: User, db: Session):
+    def notify_question_assigned(self, user: User, question: Question, astrologer: User, db: Session = None):
         """Notify user when astrologer is assigned"""
         notification = Notification(
             user_id=user.id,
@@ -91,8 +174,6 @@ class NotificationService:
             message=f"Astrologer {astrologer.full_name or astrologer.username} has been assigned to answer your question.",
             related_question_id=question.id
         )
-        db.add(notification)
-        db.commit()
         
         html_content = f"""
         <html>
@@ -111,9 +192,9 @@ class NotificationService:
         </html>
         """
         
-        self.send_email(user.email, notification.subject, html_content)
+        self.dispatcher.enqueue(notification, user.email, html_content, db)
     
-    def notify_answer_provided(self, user: User, question: Question, astrologer: User, db: Session):
+    def notify_answer_provided(self, user: User, question: Question, astrologer: User, db: Session = None):
         """Notify user when answer is provided"""
         notification = Notification(
             user_id=user.id,
@@ -122,8 +203,6 @@ class NotificationService:
             message=f"Astrologer {astrologer.full_name or astrologer.username} has provided insights to your question.",
             related_question_id=question.id
         )
-        db.add(notification)
-        db.commit()
         
         html_content = f"""
         <html>
@@ -141,9 +220,9 @@ class NotificationService:
         </html>
         """
         
-        self.send_email(user.email, notification.subject, html_content)
+        self.dispatcher.enqueue(notification, user.email, html_content, db)
     
-    def notify_new_consultation_available(self, user: User, astrologer: User, db: Session):
+    def notify_new_consultation_available(self, user: User, astrologer: User, db: Session = None):
         """Notify user about paid consultation opportunity"""
         notification = Notification(
             user_id=user.id,
@@ -151,8 +230,6 @@ class NotificationService:
             subject="Schedule a Live Consultation with Your Astrologer",
             message=f"Schedule a personalized consultation with {astrologer.full_name or astrologer.username}"
         )
-        db.add(notification)
-        db.commit()
         
         html_content = f"""
         <html>
@@ -171,9 +248,9 @@ class NotificationService:
         </html>
         """
         
-        self.send_email(user.email, notification.subject, html_content)
+        self.dispatcher.enqueue(notification, user.email, html_content, db)
     
-    def notify_astrologer_new_question(self, astrologer: User, question: Question, user: User, db: Session):
+    def notify_astrologer_new_question(self, astrologer: User, question: Question, user: User, db: Session = None):
         """Notify astrologer about new question in queue"""
         notification = Notification(
             user_id=astrologer.id,
@@ -182,8 +259,6 @@ class NotificationService:
             message=f"A new {question.category} question from {user.full_name or user.username}",
             related_question_id=question.id
         )
-        db.add(notification)
-        db.commit()
         
         html_content = f"""
         <html>
@@ -201,7 +276,190 @@ class NotificationService:
         </html>
         """
         
-        self.send_email(astrologer.email, notification.subject, html_content)
+        self.dispatcher.enqueue(notification, astrologer.email, html_content, db)
+
+
+class NotificationDispatcher:
+    """Queue notifications so request handlers never wait on SMTP or a commit
+    
+    Notification rows are bulk-inserted by one writer task in small batches.
+    Emails are sent by a pool of worker tasks over pooled SMTP connections.
+    Both are retried with exponential backoff. When queue_size emails are
+    already waiting, further emails are shed (the rows are still
+    written) and counted in notifications_dropped_total.
+    """
+    
+    def __init__(
+        self,
+        service: NotificationService,
+        session_factory=None,
+        workers: int = NOTIFICATION_WORKERS,
+        max_retries: int = NOTIFICATION_MAX_RETRIES,
+        retry_delay: float = NOTIFICATION_RETRY_DELAY,
+        queue_size: int = NOTIFICATION_QUEUE_SIZE,
+        batch_size: int = NOTIFICATION_BATCH_SIZE,
+        batch_delay: float = NOTIFICATION_BATCH_DELAY
+    ):
+        self.service = service
+        self.session_factory = session_factory or AsyncSessionLocal
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.rows_written = 0
+        self.emails_sent = 0
+        self.emails_failed = 0
+        self.emails_dropped = 0
+        self.email_retries = 0
+        self.rows_failed = 0
+        self.row_retries = 0
+        self._loop = None
+        self._rows: Optional[asyncio.Queue] = None
+        self._emails: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+    
+    def enqueue(self, notification: Notification, to_email: Optional[str], html_content: str,
+                db: Session = None):
+        """Queue the row and the email; returns immediately"""
+        row = {key: getattr(notification, key) for key in _NOTIFICATION_COLUMNS}
+        row["created_at"] = row["created_at"] or datetime.utcnow()
+        row["is_read"] = bool(row["is_read"])
+        
+        try:
+            self._ensure_running()
+        except RuntimeError:
+            # No event loop (scripts, sync callers) - fall back to sending inline
+            self._deliver_inline(notification, to_email, html_content, db)
+            return
+        
+        self._rows.put_nowait(row)
+        if to_email:
+            try:
+                self._emails.put_nowait((to_email, row["subject"], html_content))
+            except asyncio.QueueFull:
+                # SMTP is far behind - shed the email rather than fail the request or grow without bound
+                self.emails_dropped += 1
+                notifications_dropped.inc("email", "queue_full")
+    
+    def _deliver_inline(self, notification, to_email, html_content, db: Session):
+        if db is not None:
+            db.add(notification)
+            db.commit()
+        if to_email:
+            self.service.send_email(to_email, notification.subject, html_content)
+    
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._tasks:
+            return
+        self._loop = loop
+        self._rows = asyncio.Queue()
+        self._emails = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [loop.create_task(self._write_rows())]
+        self._tasks += [loop.create_task(self._send_emails()) for _ in range(self.workers)]
+    
+    async def _write_rows(self):
+        while True:
+            batch = [await self._rows.get()]
+            deadline = self._loop.time() + self.batch_delay
+            while len(batch) < self.batch_size:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._rows.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            try:
+                await self._write_with_retry(batch)
+            finally:
+                for _ in batch:
+                    self._rows.task_done()
+    
+    async def _write_with_retry(self, rows: List[dict]):
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.write_rows(rows)
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print(f"Error writing {len(rows)} notifications: {e}")
+                    self.rows_failed += len(rows)
+                    notifications_dropped.inc("row", "write_failed", amount=len(rows))
+                    return
+                self.row_retries += 1
+                await asyncio.sleep(self._retry_backoff(attempt))
+    
+    async def write_rows(self, rows: List[dict]):
+        """Bulk insert notification rows in one statement, commit and push the new unread counts"""
+        async with self.session_factory() as db:
+            await db.execute(insert(Notification), rows)
+            await db.commit()
+            self.rows_written += len(rows)
+            # The rows are saved; a failed push must not make the caller write them again
+            try:
+                await push_unread_counts(db, [row["user_id"] for row in rows])
+            except Exception as e:
+                print(f"Error pushing unread counts: {e}")
+    
+    def _retry_backoff(self, attempt: int) -> float:
+        delay = self.retry_delay * (2 ** attempt)
+        return delay + random.uniform(0, delay / 2)
+    
+    async def _send_emails(self):
+        while True:
+            to_email, subject, html_content = await self._emails.get()
+            try:
+                await self._send_with_retry(to_email, subject, html_content)
+            finally:
+                self._emails.task_done()
+    
+    async def _send_with_retry(self, to_email: str, subject: str, html_content: str):
+        for attempt in range(self.max_retries + 1):
+            try:
+                # smtplib blocks, so it runs on a worker thread
+                await asyncio.to_thread(self.service.deliver_email, to_email, subject, html_content)
+                self.emails_sent += 1
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print(f"Error sending email to {to_email}: {e}")
+                    self.emails_failed += 1
+                    notifications_dropped.inc("email", "send_failed")
+                    return
+                self.email_retries += 1
+                await asyncio.sleep(self._retry_backoff(attempt))
+    
+    async def flush(self):
+        """Wait until everything queued has been written and sent"""
+        if not self._tasks:
+            return
+        await self._rows.join()
+        await self._emails.join()
+    
+    async def stop(self):
+        await self.flush()
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        await asyncio.to_thread(self.service.smtp_pool.close)
+    
+    def stats(self) -> dict:
+        return {
+            "queued_rows": self._rows.qsize() if self._rows else 0,
+            "queued_emails": self._emails.qsize() if self._emails else 0,
+            "rows_written": self.rows_written,
+            "emails_sent": self.emails_sent,
+            "emails_failed": self.emails_failed,
+            "emails_dropped": self.emails_dropped,
+            "email_retries": self.email_retries,
+            "rows_failed": self.rows_failed,
+            "row_retries": self.row_retries,
+            "smtp_connections_opened": self.service.smtp_pool.opened
+        }
 
 
 # Global notification service instance
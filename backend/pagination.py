@@ -0,0 +1,64 @@
+"""
+Keyset (cursor) pagination helpers
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Sequence
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(values: Sequence) -> str:
+    """Pack the sort key of the last row into an opaque URL-safe token"""
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str], types: Sequence[type]) -> Optional[list]:
+    """Unpack a cursor made by encode_cursor, converting values back to types"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        if len(payload) != len(types):
+            raise ValueError("cursor length mismatch")
+        return [
+            None if value is None else (datetime.fromisoformat(value) if kind is datetime else kind(value))
+            for value, kind in zip(payload, types)
+        ]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_after(keys: Sequence, values: Sequence):
+    """WHERE clause selecting rows that sort after values
+
+    keys is a list of (column, descending) pairs in ORDER BY order.
+    """
+    clauses = []
+    for index, (column, descending) in enumerate(keys):
+        equal_prefix = [keys[i][0] == values[i] for i in range(index)]
+        step = column < values[index] if descending else column > values[index]
+        clauses.append(and_(*equal_prefix, step))
+    return or_(*clauses)
+
+
+def keyset_order(keys: Sequence):
+    """ORDER BY clauses matching keyset_after"""
+    return [column.desc() if descending else column.asc() for column, descending in keys]
+
+
+def page_cursor(rows: list, limit: int, key_of) -> Optional[str]:
+    """Cursor for the next page, or None when rows is the last page
+
+    Callers fetch limit + 1 rows; the extra row only signals that more exist.
+    """
+    if len(rows) <= limit:
+        return None
+    del rows[limit:]
+    return encode_cursor(key_of(rows[-1]))
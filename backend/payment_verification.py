@@ -0,0 +1,525 @@
+"""
+Asynchronous, idempotent payment verification
+
+Request handlers never call a gateway to verify a payment. They queue a
+PaymentVerification row keyed by an idempotency key - the client's
+Idempotency-Key header, or gateway:transaction_id - so a retried request
+finds the job it already created instead of verifying twice.
+
+Worker tasks in every process claim due jobs with a conditional UPDATE that
+takes a short lease, so any number of workers and processes share one queue
+and a job whose worker died is picked up again once its lease runs out:
+
+    PAYMENT_VERIFY_WORKERS        worker tasks per process
+    PAYMENT_VERIFY_MAX_ATTEMPTS   gateway checks before a job fails
+    PAYMENT_VERIFY_BACKOFF        first retry delay in seconds, doubled per attempt
+    PAYMENT_VERIFY_MAX_BACKOFF    cap on the retry delay
+    PAYMENT_VERIFY_LEASE          seconds a worker may hold a job
+    PAYMENT_VERIFY_POLL           idle workers look for due jobs this often
+    PAYMENT_RECONCILE_INTERVAL    seconds between reconciliation sweeps
+    PAYMENT_PENDING_TIMEOUT       pending payments with no live job fail after this long
+    PAYMENT_WEBHOOK_SECRET        shared secret gateway callbacks must carry
+
+Gateways that call back hit the webhook, which only makes the job due now -
+the payment is still confirmed by asking the gateway, so a forged callback
+cannot mark anything paid. Gateways that never call back are polled with
+exponential backoff.
+
+Consultation.payment_status moves through PAYMENT_TRANSITIONS, each move a
+conditional UPDATE, so a late or duplicate verification cannot undo a
+refund or pay a consultation for a payment it no longer refers to.
+"""
+
+import asyncio
+import hmac
+import os
+import random
+import socket
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.broadcast import broadcaster
+from backend.database import AsyncSessionLocal
+from backend.metrics import registry as metrics_registry
+from backend.models import Consultation, Notification, NotificationType, PaymentStatus, PaymentVerification
+from backend.payments import PaymentGateway, PaymentProcessor, payment_processor
+from backend.unread import push_unread_counts
+
+VERIFY_WORKERS = int(os.getenv("PAYMENT_VERIFY_WORKERS", 4))
+VERIFY_MAX_ATTEMPTS = int(os.getenv("PAYMENT_VERIFY_MAX_ATTEMPTS", 8))
+VERIFY_BACKOFF = float(os.getenv("PAYMENT_VERIFY_BACKOFF", 5))
+VERIFY_MAX_BACKOFF = float(os.getenv("PAYMENT_VERIFY_MAX_BACKOFF", 600))
+VERIFY_LEASE = float(os.getenv("PAYMENT_VERIFY_LEASE", 60))
+VERIFY_POLL = float(os.getenv("PAYMENT_VERIFY_POLL", 1))
+RECONCILE_INTERVAL = float(os.getenv("PAYMENT_RECONCILE_INTERVAL", 300))
+PENDING_TIMEOUT = float(os.getenv("PAYMENT_PENDING_TIMEOUT", 86400))
+WEBHOOK_SECRET = os.getenv("PAYMENT_WEBHOOK_SECRET", "")
+
+WAKE_CHANNEL = "payments:wake"
+
+# Which payment states each state may be entered from
+PAYMENT_TRANSITIONS = {
+    PaymentStatus.PENDING: (PaymentStatus.UNPAID, PaymentStatus.FAILED),
+    PaymentStatus.PAID: (PaymentStatus.PENDING,),
+    PaymentStatus.FAILED: (PaymentStatus.PENDING,),
+    PaymentStatus.REFUNDED: (PaymentStatus.PAID,),
+}
+
+# Where each gateway's callback carries the reference we queued the job under
+WEBHOOK_REFERENCES = {
+    "paypal": ("resource.parent_payment", "resource.id", "id"),
+    "khalti": ("transaction_id", "pidx", "token"),
+    "esewa": ("transaction_uuid", "oid", "pid"),
+    "stripe": ("data.object.id",),
+}
+
+verifications = metrics_registry.counter(
+    "payment_verifications_total", "Payment verification jobs by outcome", ("gateway", "outcome")
+)
+
+
+class PaymentStateError(Exception):
+    """The consultation's payment is not in a state that allows the change"""
+
+
+def idempotency_key(gateway: str, transaction_id: str, key: Optional[str] = None) -> str:
+    """The client's key when it sent one, otherwise one job per gateway transaction"""
+    return key or f"{gateway}:{transaction_id}"
+
+
+async def move_payment(db: AsyncSession, consultation_id: int, to: PaymentStatus,
+                       for_payment: Optional[str] = None, **values) -> bool:
+    """Move a consultation's payment to `to` if its current state allows it
+
+    With for_payment the consultation must also still refer to that payment.
+    Returns False, changing nothing, when the transition is not allowed.
+    """
+    conditions = [
+        Consultation.id == consultation_id,
+        Consultation.payment_status.in_([state.value for state in PAYMENT_TRANSITIONS[to]])
+    ]
+    if for_payment is not None:
+        conditions.append(Consultation.payment_id == for_payment)
+    result = await db.execute(
+        update(Consultation)
+        .where(*conditions)
+        .values(payment_status=to.value, updated_at=datetime.utcnow(), **values)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+async def enqueue_verification(
+    db: AsyncSession,
+    user_id: int,
+    gateway: PaymentGateway,
+    transaction_id: str,
+    verification_data: Dict,
+    consultation_id: Optional[int] = None,
+    key: Optional[str] = None
+) -> PaymentVerification:
+    """Queue a verification, or return the job already queued under the same key
+
+    Queuing moves the consultation to pending on this payment; raises
+    PaymentStateError if it is already paid or pending on another payment.
+    """
+    key = idempotency_key(gateway.value, transaction_id, key)
+    existing = await db.scalar(select(PaymentVerification).where(or_(
+        PaymentVerification.idempotency_key == key,
+        # A new key for a transaction that is still being verified is a retry too
+        and_(
+            PaymentVerification.gateway == gateway.value,
+            PaymentVerification.transaction_id == transaction_id,
+            PaymentVerification.status.in_(["queued", "running", "verified"])
+        )
+    )).order_by(PaymentVerification.id))
+    if existing is not None:
+        return existing
+
+    if consultation_id is not None:
+        moved = await move_payment(db, consultation_id, PaymentStatus.PENDING, payment_id=transaction_id)
+        if not moved:
+            current = await db.scalar(select(Consultation.payment_status).where(Consultation.id == consultation_id))
+            await db.rollback()
+            raise PaymentStateError(f"Consultation payment is {current or 'missing'}")
+
+    job = PaymentVerification(
+        idempotency_key=key,
+        user_id=user_id,
+        consultation_id=consultation_id,
+        gateway=gateway.value,
+        transaction_id=transaction_id,
+        verification_data=verification_data,
+        status="queued",
+        attempts=0,
+        next_attempt_at=datetime.utcnow()
+    )
+    db.add(job)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # A concurrent request with the same key won the insert
+        await db.rollback()
+        return await db.scalar(select(PaymentVerification).where(PaymentVerification.idempotency_key == key))
+
+    verifications.inc(gateway.value, "queued")
+    return job
+
+
+def webhook_authorized(token: Optional[str]) -> bool:
+    """Callbacks must carry the shared secret; none are accepted until one is configured"""
+    return bool(WEBHOOK_SECRET) and token is not None and hmac.compare_digest(token.encode(), WEBHOOK_SECRET.encode())
+
+
+def webhook_reference(gateway: str, payload: Dict) -> Optional[str]:
+    """The transaction reference in a gateway callback, if it has one we know"""
+    for path in WEBHOOK_REFERENCES.get(gateway, ()):
+        value = payload
+        for part in path.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+        if value:
+            return str(value)
+    return None
+
+
+class PaymentVerificationQueue:
+    """Run queued verifications on worker tasks that share the database queue"""
+
+    def __init__(
+        self,
+        processor: PaymentProcessor = None,
+        session_factory=None,
+        workers: int = VERIFY_WORKERS,
+        max_attempts: int = VERIFY_MAX_ATTEMPTS,
+        backoff: float = VERIFY_BACKOFF,
+        max_backoff: float = VERIFY_MAX_BACKOFF,
+        lease: float = VERIFY_LEASE,
+        poll_interval: float = VERIFY_POLL,
+        reconcile_interval: float = RECONCILE_INTERVAL,
+        pending_timeout: float = PENDING_TIMEOUT
+    ):
+        self.processor = processor or payment_processor
+        self.session_factory = session_factory or AsyncSessionLocal
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.reconcile_interval = reconcile_interval
+        self.pending_timeout = pending_timeout
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.verified = 0
+        self.failed = 0
+        self.retried = 0
+        self.lost_leases = 0
+        self.webhooks = 0
+        self.unmatched_webhooks = 0
+        self.last_reconcile: Optional[Dict] = None
+        self._loop = None
+        self._stopping = False
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._tasks:
+            return
+        self._loop = loop
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._tasks = [loop.create_task(self._work(f"{self.name}:{n}")) for n in range(self.workers)]
+        self._tasks.append(loop.create_task(self._reconcile_periodically()))
+
+    async def start(self):
+        broadcaster.subscribe(WAKE_CHANNEL, self._on_wake)
+        self._ensure_running()
+
+    async def stop(self, timeout: float = 10):
+        """Let workers finish the job they hold, then stop them"""
+        if not self._tasks:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        workers, reconciler = self._tasks[:-1], self._tasks[-1]
+        reconciler.cancel()
+        _, unfinished = await asyncio.wait(workers, timeout=timeout)
+        # A job still held when its worker is cancelled is retried once the lease expires
+        for task in unfinished:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def wake(self):
+        """Have idle workers look for due jobs now, in every process"""
+        if self._tasks and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        if broadcaster.distributed:
+            broadcaster.publish_threadsafe(WAKE_CHANNEL, "")
+
+    async def _on_wake(self, channel: str, payload: str):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _work(self, worker: str):
+        while not self._stopping:
+            try:
+                ran = await self.run_next(worker)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Payment verification worker error: {e}")
+                ran = False
+            if ran or self._stopping:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _reconcile_periodically(self):
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            try:
+                await self.reconcile()
+            except Exception as e:
+                print(f"Payment reconciliation error: {e}")
+
+    def _due(self, now: datetime):
+        return or_(
+            and_(PaymentVerification.status == "queued", PaymentVerification.next_attempt_at <= now),
+            and_(PaymentVerification.status == "running", PaymentVerification.locked_until < now)
+        )
+
+    async def claim(self, worker: str) -> Optional[PaymentVerification]:
+        """Lease one due job to worker; None when nothing is due"""
+        now = datetime.utcnow()
+        async with self.session_factory() as db:
+            candidates = (await db.scalars(
+                select(PaymentVerification.id)
+                .where(self._due(now))
+                .order_by(PaymentVerification.next_attempt_at)
+                .limit(self.workers * 2)
+            )).all()
+            # Workers that read the same candidates mostly try different ones first
+            random.shuffle(candidates)
+            for job_id in candidates:
+                result = await db.execute(
+                    update(PaymentVerification)
+                    .where(PaymentVerification.id == job_id, self._due(now))
+                    .values(
+                        status="running",
+                        locked_by=worker,
+                        locked_until=now + timedelta(seconds=self.lease),
+                        attempts=PaymentVerification.attempts + 1,
+                        updated_at=now
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+                if result.rowcount == 1:
+                    await db.commit()
+                    return await db.get(PaymentVerification, job_id)
+            await db.rollback()
+        return None
+
+    async def run_next(self, worker: str) -> bool:
+        """Claim and verify one due job; False when nothing was due"""
+        job = await self.claim(worker)
+        if job is None:
+            return False
+
+        error = None
+        try:
+            verified = await self.processor.verify_payment(
+                PaymentGateway(job.gateway), job.transaction_id, job.verification_data or {}
+            )
+            if not verified:
+                error = "Gateway did not confirm the payment"
+        except Exception as e:
+            verified = False
+            error = str(e) or type(e).__name__
+
+        await self._finish(job, worker, verified, error)
+        return True
+
+    def retry_delay(self, attempts: int) -> float:
+        delay = min(self.max_backoff, self.backoff * (2 ** (attempts - 1)))
+        return delay + random.uniform(0, delay / 2)
+
+    async def _finish(self, job: PaymentVerification, worker: str, verified: bool, error: Optional[str]):
+        now = datetime.utcnow()
+        if verified:
+            outcome = "verified"
+            values = {"status": "verified", "verified_at": now, "last_error": None}
+        elif job.attempts >= self.max_attempts:
+            outcome = "failed"
+            values = {"status": "failed", "last_error": error}
+        else:
+            outcome = "retried"
+            values = {
+                "status": "queued",
+                "next_attempt_at": now + timedelta(seconds=self.retry_delay(job.attempts)),
+                "last_error": error
+            }
+
+        async with self.session_factory() as db:
+            # Only the lease holder may finish the job
+            result = await db.execute(
+                update(PaymentVerification)
+                .where(
+                    PaymentVerification.id == job.id,
+                    PaymentVerification.status == "running",
+                    PaymentVerification.locked_by == worker
+                )
+                .values(locked_by=None, locked_until=None, updated_at=now, **values)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount != 1:
+                await db.rollback()
+                self.lost_leases += 1
+                verifications.inc(job.gateway, "lease_lost")
+                return
+
+            notify = False
+            if job.consultation_id is not None and outcome != "retried":
+                notify = await self._settle(db, job, outcome)
+            await db.commit()
+            if notify:
+                await push_unread_counts(db, [job.user_id])
+
+        verifications.inc(job.gateway, outcome)
+        if outcome == "verified":
+            self.verified += 1
+        elif outcome == "failed":
+            self.failed += 1
+        else:
+            self.retried += 1
+
+    async def _settle(self, db: AsyncSession, job: PaymentVerification, outcome: str) -> bool:
+        """Apply a finished job to its consultation; True when the user was notified"""
+        if outcome == "failed":
+            await move_payment(db, job.consultation_id, PaymentStatus.FAILED, for_payment=job.transaction_id)
+            return False
+
+        if not await move_payment(db, job.consultation_id, PaymentStatus.PAID, for_payment=job.transaction_id):
+            return False
+        db.add(Notification(
+            user_id=job.user_id,
+            type=NotificationType.PAYMENT_CONFIRMED,
+            subject="Payment Confirmed",
+            message="Your consultation payment has been confirmed.",
+            created_at=datetime.utcnow()
+        ))
+        return True
+
+    async def ingest_webhook(self, gateway: PaymentGateway, payload: Dict) -> Optional[int]:
+        """Make the job a gateway callback refers to due now; returns its id, if any"""
+        self.webhooks += 1
+        reference = webhook_reference(gateway.value, payload)
+        job_id = None
+        if reference:
+            async with self.session_factory() as db:
+                job_id = await db.scalar(
+                    select(PaymentVerification.id)
+                    .where(PaymentVerification.gateway == gateway.value, PaymentVerification.transaction_id == reference)
+                    .order_by(PaymentVerification.id.desc())
+                )
+                if job_id is not None:
+                    await db.execute(
+                        update(PaymentVerification)
+                        .where(PaymentVerification.id == job_id, PaymentVerification.status == "queued")
+                        .values(next_attempt_at=datetime.utcnow())
+                        .execution_options(synchronize_session=False)
+                    )
+                    await db.commit()
+
+        if job_id is None:
+            self.unmatched_webhooks += 1
+            verifications.inc(gateway.value, "webhook_unmatched")
+            return None
+        verifications.inc(gateway.value, "webhook")
+        self.wake()
+        return job_id
+
+    async def reconcile(self) -> Dict:
+        """Repair what a crash between steps can leave behind
+
+        Expired leases go back on the queue, finished jobs are applied to
+        consultations that missed the update, and payments left pending with
+        no live job past PAYMENT_PENDING_TIMEOUT are failed.
+        """
+        now = datetime.utcnow()
+        report = {"requeued": 0, "paid": 0, "failed": 0, "abandoned": 0}
+        async with self.session_factory() as db:
+            result = await db.execute(
+                update(PaymentVerification)
+                .where(PaymentVerification.status == "running", PaymentVerification.locked_until < now)
+                .values(status="queued", locked_by=None, locked_until=None, next_attempt_at=now)
+                .execution_options(synchronize_session=False)
+            )
+            report["requeued"] = result.rowcount
+
+            finished = (await db.execute(
+                select(PaymentVerification.id, PaymentVerification.status, PaymentVerification.consultation_id,
+                       PaymentVerification.transaction_id, PaymentVerification.user_id)
+                .join(Consultation, and_(
+                    Consultation.id == PaymentVerification.consultation_id,
+                    Consultation.payment_id == PaymentVerification.transaction_id
+                ))
+                .where(
+                    Consultation.payment_status == PaymentStatus.PENDING.value,
+                    PaymentVerification.status.in_(["verified", "failed"])
+                )
+            )).all()
+            notified = []
+            for job in finished:
+                outcome = "verified" if job.status == "verified" else "failed"
+                if await self._settle(db, job, outcome):
+                    notified.append(job.user_id)
+                report["paid" if outcome == "verified" else "failed"] += 1
+
+            live_job = select(PaymentVerification.id).where(
+                PaymentVerification.consultation_id == Consultation.id,
+                PaymentVerification.transaction_id == Consultation.payment_id,
+                PaymentVerification.status.in_(["queued", "running", "verified"])
+            ).exists()
+            result = await db.execute(
+                update(Consultation)
+                .where(
+                    Consultation.payment_status == PaymentStatus.PENDING.value,
+                    Consultation.updated_at < now - timedelta(seconds=self.pending_timeout),
+                    ~live_job
+                )
+                .values(payment_status=PaymentStatus.FAILED.value, updated_at=now)
+                .execution_options(synchronize_session=False)
+            )
+            report["abandoned"] = result.rowcount
+            await db.commit()
+            if notified:
+                await push_unread_counts(db, notified)
+
+        if report["requeued"]:
+            self.wake()
+        self.last_reconcile = {"at": now.isoformat(), **report}
+        return report
+
+    def stats(self) -> dict:
+        return {
+            "workers": len([task for task in self._tasks if not task.done()]),
+            "verified": self.verified,
+            "failed": self.failed,
+            "retried": self.retried,
+            "lost_leases": self.lost_leases,
+            "webhooks": self.webhooks,
+            "unmatched_webhooks": self.unmatched_webhooks,
+            "last_reconcile": self.last_reconcile
+        }
+
+
+# Global verification queue
+verification_queue = PaymentVerificationQueue()
@@ -1,11 +1,24 @@
 """
 Payment integration module - connects to real payment gateways
+
+Gateway calls go through the shared pooled client in backend.http_client and
+never block the event loop. Base URLs can be pointed at a sandbox or at the
+fake gateway in backend.testing with PAYPAL_API_URL, KHALTI_API_URL and
+ESEWA_API_URL.
 """
 
+import asyncio
+import hashlib
+import os
+import uuid
+from datetime import datetime
 from typing import Optional, Dict
 from enum import Enum
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from backend.models import Consultation, User, Question
+from backend.http_client import GatewayClient, GatewayUnavailable, gateway_client
+from backend.token_cache import AccessTokenCache, paypal_tokens
+from backend import wallet
 
 
 class PaymentGateway(str, Enum):
@@ -20,38 +33,44 @@ class PaymentGateway(str, Enum):
 class PaymentProcessor:
     """Handle payments for consultations"""
     
-    def __init__(self):
-        import os
+    def __init__(self, client: GatewayClient = None, tokens: AccessTokenCache = None):
+        self.client = client or gateway_client
+        self.tokens = tokens or paypal_tokens
         self.khalti_key = os.getenv("KHALTI_PUBLIC_KEY")
         self.esewa_key = os.getenv("ESEWA_MERCHANT_CODE")
         self.paypal_client_id = os.getenv("PAYPAL_CLIENT_ID")
+        self.paypal_secret = os.getenv("PAYPAL_SECRET")
         self.stripe_key = os.getenv("STRIPE_SECRET_KEY")
+        self.paypal_url = os.getenv("PAYPAL_API_URL", "https://api.paypal.com").rstrip("/")
+        self.khalti_url = os.getenv("KHALTI_API_URL", "https://khalti.com/api/v2").rstrip("/")
+        self.esewa_url = os.getenv("ESEWA_API_URL", "https://uat.esewa.com.np/epay").rstrip("/")
     
-    def process_consultation_payment(
+    async def process_consultation_payment(
         self,
         user_id: int,
         astrologer_id: int,
         amount: float,
         gateway: PaymentGateway,
-        db: Session
+        db: AsyncSession,
+        reference: Optional[str] = None
     ) -> Dict:
         """Process payment for consultation"""
         
         try:
             if gateway == PaymentGateway.KHALTI:
-                return self.process_khalti_payment(amount, user_id)
+                return await self.process_khalti_payment(amount, user_id)
             
             elif gateway == PaymentGateway.ESEWA:
-                return self.process_esewa_payment(amount, user_id)
+                return await self.process_esewa_payment(amount, user_id)
             
             elif gateway == PaymentGateway.PAYPAL:
-                return self.process_paypal_payment(amount, user_id)
+                return await self.process_paypal_payment(amount, user_id)
             
             elif gateway == PaymentGateway.STRIPE:
-                return self.process_stripe_payment(amount, user_id)
+                return await self.process_stripe_payment(amount, user_id)
             
             elif gateway == PaymentGateway.WALLET:
-                return self.process_wallet_payment(amount, user_id, db)
+                return await self.process_wallet_payment(amount, user_id, db, reference)
             
             else:
                 return {"success": False, "error": "Unknown gateway"}
@@ -59,10 +78,8 @@ class PaymentProcessor:
         except Exception as e:
             return {"success": False, "error": str(e)}
     
-    def process_khalti_payment(self, amount: float, user_id: int) -> Dict:
+    async def process_khalti_payment(self, amount: float, user_id: int) -> Dict:
         """Process Khalti payment"""
-        import requests
-        
         try:
             # Convert to paisa (1 NPR = 100 paisa)
             amount_paisa = int(amount * 100)
@@ -87,11 +104,8 @@ class PaymentProcessor:
         except Exception as e:
             return {"success": False, "error": str(e)}
     
-    def process_esewa_payment(self, amount: float, user_id: int) -> Dict:
+    async def process_esewa_payment(self, amount: float, user_id: int) -> Dict:
         """Process eSewa payment"""
-        import hashlib
-        import uuid
-        
         try:
             transaction_uuid = str(uuid.uuid4())
             
@@ -106,30 +120,40 @@ class PaymentProcessor:
                 "transaction_uuid": transaction_uuid,
                 "signature": signature,
                 "merchant_code": self.esewa_key,
-                "payment_url": "https://uat.esewa.com.np/epay/main"
+                "payment_url": f"{self.esewa_url}/main"
             }
         
         except Exception as e:
             return {"success": False, "error": str(e)}
     
-    def process_paypal_payment(self, amount: float, user_id: int) -> Dict:
+    @property
+    def paypal_token_key(self):
+        return (f"{self.paypal_url}/v1/oauth2/token", self.paypal_client_id)
+    
+    async def get_paypal_token(self) -> Optional[str]:
+        """OAuth token for the PayPal REST API, cached until shortly before it expires"""
+        return await self.tokens.get(self.paypal_token_key, self.fetch_paypal_token)
+    
+    async def fetch_paypal_token(self):
+        auth_response = await self.client.post(
+            "paypal",
+            f"{self.paypal_url}/v1/oauth2/token",
+            auth=(self.paypal_client_id or "", self.paypal_secret or ""),
+            data={"grant_type": "client_credentials"},
+            retry=True
+        )
+        if auth_response.status_code != 200:
+            return None
+        token = auth_response.json()
+        return token['access_token'], token.get('expires_in', 0)
+    
+    async def process_paypal_payment(self, amount: float, user_id: int) -> Dict:
         """Process PayPal payment"""
-        import requests
-        
         try:
-            # Get access token
-            auth_response = requests.post(
-                "https://api.paypal.com/v1/oauth2/token",
-                auth=(self.paypal_client_id, os.getenv("PAYPAL_SECRET")),
-                data={"grant_type": "client_credentials"},
-                timeout=10
-            )
-            
-            if auth_response.status_code != 200:
+            access_token = await self.get_paypal_token()
+            if not access_token:
                 return {"success": False, "error": "Failed to authenticate with PayPal"}
             
-            access_token = auth_response.json()['access_token']
-            
             # Create payment
             payment_data = {
                 "intent": "sale",
@@ -160,13 +184,17 @@ class PaymentProcessor:
                 }
             }
             
-            response = requests.post(
-                "https://api.paypal.com/v1/payments/payment",
+            # Not retried after a response or timeout - the payment may already exist
+            response = await self.client.post(
+                "paypal",
+                f"{self.paypal_url}/v1/payments/payment",
                 json=payment_data,
-                headers={"Authorization": f"Bearer {access_token}"},
-                timeout=10
+                headers={"Authorization": f"Bearer {access_token}"}
             )
             
+            if response.status_code == 401:
+                self.tokens.invalidate(self.paypal_token_key)
+            
             if response.status_code == 201:
                 payment = response.json()
                 # Find approval link
@@ -189,14 +217,15 @@ class PaymentProcessor:
         except Exception as e:
             return {"success": False, "error": str(e)}
     
-    def process_stripe_payment(self, amount: float, user_id: int) -> Dict:
+    async def process_stripe_payment(self, amount: float, user_id: int) -> Dict:
         """Process Stripe payment"""
         try:
             import stripe
             stripe.api_key = self.stripe_key
             
-            # Create payment intent
-            intent = stripe.PaymentIntent.create(
+            # The Stripe SDK is synchronous, so it runs in a worker thread
+            intent = await asyncio.to_thread(
+                stripe.PaymentIntent.create,
                 amount=int(amount * 100),  # Convert to cents
                 currency="usd",
                 metadata={
@@ -216,43 +245,42 @@ class PaymentProcessor:
         except Exception as e:
             return {"success": False, "error": str(e)}
     
-    def process_wallet_payment(self, amount: float, user_id: int, db: Session) -> Dict:
-        """Process wallet-based payment"""
+    async def process_wallet_payment(self, amount: float, user_id: int, db: AsyncSession,
+                                     reference: Optional[str] = None) -> Dict:
+        """Debit the wallet ledger - repeating a reference does not charge twice"""
         try:
-            from models import User
-            
-            user = db.query(User).filter(User.id == user_id).first()
-            if not user:
-                return {"success": False, "error": "User not found"}
-            
-            # Check wallet balance (would need to implement wallet table)
-            # For now, assume sufficient balance
+            entry = await wallet.debit(
+                db, user_id, wallet.to_minor(amount), "consultation", reference or f"consultation:{uuid.uuid4()}"
+            )
             
             return {
                 "success": True,
                 "gateway": "wallet",
                 "amount": amount,
-                "transaction_id": f"wallet_{user_id}_{datetime.utcnow().timestamp()}"
+                "transaction_id": f"wallet_{entry.id}",
+                "balance": wallet.from_minor(entry.balance_after)
             }
         
+        except wallet.InsufficientFunds:
+            return {"success": False, "error": "Insufficient wallet balance"}
         except Exception as e:
             return {"success": False, "error": str(e)}
     
-    def verify_payment(self, gateway: PaymentGateway, transaction_id: str, verification_data: Dict) -> bool:
+    async def verify_payment(self, gateway: PaymentGateway, transaction_id: str, verification_data: Dict) -> bool:
         """Verify payment from gateway"""
         
         try:
             if gateway == PaymentGateway.KHALTI:
-                return self.verify_khalti(transaction_id, verification_data)
+                return await self.verify_khalti(transaction_id, verification_data)
             
             elif gateway == PaymentGateway.ESEWA:
-                return self.verify_esewa(transaction_id, verification_data)
+                return await self.verify_esewa(transaction_id, verification_data)
             
             elif gateway == PaymentGateway.PAYPAL:
-                return self.verify_paypal(transaction_id, verification_data)
+                return await self.verify_paypal(transaction_id, verification_data)
             
             elif gateway == PaymentGateway.STRIPE:
-                return self.verify_stripe(transaction_id, verification_data)
+                return await self.verify_stripe(transaction_id, verification_data)
             
             elif gateway == PaymentGateway.WALLET:
                 return True  # Wallet payments don't need external verification
@@ -263,83 +291,72 @@ class PaymentProcessor:
             print(f"Payment verification error: {e}")
             return False
     
-    def verify_khalti(self, transaction_id: str, verification_data: Dict) -> bool:
+    async def verify_khalti(self, transaction_id: str, verification_data: Dict) -> bool:
         """Verify Khalti payment"""
-        import requests
-        
         try:
-            response = requests.post(
-                "https://khalti.com/api/v2/payment/verify/",
+            # Verification only reads the payment's state, so it is safe to retry
+            response = await self.client.post(
+                "khalti",
+                f"{self.khalti_url}/payment/verify/",
                 json={"token": verification_data.get("token")},
                 headers={"Authorization": f"Key {self.khalti_key}"},
-                timeout=10
+                retry=True
             )
             return response.status_code == 200
-        except:
+        except GatewayUnavailable:
             return False
     
-    def verify_esewa(self, transaction_id: str, verification_data: Dict) -> bool:
+    async def verify_esewa(self, transaction_id: str, verification_data: Dict) -> bool:
         """Verify eSewa payment"""
-        import requests
-        
         try:
-            response = requests.post(
-                "https://uat.esewa.com.np/epay/transrec",
+            response = await self.client.post(
+                "esewa",
+                f"{self.esewa_url}/transrec",
                 data=verification_data,
-                timeout=10
+                retry=True
             )
             return "Success" in response.text
-        except:
+        except GatewayUnavailable:
             return False
     
-    def verify_paypal(self, transaction_id: str, verification_data: Dict) -> bool:
+    async def verify_paypal(self, transaction_id: str, verification_data: Dict) -> bool:
         """Verify PayPal payment"""
-        import requests
-        
         try:
             # Use PaymentID from verification_data
             payment_id = verification_data.get("paymentId")
             payer_id = verification_data.get("payerId")
             
-            # Get PayPal token (simplified)
-            auth_response = requests.post(
-                "https://api.paypal.com/v1/oauth2/token",
-                auth=(self.paypal_client_id, os.getenv("PAYPAL_SECRET")),
-                data={"grant_type": "client_credentials"},
-                timeout=10
-            )
-            
-            if auth_response.status_code != 200:
+            access_token = await self.get_paypal_token()
+            if not access_token:
                 return False
             
-            access_token = auth_response.json()['access_token']
-            
-            # Execute payment
-            response = requests.post(
-                f"https://api.paypal.com/v1/payments/payment/{payment_id}/execute",
+            # Execute payment - PayPal replays the first answer for a repeated
+            # request id, so verification jobs can safely run it again
+            response = await self.client.post(
+                "paypal",
+                f"{self.paypal_url}/v1/payments/payment/{payment_id}/execute",
                 json={"payer_id": payer_id},
-                headers={"Authorization": f"Bearer {access_token}"},
-                timeout=10
+                headers={"Authorization": f"Bearer {access_token}", "PayPal-Request-Id": f"execute-{payment_id}"},
+                retry=True
             )
+            if response.status_code == 401:
+                self.tokens.invalidate(self.paypal_token_key)
             
             return response.status_code in [200, 201]
-        except:
+        except GatewayUnavailable:
             return False
     
-    def verify_stripe(self, transaction_id: str, verification_data: Dict) -> bool:
+    async def verify_stripe(self, transaction_id: str, verification_data: Dict) -> bool:
         """Verify Stripe payment"""
         try:
             import stripe
             stripe.api_key = self.stripe_key
             
-            intent = stripe.PaymentIntent.retrieve(transaction_id)
+            intent = await asyncio.to_thread(stripe.PaymentIntent.retrieve, transaction_id)
             return intent['status'] == 'succeeded'
-        except:
+        except Exception:
             return False
 
 
 # Global payment processor instance
 payment_processor = PaymentProcessor()
-
-from datetime import datetime
-import os
@@ -0,0 +1,117 @@
+"""
+Short-lived cache of authenticated users so get_current_user can skip the users lookup
+
+Committed user changes are invalidated in the writing process, and
+published on the broadcaster so other workers drop their copy too. With the
+default in-process broadcaster (no BROADCAST_URL) other workers are not
+told, and a revoked role or is_active=False can take up to
+PRINCIPAL_CACHE_TTL seconds (10 by default) to apply everywhere.
+
+ORM flushes and ORM-enabled bulk update()/delete() statements invalidate
+entries. Core statements run directly on a Connection, such as
+connection.execute(update(User.__table__)), bypass the Session and are
+not seen; call principal_cache.invalidate()/clear() after them.
+"""
+
+import os
+from typing import Optional
+
+from sqlalchemy import event, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from backend.broadcast import broadcaster
+from backend.cache import TTLCache
+from backend.models import User
+
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", 10))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", 10000))
+
+_USER_COLUMNS = [column.key for column in inspect(User).column_attrs]
+
+
+class PrincipalCache:
+    """Cache user column snapshots keyed by user id"""
+
+    def __init__(self, maxsize: int = PRINCIPAL_CACHE_SIZE, ttl: float = PRINCIPAL_CACHE_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def put(self, user: User):
+        """Remember the loaded column values of a user"""
+        self._cache.set(user.id, {key: getattr(user, key) for key in _USER_COLUMNS})
+
+    async def get(self, user_id: int, db: AsyncSession) -> Optional[User]:
+        """Return the cached user attached to db without emitting a SELECT"""
+        snapshot = self._cache.get(user_id)
+        if snapshot is None:
+            return None
+
+        user = User(**snapshot)
+        make_transient_to_detached(user)
+        return await db.merge(user, load=False)
+
+    def invalidate(self, user_id: int):
+        self._cache.invalidate(user_id)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+# Global principal cache instance
+principal_cache = PrincipalCache()
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    """Role, is_active or profile changes must be visible on the next request"""
+    principal_cache.invalidate(target.id)
+    session = Session.object_session(target)
+    if session is not None:
+        mark_user_changed(session, target.id)
+
+
+def mark_user_changed(session: Session, user_id: int):
+    """Invalidate user_id everywhere once session commits
+
+    For writes that change a users row without going through the User mapper.
+    """
+    session.info.setdefault("changed_user_ids", set()).add(user_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    # A concurrent request may have re-cached the old row between flush and commit
+    for user_id in session.info.pop("changed_user_ids", ()):
+        principal_cache.invalidate(user_id)
+        if broadcaster.distributed:
+            broadcaster.publish_threadsafe("principal:invalidate", str(user_id))
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_after_rollback(session):
+    session.info.pop("changed_user_ids", None)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _invalidate_bulk_user_writes(orm_execute_state):
+    """Bulk UPDATE/DELETE statements skip mapper events, so drop everything"""
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) and \
+            orm_execute_state.bind_mapper is inspect(User):
+        principal_cache.clear()
+        if broadcaster.distributed:
+            broadcaster.publish_threadsafe("principal:clear", "")
+
+
+async def _on_principal_broadcast(channel: str, payload: str):
+    """Apply invalidations published by other workers"""
+    if channel == "principal:clear":
+        principal_cache.clear()
+    else:
+        principal_cache.invalidate(int(payload))
+
+
+broadcaster.subscribe("principal:", _on_principal_broadcast)
@@ -0,0 +1,285 @@
+"""
+Token-bucket rate limiting and admission control for write endpoints
+
+Each route has a budget like "10/minute": a bucket holding up to 10 tokens,
+refilled at 10 per minute, and every request takes one. Authenticated routes
+are keyed by user id and anonymous ones by client IP. Budgets are set with
+RATE_LIMIT_<ROUTE>, e.g. RATE_LIMIT_LOGIN=20/minute, and RATE_LIMIT_ENABLED=false
+turns limiting off.
+
+Configure where buckets live with RATE_LIMIT_URL:
+    (unset)            per-process buckets, for a single worker
+    redis://host:6379  buckets shared by every worker through one Lua script
+    memory://          in-process stand-in for Redis, for tests and development
+
+AdmissionControlMiddleware sheds requests with 503 while the database pool
+has no free connection, instead of letting them queue for pool_timeout.
+"""
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.responses import JSONResponse
+
+from backend.metrics import registry as metrics_registry
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes", "on")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 100000))
+RATE_LIMIT_KEY_PREFIX = os.getenv("RATE_LIMIT_KEY_PREFIX", "cosmos:ratelimit:")
+
+# Default budgets per route, overridden by RATE_LIMIT_<ROUTE>
+DEFAULT_BUDGETS = {
+    "register": "5/minute",
+    "login": "10/minute",
+    "refresh": "30/minute",
+    "create_question": "10/minute",
+    "send_message": "30/minute",
+    "ws_message": "60/minute",
+}
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+rate_limited = metrics_registry.counter(
+    "rate_limited_requests_total", "Requests over their rate limit", ("route",)
+)
+requests_shed = metrics_registry.counter(
+    "admission_shed_requests_total", "Requests shed while the database pool was exhausted"
+)
+
+
+class Budget:
+    """A bucket of `burst` tokens refilled at `rate` tokens per second"""
+
+    def __init__(self, burst: float, rate: float):
+        self.burst = burst
+        self.rate = rate
+
+    @classmethod
+    def parse(cls, text: str) -> "Budget":
+        """"30/minute" -> a burst of 30 refilled at half a token per second"""
+        count, _, period = text.strip().partition("/")
+        if period not in PERIODS:
+            raise ValueError(f"Invalid rate limit '{text}', expected <count>/<{'|'.join(PERIODS)}>")
+        return cls(float(count), float(count) / PERIODS[period])
+
+
+def load_budgets() -> Dict[str, Budget]:
+    return {
+        route: Budget.parse(os.getenv(f"RATE_LIMIT_{route.upper()}", default))
+        for route, default in DEFAULT_BUDGETS.items()
+    }
+
+
+def take_token(state: Optional[Tuple[float, float]], budget: Budget, now: float,
+               cost: float = 1) -> Tuple[Tuple[float, float], bool, float]:
+    """Refill and take from a (tokens, updated_at) bucket; returns (state, allowed, retry_after)"""
+    tokens, updated_at = state if state is not None else (budget.burst, now)
+    tokens = min(budget.burst, tokens + max(0.0, now - updated_at) * budget.rate)
+    if tokens >= cost:
+        return (tokens - cost, now), True, 0.0
+    return (tokens, now), False, (cost - tokens) / budget.rate
+
+
+class MemoryBucketBackend:
+    """Buckets in this process, least recently used dropped beyond max_keys"""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def take(self, key: str, budget: Budget, cost: float = 1) -> Tuple[bool, float]:
+        with self._lock:
+            state, allowed, retry_after = take_token(self._buckets.get(key), budget, time.monotonic(), cost)
+            self._buckets[key] = state
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, retry_after
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+# Refill and take atomically on the Redis server; mirrors take_token()
+TOKEN_BUCKET_SCRIPT = """
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local burst = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {allowed, tostring(retry_after)}
+"""
+
+
+class SharedBucketBackend:
+    """Buckets in a Redis-compatible server shared by every worker"""
+
+    def __init__(self, client, prefix: str = RATE_LIMIT_KEY_PREFIX):
+        self.client = client
+        self.prefix = prefix
+
+    async def take(self, key: str, budget: Budget, cost: float = 1) -> Tuple[bool, float]:
+        # Wall clock, since the buckets are compared across machines
+        allowed, retry_after = await self.client.eval(
+            TOKEN_BUCKET_SCRIPT, 1, self.prefix + key, budget.burst, budget.rate, time.time(), cost
+        )
+        return bool(int(allowed)), float(retry_after)
+
+    def reset(self):
+        # Only the in-process stand-in can be emptied; Redis buckets expire on their own
+        if isinstance(self.client, LocalBucketStore):
+            self.client.clear()
+
+
+class LocalBucketStore:
+    """In-memory stand-in for the part of redis.asyncio used by SharedBucketBackend
+
+    Runs TOKEN_BUCKET_SCRIPT's algorithm in Python. Every SharedBucketBackend
+    built on the same store behaves like a separate worker sharing one Redis.
+    """
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    async def eval(self, script: str, numkeys: int, key: str, burst, rate, now, cost):
+        if script != TOKEN_BUCKET_SCRIPT:
+            raise NotImplementedError("LocalBucketStore only runs TOKEN_BUCKET_SCRIPT")
+        with self._lock:
+            state, allowed, retry_after = take_token(
+                self._buckets.get(key), Budget(float(burst), float(rate)), float(now), float(cost)
+            )
+            self._buckets[key] = state
+        return [int(allowed), str(retry_after)]
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+_local_store = LocalBucketStore()
+
+
+def create_backend(url: Optional[str] = None):
+    """Build the backend named by RATE_LIMIT_URL"""
+    url = url if url is not None else os.getenv("RATE_LIMIT_URL", "")
+    if not url:
+        return MemoryBucketBackend()
+    if url.startswith("memory://"):
+        return SharedBucketBackend(_local_store)
+    if url.startswith(("redis://", "rediss://")):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("RATE_LIMIT_URL uses Redis but the 'redis' package is not installed")
+        return SharedBucketBackend(redis.from_url(url))
+    raise ValueError(f"Unsupported RATE_LIMIT_URL '{url}'")
+
+
+class RateLimiter:
+    """Per-route token buckets"""
+
+    def __init__(self, backend=None, budgets: Dict[str, Budget] = None, enabled: bool = RATE_LIMIT_ENABLED):
+        self.backend = backend or create_backend()
+        self.budgets = budgets or load_budgets()
+        self.enabled = enabled
+
+    async def hit(self, route: str, identity: str) -> Tuple[bool, float]:
+        """Take a token for identity on route; returns (allowed, seconds until one is available)"""
+        if not self.enabled:
+            return True, 0.0
+        allowed, retry_after = await self.backend.take(f"{route}:{identity}", self.budgets[route])
+        if not allowed:
+            rate_limited.inc(route)
+        return allowed, retry_after
+
+    async def check(self, route: str, identity: str):
+        """Raise 429 when identity has used up its budget on route"""
+        allowed, retry_after = await self.hit(route, identity)
+        if not allowed:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Rate limit exceeded",
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+            )
+
+    def reset(self):
+        self.backend.reset()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "rejected": {route: rate_limited.value(route) for route in self.budgets},
+            "shed": requests_shed.value()
+        }
+
+
+def client_ip(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
+
+
+def limit_by_ip(route: str):
+    """Dependency charging the client IP against route's budget"""
+    async def dependency(request: Request):
+        await rate_limiter.check(route, f"ip:{client_ip(request)}")
+    return Depends(dependency)
+
+
+# ---- Admission control ----
+
+def pool_exhausted(db_engine) -> bool:
+    """True when every connection the pool may open is checked out"""
+    pool = db_engine.pool
+    if not hasattr(pool, "checkedout") or not hasattr(pool, "size"):
+        return False
+    max_overflow = getattr(pool, "_max_overflow", 0)
+    if max_overflow < 0:
+        # max_overflow=-1 lets the pool open as many connections as asked for
+        return False
+    return pool.checkedout() >= pool.size() + max_overflow
+
+
+class AdmissionControlMiddleware:
+    """ASGI middleware answering 503 while the database pools are exhausted"""
+
+    def __init__(self, app, engines=(), exempt=("/health", "/metrics"), retry_after: int = 1):
+        self.app = app
+        self.engines = engines
+        self.exempt = exempt
+        self.retry_after = retry_after
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] not in self.exempt and \
+                any(pool_exhausted(db_engine) for db_engine in self.engines):
+            requests_shed.inc()
+            response = JSONResponse(
+                {"detail": "Server busy, try again shortly"},
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": str(self.retry_after)}
+            )
+            return await response(scope, receive, send)
+        return await self.app(scope, receive, send)
+
+
+# Global rate limiter instance
+rate_limiter = RateLimiter()
@@ -0,0 +1,155 @@
+"""
+Denormalized astrologer rating and consultation aggregates
+
+Rating inserts, deletes and score changes made through the ORM adjust
+users.rating_sum, rating_count and average_rating with one atomic UPDATE in
+the same transaction, so the aggregates never need a scan of ratings. A
+Consultation moving into or out of "completed" adjusts total_consultations
+the same way.
+
+The hooks are registered when this module is imported, which backend.main
+does. ORM bulk statements and raw SQL skip them; reconcile_aggregates()
+recomputes every astrologer from scratch in one statement.
+"""
+
+from sqlalchemy import case, event, func, inspect, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from backend.assignment import mark_astrologer_changed
+from backend.models import Consultation, Rating, User, UserRole
+from backend.http_cache import mark_changed, user_tags
+from backend.principal_cache import mark_user_changed
+from backend.specializations import mark_directory_changed
+
+COMPLETED = "completed"
+
+users = User.__table__
+
+
+def _average(rating_sum, rating_count):
+    return case((rating_count > 0, rating_sum * 1.0 / rating_count), else_=0.0)
+
+
+def _adjust_rating(connection, target, astrologer_id: int, delta_sum: int, delta_count: int):
+    rating_sum = users.c.rating_sum + delta_sum
+    rating_count = users.c.rating_count + delta_count
+    connection.execute(
+        update(users)
+        .where(users.c.id == astrologer_id)
+        .values(rating_sum=rating_sum, rating_count=rating_count,
+                average_rating=_average(rating_sum, rating_count))
+    )
+    session = Session.object_session(target)
+    mark_astrologer_changed(session, connection, astrologer_id)
+    if session is not None:
+        mark_user_changed(session, astrologer_id)
+        mark_directory_changed(session)
+        mark_changed(session, *user_tags(astrologer_id, astrologer=True))
+
+
+def _adjust_consultations(connection, target, astrologer_id: int, delta: int):
+    connection.execute(
+        update(users)
+        .where(users.c.id == astrologer_id)
+        .values(total_consultations=func.coalesce(users.c.total_consultations, 0) + delta)
+    )
+    session = Session.object_session(target)
+    if session is not None:
+        mark_user_changed(session, astrologer_id)
+        mark_directory_changed(session)
+        mark_changed(session, *user_tags(astrologer_id, astrologer=True))
+
+
+def _previous(target, key: str):
+    """Committed value of an attribute before the pending change"""
+    history = inspect(target).attrs[key].history
+    return history.deleted[0] if history.deleted else getattr(target, key)
+
+
+def _keep_previous_value(target, value, oldvalue, initiator):
+    pass
+
+
+# Load the old value before it is overwritten, even when it was expired by a commit
+for _attribute in (Rating.rating, Rating.astrologer_id, Consultation.status, Consultation.astrologer_id):
+    event.listen(_attribute, "set", _keep_previous_value, active_history=True)
+
+
+@event.listens_for(Rating, "after_insert")
+def _rating_added(mapper, connection, target):
+    _adjust_rating(connection, target, target.astrologer_id, target.rating, 1)
+
+
+@event.listens_for(Rating, "after_delete")
+def _rating_removed(mapper, connection, target):
+    _adjust_rating(connection, target, target.astrologer_id, -target.rating, -1)
+
+
+@event.listens_for(Rating, "after_update")
+def _rating_changed(mapper, connection, target):
+    old_astrologer_id = _previous(target, "astrologer_id")
+    old_rating = _previous(target, "rating")
+    if old_astrologer_id == target.astrologer_id and old_rating == target.rating:
+        return
+    _adjust_rating(connection, target, old_astrologer_id, -old_rating, -1)
+    _adjust_rating(connection, target, target.astrologer_id, target.rating, 1)
+
+
+@event.listens_for(Consultation, "after_insert")
+def _consultation_added(mapper, connection, target):
+    if target.status == COMPLETED and target.astrologer_id:
+        _adjust_consultations(connection, target, target.astrologer_id, 1)
+
+
+@event.listens_for(Consultation, "after_delete")
+def _consultation_removed(mapper, connection, target):
+    if target.status == COMPLETED and target.astrologer_id:
+        _adjust_consultations(connection, target, target.astrologer_id, -1)
+
+
+@event.listens_for(Consultation, "after_update")
+def _consultation_changed(mapper, connection, target):
+    old_astrologer_id = _previous(target, "astrologer_id")
+    was_completed = _previous(target, "status") == COMPLETED
+    is_completed = target.status == COMPLETED
+    if was_completed and old_astrologer_id and (not is_completed or old_astrologer_id != target.astrologer_id):
+        _adjust_consultations(connection, target, old_astrologer_id, -1)
+    if is_completed and target.astrologer_id and (not was_completed or old_astrologer_id != target.astrologer_id):
+        _adjust_consultations(connection, target, target.astrologer_id, 1)
+
+
+def reconcile_statement():
+    """One UPDATE recomputing every astrologer's aggregates with correlated subqueries"""
+    rating_sum = func.coalesce(
+        select(func.sum(Rating.rating)).where(Rating.astrologer_id == User.id).scalar_subquery(), 0
+    )
+    rating_count = (
+        select(func.count(Rating.id)).where(Rating.astrologer_id == User.id).scalar_subquery()
+    )
+    completed = (
+        select(func.count(Consultation.id))
+        .where(Consultation.astrologer_id == User.id, Consultation.status == COMPLETED)
+        .scalar_subquery()
+    )
+    return (
+        update(User)
+        .where(User.role == UserRole.ASTROLOGER)
+        .values(
+            rating_sum=rating_sum,
+            rating_count=rating_count,
+            average_rating=_average(rating_sum, rating_count),
+            total_consultations=completed
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def reconcile_aggregates(db: AsyncSession) -> int:
+    """Recompute every astrologer's aggregates from ratings and consultations
+
+    Returns the number of astrologers. The caller commits.
+    """
+    # ORM-enabled so the principal cache sees the bulk write
+    result = await db.execute(reconcile_statement())
+    return result.rowcount
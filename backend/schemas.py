@@ -26,6 +26,17 @@ class UserLogin(BaseModel):
     password: str
 
 
+class TokenRefresh(BaseModel):
+    """Refresh token exchange schema"""
+    refresh_token: str
+
+
+class LogoutRequest(BaseModel):
+    """Logout schema - all_devices revokes every token of the user"""
+    refresh_token: Optional[str] = None
+    all_devices: bool = False
+
+
 class AstrologerProfile(UserBase):
     """Astrologer profile schema"""
     specialization: Optional[str] = None
@@ -92,9 +103,10 @@ class QuestionResponse(BaseModel):
 
 
 class QuestionDetailResponse(QuestionResponse):
-    """Detailed question response with messages"""
+    """Detailed question response with the first page of messages"""
     user: UserResponse
     messages: List['MessageResponse'] = []
+    next_message_cursor: Optional[str] = None
 
 
 # Message Schemas
@@ -144,11 +156,63 @@ class ConsultationResponse(BaseModel):
         from_attributes = True
 
 
+# Payment Verification Schemas
+class PaymentVerificationRequest(BaseModel):
+    """Queue verification of a gateway payment"""
+    gateway: str = Field(..., pattern="^(khalti|esewa|paypal|stripe)$")
+    transaction_id: str = Field(..., min_length=1, max_length=150)
+    verification_data: dict = Field(default_factory=dict)
+    consultation_id: Optional[int] = None
+
+
+class PaymentVerificationResponse(BaseModel):
+    """Verification job state - poll until status is verified or failed"""
+    id: int
+    gateway: str
+    transaction_id: str
+    consultation_id: Optional[int]
+    status: str  # queued, running, verified, failed
+    attempts: int
+    next_attempt_at: Optional[datetime]
+    verified_at: Optional[datetime]
+    last_error: Optional[str]
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+
+# Wallet Schemas
+class WalletEntryResponse(BaseModel):
+    """One ledger entry - amounts in currency units"""
+    id: int
+    version: int
+    amount: float
+    balance_after: float
+    kind: str
+    reference: str
+    created_at: datetime
+
+
+class WalletResponse(BaseModel):
+    """Wallet balance and its latest entries"""
+    balance: float
+    version: int
+    entries: List[WalletEntryResponse]
+
+
+class WalletAdjustment(BaseModel):
+    """Admin credit (positive) or debit (negative)"""
+    amount: float
+    reference: str = Field(..., min_length=1, max_length=150)
+    kind: str = Field("adjustment", pattern="^(topup|refund|adjustment)$")
+
+
 # Rating Schemas
 class RatingCreate(BaseModel):
     """Create rating schema"""
     astrologer_id: int
-    question_id: Optional[int] = None
+    question_id: int  # Your question the astrologer was assigned to, answered or consulted on
     rating: int = Field(..., ge=1, le=5)
     review: Optional[str] = None
 
@@ -181,6 +245,13 @@ class NotificationResponse(BaseModel):
         from_attributes = True
 
 
+class NotificationReadRequest(BaseModel):
+    """Bulk mark-read schema - give exactly one of the criteria"""
+    ids: Optional[List[int]] = Field(None, max_length=1000)
+    up_to_id: Optional[int] = None
+    before: Optional[datetime] = None
+
+
 # Search and Filter Schemas
 class QuestionFilter(BaseModel):
     """Question filter schema"""
@@ -198,3 +269,7 @@ class PaginatedResponse(BaseModel):
     skip: int
     limit: int
     items: List[dict]
+
+
+# Resolve forward references
+QuestionDetailResponse.model_rebuild()
@@ -0,0 +1,189 @@
+"""
+Full-text search over questions and messages
+
+SQLite keeps two FTS5 external-content tables, questions_fts and
+messages_fts, in step with their base tables through triggers. PostgreSQL
+uses GIN indexes on to_tsvector() expressions, which it maintains itself.
+Either way a query reads the posting lists of its terms instead of scanning
+the base table, so its cost follows the number of matches, not the table
+size. sort=recent walks matches in id order and stops after one page;
+sort=rank has to score every match first.
+"""
+
+import re
+from typing import List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import DDL, column, event, func, literal_column, select, table, true
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.database import Base
+from backend.models import Message, Question, User, UserRole
+from backend.pagination import decode_cursor, keyset_after, keyset_order, page_cursor
+
+SNIPPET_TOKENS = 16
+SNIPPET_CHARS = 200
+
+questions_fts = table("questions_fts", column("rowid"), column("rank"))
+messages_fts = table("messages_fts", column("rowid"), column("rank"))
+
+SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5(
+        title, description, content='questions', content_rowid='id', tokenize='porter unicode61'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS questions_fts_ai AFTER INSERT ON questions BEGIN
+        INSERT INTO questions_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS questions_fts_ad AFTER DELETE ON questions BEGIN
+        INSERT INTO questions_fts(questions_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS questions_fts_au AFTER UPDATE OF title, description ON questions BEGIN
+        INSERT INTO questions_fts(questions_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO questions_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        content, content='messages', content_rowid='id', tokenize='porter unicode61'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF content ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+]
+
+# The query expressions below must stay identical to these for the planner to use the indexes
+QUESTION_TSVECTOR = "to_tsvector('english', coalesce({t}title, '') || ' ' || coalesce({t}description, ''))"
+MESSAGE_TSVECTOR = "to_tsvector('english', coalesce({t}content, ''))"
+
+POSTGRES_DDL = [
+    f"CREATE INDEX IF NOT EXISTS ix_questions_search ON questions USING GIN ({QUESTION_TSVECTOR.format(t='')})",
+    f"CREATE INDEX IF NOT EXISTS ix_messages_search ON messages USING GIN ({MESSAGE_TSVECTOR.format(t='')})",
+]
+
+
+@event.listens_for(Base.metadata, "after_create")
+def install_search_index(target, connection, **kw):
+    """Create the search indexes next to the tables, backfilling existing rows once"""
+    if connection.dialect.name == "sqlite":
+        existing = connection.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE name IN ('questions_fts', 'messages_fts')"
+        ).scalars().all()
+        for statement in SQLITE_DDL:
+            connection.execute(DDL(statement))
+        for name in ("questions_fts", "messages_fts"):
+            if name not in existing:
+                connection.exec_driver_sql(f"INSERT INTO {name}({name}) VALUES ('rebuild')")
+    elif connection.dialect.name == "postgresql":
+        for statement in POSTGRES_DDL:
+            connection.execute(DDL(statement))
+
+
+def fts5_query(text: str) -> str:
+    """Quote each word so user input is never parsed as FTS5 syntax; the last word matches as a prefix"""
+    words = re.findall(r"\w+", text)
+    if not words:
+        raise HTTPException(status_code=400, detail="Search query has no words")
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def _visible(current_user: User):
+    """Same rule as reading a thread - users see their own questions"""
+    if current_user.role in [UserRole.ASTROLOGER, UserRole.ADMIN]:
+        return true()
+    return Question.user_id == current_user.id
+
+
+def _question_hits(dialect: str, text: str):
+    """Question matches as (query, score) - a lower score ranks first"""
+    columns = [Question.id.label("question_id"), Question.title, Question.status, Question.created_at]
+    if dialect == "sqlite":
+        fts = literal_column("questions_fts")
+        score = questions_fts.c.rank
+        query = (
+            select(*columns, func.snippet(fts, -1, "", "", "…", SNIPPET_TOKENS).label("snippet"), score.label("score"))
+            .join(questions_fts, questions_fts.c.rowid == Question.id)
+            .where(fts.op("MATCH")(fts5_query(text)))
+        )
+        return query, score
+
+    vector = literal_column(QUESTION_TSVECTOR.format(t="questions."))
+    ts_query = func.plainto_tsquery(literal_column("'english'"), text)
+    score = -func.ts_rank_cd(vector, ts_query)
+    snippet = func.left(func.coalesce(Question.description, Question.title), SNIPPET_CHARS)
+    query = select(*columns, snippet.label("snippet"), score.label("score")).where(vector.op("@@")(ts_query))
+    return query, score
+
+
+def _message_hits(dialect: str, text: str):
+    """Message matches as (query, score), joined to their question for access checks"""
+    columns = [Message.id.label("message_id"), Message.question_id, Question.title, Message.created_at]
+    if dialect == "sqlite":
+        fts = literal_column("messages_fts")
+        score = messages_fts.c.rank
+        query = (
+            select(*columns, func.snippet(fts, -1, "", "", "…", SNIPPET_TOKENS).label("snippet"), score.label("score"))
+            .join(messages_fts, messages_fts.c.rowid == Message.id)
+            .join(Question, Question.id == Message.question_id)
+            .where(fts.op("MATCH")(fts5_query(text)))
+        )
+        return query, score
+
+    vector = literal_column(MESSAGE_TSVECTOR.format(t="messages."))
+    ts_query = func.plainto_tsquery(literal_column("'english'"), text)
+    score = -func.ts_rank_cd(vector, ts_query)
+    query = (
+        select(*columns, func.left(Message.content, SNIPPET_CHARS).label("snippet"), score.label("score"))
+        .join(Question, Question.id == Message.question_id)
+        .where(vector.op("@@")(ts_query))
+    )
+    return query, score
+
+
+async def search(
+    db: AsyncSession,
+    current_user: User,
+    text: str,
+    scope: str = "questions",
+    sort: str = "rank",
+    limit: int = 20,
+    cursor: Optional[str] = None
+) -> dict:
+    """One page of ranked (or newest first) hits the user is allowed to see"""
+    dialect = db.get_bind().dialect.name
+    if dialect not in ("sqlite", "postgresql"):
+        raise HTTPException(status_code=501, detail="Search is not supported on this database")
+
+    if scope == "messages":
+        query, score = _message_hits(dialect, text)
+        row_id = Message.id
+        id_key = "message_id"
+    else:
+        query, score = _question_hits(dialect, text)
+        row_id = Question.id
+        id_key = "question_id"
+    query = query.where(_visible(current_user))
+
+    if sort == "recent":
+        keys, key_types = [(row_id, True)], [int]
+        key_of = lambda hit: (hit[id_key],)
+    else:
+        keys, key_types = [(score, False), (row_id, False)], [float, int]
+        key_of = lambda hit: (hit["score"], hit[id_key])
+
+    after = decode_cursor(cursor, key_types)
+    if after:
+        query = query.where(keyset_after(keys, after))
+
+    rows = (await db.execute(query.order_by(*keyset_order(keys)).limit(limit + 1))).mappings().all()
+    items: List[dict] = [dict(row) for row in rows]
+    next_cursor = page_cursor(items, limit, key_of)
+    return {"items": items, "next_cursor": next_cursor}
@@ -0,0 +1,77 @@
+"""
+Fast JSON path for listing endpoints
+
+Listings select just the columns they return and turn each row tuple into a
+plain dict, skipping ORM identity-map hydration and Pydantic validation. The
+dicts are rendered by orjson through ORJSONResponse.
+"""
+
+import json
+from typing import Any, Iterable, List, Optional, Sequence, Type
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from sqlalchemy import inspect, select
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    """Serialize to JSON bytes - datetimes as ISO 8601, enums as their values"""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_default, separators=(",", ":")).encode()
+
+
+def _default(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    if hasattr(value, "value"):
+        return value.value
+    return str(value)
+
+
+class ORJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson (stdlib json when orjson is missing)"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class RowSerializer:
+    """Select a fixed list of entity columns and build response dicts from the rows"""
+
+    def __init__(self, entity, fields: Sequence[str]):
+        self.entity = entity
+        self.fields = list(fields)
+        self.columns = [getattr(entity, field) for field in self.fields]
+
+    @classmethod
+    def for_schema(cls, entity, schema: Type[BaseModel]) -> "RowSerializer":
+        """The columns behind a from_attributes response schema"""
+        return cls(entity, [field for field in schema.model_fields if hasattr(entity, field)])
+
+    @classmethod
+    def for_entity(cls, entity) -> "RowSerializer":
+        """Every mapped column of entity"""
+        return cls(entity, [column.key for column in inspect(entity).column_attrs])
+
+    def select(self):
+        return select(*self.columns)
+
+    def rows(self, rows: Iterable[Sequence]) -> List[dict]:
+        fields = self.fields
+        return [dict(zip(fields, row)) for row in rows]
+
+    def from_object(self, obj) -> dict:
+        """Same dict shape from an already loaded ORM instance"""
+        return {field: getattr(obj, field) for field in self.fields}
+
+
+def json_response(content: Any, next_cursor: Optional[str] = None) -> ORJSONResponse:
+    """Bare-list endpoints send their next page cursor in X-Next-Cursor"""
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return ORJSONResponse(content, headers=headers)
@@ -0,0 +1,190 @@
+"""
+Normalized astrologer specializations and the cached astrologer directory
+
+User.specialization stays the free-text profile field. Mapper hooks split it
+into lower-cased word tags stored in specializations and linked through
+astrologer_specializations, so filtering by specialization is an index lookup
+on the link table instead of a LIKE scan of users.
+
+Directory pages are cached per (tags, sort, filters, cursor). Any committed
+change to an astrologer's public profile clears the cache in this process and,
+when the broadcaster is distributed, on every other worker.
+"""
+
+import os
+import re
+from typing import Iterable, List, Optional
+
+from sqlalchemy import delete, event, exists, insert, inspect, select
+from sqlalchemy.orm import Session
+
+from backend.broadcast import broadcaster
+from backend.cache import TTLCache
+from backend.database import Base
+from backend.models import Specialization, User, UserRole, astrologer_specializations
+
+DIRECTORY_CACHE_TTL = float(os.getenv("DIRECTORY_CACHE_TTL", 60))
+DIRECTORY_CACHE_SIZE = int(os.getenv("DIRECTORY_CACHE_SIZE", 2048))
+
+STOPWORDS = {"and", "or", "the", "of", "for", "with", "in", "on"}
+
+# Columns shown in the directory - changing any of them clears the cache
+DIRECTORY_FIELDS = [
+    "username", "full_name", "role", "is_active", "is_verified", "specialization", "bio",
+    "experience_years", "hourly_rate", "average_rating", "total_consultations"
+]
+
+directory_cache = TTLCache(maxsize=DIRECTORY_CACHE_SIZE, ttl=DIRECTORY_CACHE_TTL)
+
+links = astrologer_specializations
+
+
+def specialization_tags(text: Optional[str]) -> List[str]:
+    """"Vedic Astrology, Love & Relationships" -> ["astrology", "love", "relationships", "vedic"]"""
+    words = re.findall(r"\w+", (text or "").lower())
+    return sorted({word for word in words if len(word) > 1 and word not in STOPWORDS})
+
+
+def with_all_tags(tags: Iterable[str]):
+    """WHERE clauses for users linked to every tag - each is an index range on the link table"""
+    return [
+        User.id.in_(
+            select(links.c.user_id)
+            .join(Specialization, Specialization.id == links.c.specialization_id)
+            .where(Specialization.name == tag)
+        )
+        for tag in tags
+    ]
+
+
+def with_any_tag(tags: Iterable[str]):
+    """WHERE clause for users linked to at least one tag"""
+    return User.id.in_(
+        select(links.c.user_id)
+        .join(Specialization, Specialization.id == links.c.specialization_id)
+        .where(Specialization.name.in_(list(tags)))
+    )
+
+
+# ---- Keeping the link table in step ----
+
+def _insert_ignoring_duplicates(connection, rows: List[dict]):
+    """Insert tag names, tolerating a concurrent writer adding the same name"""
+    if connection.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif connection.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        connection.execute(insert(Specialization.__table__), rows)
+        return
+    connection.execute(dialect_insert(Specialization.__table__).on_conflict_do_nothing(), rows)
+
+
+def write_tags(connection, user_id: int, specialization: Optional[str]):
+    """Replace a user's tag links with the tags of specialization"""
+    connection.execute(delete(links).where(links.c.user_id == user_id))
+    tags = specialization_tags(specialization)
+    if not tags:
+        return
+
+    tag_ids = dict(connection.execute(
+        select(Specialization.name, Specialization.id).where(Specialization.name.in_(tags))
+    ).all())
+    missing = [tag for tag in tags if tag not in tag_ids]
+    if missing:
+        _insert_ignoring_duplicates(connection, [{"name": tag} for tag in missing])
+        tag_ids = dict(connection.execute(
+            select(Specialization.name, Specialization.id).where(Specialization.name.in_(tags))
+        ).all())
+
+    connection.execute(insert(links), [{"user_id": user_id, "specialization_id": tag_ids[tag]} for tag in tags])
+
+
+def rebuild_tags(connection, chunk_size: int = 1000) -> int:
+    """Re-derive every user's links from User.specialization; returns users tagged"""
+    tagged = 0
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            select(User.id, User.specialization)
+            .where(User.specialization != None, User.id > last_id)
+            .order_by(User.id)
+            .limit(chunk_size)
+        ).all()
+        for user_id, specialization in rows:
+            write_tags(connection, user_id, specialization)
+        tagged += len(rows)
+        if len(rows) < chunk_size:
+            return tagged
+        last_id = rows[-1][0]
+
+
+@event.listens_for(Base.metadata, "after_create")
+def _backfill_tags(target, connection, **kw):
+    """Tag astrologers that existed before the link table did"""
+    has_links = connection.execute(select(exists().select_from(links))).scalar()
+    if not has_links:
+        rebuild_tags(connection)
+
+
+# ---- Cache invalidation ----
+
+def mark_directory_changed(session: Optional[Session]):
+    """Clear the directory cache once session commits"""
+    if session is not None:
+        session.info["directory_changed"] = True
+
+
+def _profile_changed(target: User) -> bool:
+    state = inspect(target)
+    return any(state.attrs[field].history.has_changes() for field in DIRECTORY_FIELDS)
+
+
+@event.listens_for(User, "after_insert")
+def _tag_new_user(mapper, connection, target):
+    if target.specialization:
+        write_tags(connection, target.id, target.specialization)
+    if target.role == UserRole.ASTROLOGER:
+        mark_directory_changed(Session.object_session(target))
+
+
+@event.listens_for(User, "after_update")
+def _retag_changed_user(mapper, connection, target):
+    if inspect(target).attrs.specialization.history.has_changes():
+        write_tags(connection, target.id, target.specialization)
+    if _profile_changed(target):
+        mark_directory_changed(Session.object_session(target))
+
+
+@event.listens_for(User, "after_delete")
+def _untag_deleted_user(mapper, connection, target):
+    connection.execute(delete(links).where(links.c.user_id == target.id))
+    mark_directory_changed(Session.object_session(target))
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _clear_after_bulk_user_writes(orm_execute_state):
+    """Bulk UPDATE/DELETE statements skip mapper events"""
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) and \
+            orm_execute_state.bind_mapper is inspect(User):
+        mark_directory_changed(orm_execute_state.session)
+
+
+@event.listens_for(Session, "after_commit")
+def _clear_directory_after_commit(session):
+    if session.info.pop("directory_changed", False):
+        directory_cache.clear()
+        if broadcaster.distributed:
+            broadcaster.publish_threadsafe("directory:clear", "")
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_after_rollback(session):
+    session.info.pop("directory_changed", None)
+
+
+async def _on_directory_broadcast(channel: str, payload: str):
+    directory_cache.clear()
+
+
+broadcaster.subscribe("directory:", _on_directory_broadcast)
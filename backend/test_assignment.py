@@ -0,0 +1,161 @@
+"""
+Tests for the question assignment engine
+"""
+
+import asyncio
+
+import backend.ratings  # noqa: F401 - registers the aggregate hooks
+from backend.assignment import AssignmentEngine, assignment_engine
+from backend.models import AstrologerQueue, Question, QuestionStatus, Rating, User, UserRole
+
+
+def test_choose_prefers_specialists_then_load_then_rating():
+    engine = AssignmentEngine(max_load=2)
+    engine.add_astrologer(1, "Vedic Astrology, Career", rating=4.0)
+    engine.add_astrologer(2, "Career", rating=4.8)
+    engine.add_astrologer(3, "Love & Relationships", rating=5.0)
+
+    # Equal load - the better rated specialist wins, then load balances
+    assert [engine.choose("Career") for _ in range(4)] == [2, 1, 2, 1]
+    # Both career specialists are full - fall back to anyone with capacity
+    assert engine.choose("Career") == 3
+    assert engine.choose("Money") == 3
+    assert engine.choose("Money") is None
+
+    engine.release(1)
+    assert engine.choose("career") == 1
+
+
+def test_private_question_is_assigned_and_released(client, make_user, database):
+    """Creating a question queues it; answering it frees the astrologer's slot"""
+    session_factory, _ = database
+    _, user_headers = make_user("seeker")
+    astrologer_id, astrologer_headers = make_user(
+        "guru", role=UserRole.ASTROLOGER, is_verified=True, specialization="Career"
+    )
+
+    question = client.post("/api/questions", headers=user_headers, json={
+        "category": "Career",
+        "title": "Should I change my job?"
+    }).json()
+    assert question["assigned_to"] == astrologer_id
+    assert question["status"] == QuestionStatus.ASSIGNED.value
+
+    queue = client.get("/api/astrologer/queue", headers=astrologer_headers).json()
+    assert [item["id"] for item in queue["items"]] == [question["id"]]
+
+    response = client.post(f"/api/questions/{question['id']}/messages", headers=astrologer_headers,
+                           json={"content": "Yes, after the summer", "message_type": "answer"})
+    assert response.status_code == 200
+
+    db = session_factory()
+    entry = db.query(AstrologerQueue).filter(AstrologerQueue.question_id == question["id"]).one()
+    db.close()
+    assert entry.position == 1
+    assert entry.expected_completion > entry.assigned_at
+    assert entry.is_completed
+
+
+def test_backlog_is_assigned_in_batches(client, make_user, database):
+    """The admin backlog endpoint spreads pending questions across astrologers"""
+    session_factory, _ = database
+    user_id, _ = make_user("seeker")
+    _, admin_headers = make_user("root", role=UserRole.ADMIN)
+    astrologers = [
+        make_user(f"guru{i}", role=UserRole.ASTROLOGER, is_verified=True, specialization="Love")[0]
+        for i in range(3)
+    ]
+
+    db = session_factory()
+    db.add_all([
+        Question(user_id=user_id, category="Love", title=f"Question {i}", priority=i % 2)
+        for i in range(10)
+    ])
+    db.add(Question(user_id=user_id, category="Love", title="Open to all", is_public=True))
+    db.commit()
+    db.close()
+
+    response = client.post("/api/admin/assignments/backlog", headers=admin_headers)
+    assert response.status_code == 200
+    assert response.json()["assigned"] == 10
+
+    db = session_factory()
+    questions = db.query(Question).filter(Question.is_public == False).all()
+    queue_rows = db.query(AstrologerQueue).count()
+    db.close()
+    assert all(q.status == QuestionStatus.ASSIGNED for q in questions)
+    loads = sorted(sum(q.assigned_to == a for q in questions) for a in astrologers)
+    assert loads == [3, 3, 4]
+    assert queue_rows == 10
+
+
+def test_profile_and_rating_commits_update_the_index(make_user, database):
+    session_factory, async_session_factory = database
+    seeker_id, _ = make_user("seeker")
+    first, _ = make_user("first", role=UserRole.ASTROLOGER, is_verified=True, specialization="Career")
+    second, _ = make_user("second", role=UserRole.ASTROLOGER, is_verified=True, specialization="Career")
+
+    async def load():
+        async with async_session_factory() as db:
+            await assignment_engine.ensure_loaded(db)
+
+    asyncio.run(load())
+    assert assignment_engine.stats()["astrologers"] == 2
+
+    # A rating makes the second the better-rated choice
+    db = session_factory()
+    db.add(Rating(user_id=seeker_id, astrologer_id=second, rating=5))
+    db.commit()
+    assert assignment_engine.choose("Career") == second
+    assignment_engine.release(second)
+
+    # Unverified and deactivated astrologers leave the index; a rolled-back change does not apply
+    db.get(User, second).is_verified = False
+    db.commit()
+    assert assignment_engine.choose("Career") == first
+    db.get(User, first).is_active = False
+    db.flush()
+    db.rollback()
+    assert assignment_engine.stats()["astrologers"] == 1
+    db.get(User, first).is_active = False
+    db.commit()
+    db.close()
+    assert assignment_engine.stats()["astrologers"] == 0
+    assert assignment_engine.choose("Career") is None
+
+
+def test_slots_follow_the_transaction(make_user, database):
+    session_factory, async_session_factory = database
+    seeker_id, _ = make_user("seeker")
+    astrologer_id, _ = make_user("guru", role=UserRole.ASTROLOGER, is_verified=True, specialization="Career")
+
+    async def scenario():
+        async with async_session_factory() as db:
+            question = Question(user_id=seeker_id, category="Career", title="Should I change my job?")
+            db.add(question)
+            await db.flush()
+            assert await assignment_engine.assign_question(db, question) == astrologer_id
+            assert assignment_engine.load_of(astrologer_id) == 1
+            # The commit fails - the slot is given back
+            await db.rollback()
+            assert assignment_engine.load_of(astrologer_id) == 0
+
+            question = Question(user_id=seeker_id, category="Career", title="Should I change my job?")
+            db.add(question)
+            await db.flush()
+            await assignment_engine.assign_question(db, question)
+            await db.commit()
+            assert assignment_engine.load_of(astrologer_id) == 1
+
+            # Completing only frees the slot once it commits
+            question_id = question.id
+            await assignment_engine.complete_question(db, question)
+            assert assignment_engine.load_of(astrologer_id) == 1
+            await db.rollback()
+            assert assignment_engine.load_of(astrologer_id) == 1
+            question = await db.get(Question, question_id)
+            await assignment_engine.complete_question(db, question)
+            await db.commit()
+            assert assignment_engine.load_of(astrologer_id) == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,67 @@
+"""
+Tests for the AsyncSession-backed question, message and notification endpoints
+"""
+
+from backend.models import Notification, NotificationType, UserRole
+
+
+def test_question_message_roundtrip(client, make_user):
+    """A question can be created, messaged and read back through the async session"""
+    user_id, headers = make_user("seeker")
+
+    response = client.post("/api/questions", headers=headers, json={
+        "category": "Marriage",
+        "title": "When will I get married?",
+        "description": "Born under Leo"
+    })
+    assert response.status_code == 200
+    question_id = response.json()["id"]
+
+    response = client.post(f"/api/questions/{question_id}/messages", headers=headers,
+                           json={"content": "Some more details here"})
+    assert response.status_code == 200
+    assert response.json()["question_id"] == question_id
+
+    response = client.get(f"/api/questions/{question_id}", headers=headers)
+    assert response.status_code == 200
+    detail = response.json()
+    assert detail["user"]["id"] == user_id
+    assert [m["content"] for m in detail["messages"]] == ["Some more details here"]
+
+    response = client.get("/api/questions?include_total=true", headers=headers)
+    assert response.json()["total"] == 1
+
+
+def test_astrologer_queue_and_notifications(client, make_user, database):
+    """Astrologer queue and notification endpoints work on the async session"""
+    session_factory, _ = database
+    user_id, user_headers = make_user("seeker")
+    astrologer_id, astrologer_headers = make_user("guru", role=UserRole.ASTROLOGER)
+
+    question_id = client.post("/api/questions", headers=user_headers, json={
+        "category": "Work",
+        "title": "Should I change my job?"
+    }).json()["id"]
+
+    db = session_factory()
+    from backend.models import Question
+    db.get(Question, question_id).assigned_to = astrologer_id
+    db.add(Notification(user_id=user_id, type=NotificationType.ANSWER_PROVIDED,
+                        subject="Answered", message="Your question was answered"))
+    db.commit()
+    db.close()
+
+    queue = client.get("/api/astrologer/queue?include_total=true", headers=astrologer_headers).json()
+    assert queue["total"] == 1
+    assert queue["items"][0]["id"] == question_id
+
+    notifications = client.get("/api/notifications", headers=user_headers).json()
+    assert len(notifications) == 1
+    response = client.patch(f"/api/notifications/{notifications[0]['id']}/read", headers=user_headers)
+    assert response.status_code == 200
+    assert client.get("/api/notifications?unread_only=true", headers=user_headers).json() == []
+
+
+def test_missing_authorization_header(client):
+    """Requests without a bearer token are rejected"""
+    assert client.get("/api/questions").status_code == 401
@@ -0,0 +1,125 @@
+"""
+Tests for token verification caching, refresh rotation and revocation, and password hashing
+"""
+
+import asyncio
+import time
+
+from backend.auth import PasswordHasher, _legacy_hash, get_tokens, password_hasher, verified_tokens, verify_token
+from backend.models import User
+
+
+def test_verified_tokens_are_cached_until_revoked(client, make_user):
+    _, headers = make_user("seeker")
+    assert client.get("/api/users/me", headers=headers).status_code == 200
+
+    hits = verified_tokens.hits
+    assert client.get("/api/users/me", headers=headers).status_code == 200
+    assert verified_tokens.hits == hits + 1
+
+    assert client.post("/api/auth/logout", headers=headers).status_code == 200
+    assert client.get("/api/users/me", headers=headers).status_code == 401
+
+
+def test_refresh_tokens_rotate_and_replay_revokes_everything(client, make_user):
+    user_id, _ = make_user("seeker")
+    tokens = get_tokens(user_id, "seeker", "user")
+
+    # A refresh token is not an access token
+    assert verify_token(tokens.refresh_token) is None
+
+    rotated = client.post("/api/auth/refresh", json={"refresh_token": tokens.refresh_token}).json()
+    assert rotated["refresh_token"] != tokens.refresh_token
+    new_headers = {"Authorization": f"Bearer {rotated['access_token']}"}
+    assert client.get("/api/users/me", headers=new_headers).json()["id"] == user_id
+
+    # Replaying the used token revokes the whole family
+    replay = client.post("/api/auth/refresh", json={"refresh_token": tokens.refresh_token})
+    assert replay.status_code == 401
+    assert client.get("/api/users/me", headers=new_headers).status_code == 401
+    assert client.post("/api/auth/refresh", json={"refresh_token": rotated["refresh_token"]}).status_code == 401
+
+
+def test_logout_revokes_the_refresh_token(client, make_user):
+    user_id, headers = make_user("seeker")
+    tokens = get_tokens(user_id, "seeker", "user")
+    client.post("/api/auth/logout", json={"refresh_token": tokens.refresh_token}, headers=headers)
+    assert client.post("/api/auth/refresh", json={"refresh_token": tokens.refresh_token}).status_code == 401
+
+
+def test_deactivation_revokes_issued_tokens(client, make_user, database):
+    session_factory, _ = database
+    user_id, headers = make_user("seeker")
+    tokens = get_tokens(user_id, "seeker", "user")
+    assert client.get("/api/users/me", headers=headers).status_code == 200
+
+    db = session_factory()
+    db.get(User, user_id).is_active = False
+    db.commit()
+    db.close()
+
+    assert client.get("/api/users/me", headers=headers).status_code == 401
+    assert client.post("/api/auth/refresh", json={"refresh_token": tokens.refresh_token}).status_code == 401
+
+
+def _password_hash(session_factory, user_id):
+    db = session_factory()
+    try:
+        return db.get(User, user_id).password_hash
+    finally:
+        db.close()
+
+
+def test_login_upgrades_legacy_and_cheaper_hashes(client, make_user, database, monkeypatch):
+    session_factory, _ = database
+    user_id, _ = make_user("seeker")
+    db = session_factory()
+    db.get(User, user_id).password_hash = _legacy_hash("password123")
+    db.commit()
+    db.close()
+
+    wrong = {"username": "seeker", "password": "password124"}
+    assert client.post("/api/auth/login", json=wrong).status_code == 401
+    assert len(_password_hash(session_factory, user_id)) == 64
+
+    credentials = {"username": "seeker", "password": "password123"}
+    assert client.post("/api/auth/login", json=credentials).status_code == 200
+    upgraded = _password_hash(session_factory, user_id)
+    assert upgraded.startswith("$2b$04$") and password_hasher.verify("password123", upgraded)
+
+    # Raising the cost upgrades again at the next login, and only then
+    monkeypatch.setattr(password_hasher, "rounds", 5)
+    assert password_hasher.needs_rehash(upgraded)
+    assert client.post("/api/auth/login", json=credentials).status_code == 200
+    assert _password_hash(session_factory, user_id).startswith("$2b$05$")
+    assert client.post("/api/auth/login", json={"username": "nobody", "password": "x" * 8}).status_code == 401
+
+
+def test_hashing_runs_off_the_event_loop():
+    hasher = PasswordHasher(rounds=10, workers=2)
+    hashed = hasher.hash("x" * 100)
+    assert hasher.verify("x" * 100, hashed) and not hasher.verify("x" * 99, hashed)
+
+    async def scenario():
+        gaps, last = [], time.perf_counter()
+
+        async def ticker():
+            nonlocal last
+            while True:
+                await asyncio.sleep(0.005)
+                now = time.perf_counter()
+                gaps.append(now - last)
+                last = now
+
+        ticking = asyncio.create_task(ticker())
+        results = await asyncio.gather(*(hasher.verify_async("x" * 100, hashed) for _ in range(4)))
+        ticking.cancel()
+        return results, gaps
+
+    try:
+        results, gaps = asyncio.run(scenario())
+    finally:
+        hasher.shutdown()
+    assert all(results)
+    # Each hash takes far longer than this; the loop kept ticking while they ran
+    assert len(gaps) >= 5 and max(gaps) < 0.05
@@ -0,0 +1,118 @@
+"""
+Tests for cross-worker WebSocket fan-out
+"""
+
+import asyncio
+import json
+
+from backend.broadcast import Broadcaster, InProcessBackend, LocalPubSubHub, PubSubBackend
+from backend.websocket_manager import ConnectionManager
+
+
+class FakeWebSocket:
+    """Records frames instead of writing to a network socket"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data):
+        self.sent.append(json.loads(data))
+
+    async def close(self, code=1000):
+        self.closed = code
+
+
+class StalledWebSocket(FakeWebSocket):
+    """A client that never drains its socket"""
+
+    async def send_text(self, data):
+        await asyncio.Event().wait()
+
+
+async def _settle():
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+
+def test_pubsub_reaches_sockets_on_other_workers():
+    """A message published on worker A is delivered to a socket held by worker B"""
+    async def scenario():
+        hub = LocalPubSubHub()
+        worker_a = ConnectionManager(Broadcaster(PubSubBackend(hub)))
+        worker_b = ConnectionManager(Broadcaster(PubSubBackend(hub)))
+        await worker_a.start()
+        await worker_b.start()
+
+        socket_a, socket_b = FakeWebSocket(), FakeWebSocket()
+        await worker_a.connect(socket_a, question_id=1, user_id=10)
+        await worker_b.connect(socket_b, question_id=1, user_id=20)
+
+        await worker_a.broadcast_to_question(1, {"type": "message", "content": "hello"})
+        await worker_a.send_to_user(20, {"type": "notification"})
+        await _settle()
+
+        await worker_a.stop()
+        await worker_b.stop()
+        return socket_a.sent, socket_b.sent
+
+    sent_a, sent_b = asyncio.run(scenario())
+    assert [m["type"] for m in sent_a] == ["message"]
+    assert [m["type"] for m in sent_b] == ["message", "notification"]
+
+
+def test_in_process_backend_delivers_locally():
+    """Without BROADCAST_URL delivery behaves as before, in this process only"""
+    async def scenario():
+        manager = ConnectionManager(Broadcaster(InProcessBackend()))
+        socket = FakeWebSocket()
+        await manager.connect(socket, question_id=3, user_id=30)
+        await manager.broadcast_to_question(3, {"type": "message"})
+        await manager.broadcast_to_question(4, {"type": "elsewhere"})
+        await _settle()
+        return socket.sent
+
+    assert [m["type"] for m in asyncio.run(scenario())] == ["message"]
+
+
+def test_slow_consumer_does_not_delay_others():
+    """A stalled socket fills its own queue and drops its oldest frames"""
+    async def scenario():
+        manager = ConnectionManager(Broadcaster(InProcessBackend()), queue_size=3, send_timeout=60)
+        fast, stalled = FakeWebSocket(), StalledWebSocket()
+        await manager.connect(fast, question_id=1, user_id=1)
+        await manager.connect(stalled, question_id=1, user_id=2)
+
+        for i in range(10):
+            await manager.broadcast_to_question(1, {"type": "message", "n": i})
+            await _settle()
+        stats = manager.get_connection_count()
+        manager.disconnect(1, 1)
+        manager.disconnect(1, 2)
+        return fast.sent, stats
+
+    sent, stats = asyncio.run(scenario())
+    assert [m["n"] for m in sent] == list(range(10))
+    assert stats["max_queue_depth"] == 3
+    # The stalled writer holds one frame in flight and three queued
+    assert stats["dropped_messages"] == 6
+
+
+def test_disconnect_policy_closes_slow_consumer():
+    """With the disconnect policy an overflowing socket is closed and removed"""
+    async def scenario():
+        manager = ConnectionManager(Broadcaster(InProcessBackend()), queue_size=2,
+                                    slow_consumer_policy="disconnect")
+        stalled = StalledWebSocket()
+        await manager.connect(stalled, question_id=1, user_id=2)
+        for i in range(5):
+            await manager.broadcast_to_question(1, {"type": "message", "n": i})
+            await _settle()
+        return stalled, manager
+
+    stalled, manager = asyncio.run(scenario())
+    assert not manager.is_user_connected(2, 1)
+    assert stalled.closed == 1013
+    assert manager.get_connection_count()["slow_consumer_disconnects"] == 1
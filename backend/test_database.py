@@ -0,0 +1,44 @@
+"""
+Tests for pool profiles and the SQLite connection profile
+"""
+
+import pytest
+from sqlalchemy import text
+
+from backend.database import create_db_engine, get_async_database_url, get_pool_profile
+
+
+def test_pool_profile_env_overrides(monkeypatch):
+    """Individual env vars override the selected profile"""
+    monkeypatch.setenv("DB_POOL_PROFILE", "small")
+    monkeypatch.setenv("DB_POOL_SIZE", "7")
+    monkeypatch.setenv("DB_POOL_PRE_PING", "false")
+
+    profile = get_pool_profile()
+    assert profile["pool_size"] == 7
+    assert profile["max_overflow"] == 3
+    assert profile["pool_pre_ping"] is False
+
+    with pytest.raises(ValueError):
+        get_pool_profile("enormous")
+
+
+def test_sqlite_file_uses_wal_and_connection_pool(tmp_path):
+    """File databases get WAL and a real pool instead of one shared connection"""
+    db_engine = create_db_engine(f"sqlite:///{tmp_path / 'wal.db'}")
+
+    with db_engine.connect() as first, db_engine.connect() as second:
+        assert first.connection.dbapi_connection is not second.connection.dbapi_connection
+        assert first.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert first.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert first.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+    db_engine.dispose()
+
+
+def test_async_url_mapping():
+    """Known drivers map onto their asyncio counterparts, others ask for ASYNC_DATABASE_URL"""
+    assert get_async_database_url("sqlite:///./app.db") == "sqlite+aiosqlite:///./app.db"
+    assert get_async_database_url("postgresql://u:p@db/app") == "postgresql+asyncpg://u:p@db/app"
+
+    with pytest.raises(ValueError, match="ASYNC_DATABASE_URL"):
+        get_async_database_url("mysql://u:p@db/app")
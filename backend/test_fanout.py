@@ -0,0 +1,56 @@
+"""
+Tests for public question fan-out to astrologers
+"""
+
+import asyncio
+
+from backend.broadcast import Broadcaster, InProcessBackend
+from backend.fanout import fan_out_public_question
+from backend.models import Notification, Question, UserRole
+from backend.websocket_manager import ConnectionManager
+
+
+class RecordingManager(ConnectionManager):
+    def __init__(self, online):
+        super().__init__(Broadcaster(InProcessBackend()))
+        self.user_connections = {user_id: {0} for user_id in online}
+        self.sent = []
+
+    async def send_to_user(self, user_id, message):
+        self.sent.append((user_id, message))
+
+
+def test_fan_out_notifies_matching_astrologers_in_chunks(database, make_user):
+    """Only verified astrologers with a matching specialization are notified"""
+    session_factory, async_session_factory = database
+    user_id, _ = make_user("seeker")
+    matching = [
+        make_user(f"guru{i}", role=UserRole.ASTROLOGER, is_verified=True,
+                  specialization="Love & Relationships")[0]
+        for i in range(7)
+    ]
+    make_user("unverified", role=UserRole.ASTROLOGER, specialization="Love & Relationships")
+    make_user("career", role=UserRole.ASTROLOGER, is_verified=True, specialization="Career")
+    make_user("lover", specialization="Love & Relationships", is_verified=True)
+
+    db = session_factory()
+    question = Question(user_id=user_id, category="love", title="Will we meet again?", is_public=True)
+    db.add(question)
+    db.commit()
+    question_id = question.id
+    db.close()
+
+    manager = RecordingManager(online=matching[:2])
+    notified = asyncio.run(fan_out_public_question(
+        question_id, "love", "Will we meet again?",
+        session_factory=async_session_factory, connection_manager=manager, chunk_size=3
+    ))
+
+    assert notified == 7
+    db = session_factory()
+    rows = db.query(Notification).filter(Notification.related_question_id == question_id).all()
+    db.close()
+    assert sorted(row.user_id for row in rows) == matching
+    # Only astrologers with an open socket on this worker get a push
+    assert [user_id for user_id, _ in manager.sent] == matching[:2]
+    assert manager.sent[0][1]["question_id"] == question_id
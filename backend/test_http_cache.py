@@ -0,0 +1,71 @@
+"""
+Tests for HTTP response caching, ETags and precompressed static pages
+"""
+
+import gzip
+
+from backend.http_cache import response_cache
+from backend.models import User, UserRole
+
+
+def test_public_reads_are_cached_with_etags(client, make_user, database):
+    session_factory, _ = database
+    astrologer_id, headers = make_user("guru", role=UserRole.ASTROLOGER, is_verified=True, bio="Vedic")
+
+    first = client.get("/api/astrologers")
+    etag = first.headers["etag"]
+    assert first.headers["cache-control"] == "public, max-age=30"
+
+    hits = response_cache.stats()["hits"]
+    second = client.get("/api/astrologers")
+    assert second.json() == first.json() and second.headers["etag"] == etag
+    assert response_cache.stats()["hits"] == hits + 1
+
+    not_modified = client.get("/api/astrologers", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304 and not_modified.content == b""
+
+    # Authenticated requests bypass the shared cache
+    assert "cache-control" not in client.get("/api/astrologers", headers=headers).headers
+
+    db = session_factory()
+    db.get(User, astrologer_id).bio = "Vedic and Western"
+    db.commit()
+    db.close()
+
+    changed = client.get("/api/astrologers", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.json()[0]["bio"] == "Vedic and Western"
+    assert changed.headers["etag"] != etag
+
+
+def test_user_profile_invalidated_by_its_own_writes(client, make_user, database):
+    session_factory, _ = database
+    user_id, _ = make_user("seeker")
+    other_id, _ = make_user("other")
+
+    assert client.get(f"/api/users/{user_id}").json()["full_name"] == "Seeker"
+    client.get(f"/api/users/{other_id}")
+    assert len(response_cache._entries) == 2
+
+    db = session_factory()
+    db.get(User, user_id).full_name = "Seeker Of Truth"
+    db.commit()
+    db.close()
+
+    assert len(response_cache._entries) == 1
+    assert client.get(f"/api/users/{user_id}").json()["full_name"] == "Seeker Of Truth"
+
+
+def test_static_pages_are_precompressed(client):
+    plain = client.get("/", headers={"Accept-Encoding": "identity"})
+    assert plain.status_code == 200
+    assert "content-encoding" not in plain.headers
+
+    compressed = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert compressed.headers["vary"] == "Accept-Encoding"
+    assert compressed.content == plain.content
+
+    again = client.get("/", headers={"Accept-Encoding": "gzip", "If-None-Match": compressed.headers["etag"]})
+    assert again.status_code == 304
+    assert compressed.headers["etag"] != plain.headers["etag"]
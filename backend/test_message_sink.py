@@ -0,0 +1,118 @@
+"""
+Tests for the batched chat message sink
+"""
+
+import asyncio
+
+from sqlalchemy.exc import IntegrityError
+
+from backend.message_sink import MessageSink
+from backend.models import Message, MessageType, Question
+
+
+def test_concurrent_submissions_share_batches(database, make_user):
+    """Many submissions cost a few commits and keep their submission order"""
+    session_factory, async_session_factory = database
+    user_id, _ = make_user("seeker")
+    db = session_factory()
+    question = Question(user_id=user_id, category="Work", title="Promotion this year?")
+    db.add(question)
+    db.commit()
+    question_id = question.id
+    db.close()
+
+    async def scenario():
+        sink = MessageSink(async_session_factory, batch_size=20, batch_delay=0.05)
+        futures = [
+            sink.submit(question_id=question_id, user_id=user_id, message_type=MessageType.FOLLOW_UP,
+                        content=f"frame {i}")
+            for i in range(50)
+        ]
+        results = await asyncio.gather(*futures)
+        await sink.flush()
+        return sink, results
+
+    sink, results = asyncio.run(scenario())
+    ids = [message_id for message_id, _ in results]
+    assert ids == sorted(ids) and len(set(ids)) == 50
+    assert sink.batches_written == 3
+
+    db = session_factory()
+    stored = {m.id: m.content for m in db.query(Message).all()}
+    db.close()
+    assert [stored[i] for i in ids] == [f"frame {i}" for i in range(50)]
+
+
+def test_websocket_frames_are_saved_and_broadcast_in_order(client, make_user, database, test_sink):
+    """Every chat frame comes back to the sender with its stored id, in order"""
+    session_factory, _ = database
+    user_id, _ = make_user("seeker")
+    db = session_factory()
+    question = Question(user_id=user_id, category="Love", title="Is this the right person?")
+    db.add(question)
+    db.commit()
+    question_id = question.id
+    db.close()
+
+    with client.websocket_connect(f"/ws/questions/{question_id}/{user_id}") as ws:
+        for i in range(5):
+            ws.send_json({"type": "message", "content": f"hello {i}", "client_id": f"c{i}"})
+        frames = [ws.receive_json() for _ in range(5)]
+
+    assert [f["client_id"] for f in frames] == [f"c{i}" for i in range(5)]
+    ids = [f["message_id"] for f in frames]
+    assert ids == sorted(ids)
+
+    db = session_factory()
+    assert db.query(Message).filter(Message.question_id == question_id).count() == 5
+    db.close()
+
+
+def test_a_bad_row_fails_alone(database, make_user):
+    session_factory, async_session_factory = database
+    user_id, _ = make_user("seeker")
+    db = session_factory()
+    question = Question(user_id=user_id, category="Work", title="Promotion this year?")
+    db.add(question)
+    db.commit()
+    question_id = question.id
+    db.close()
+
+    async def scenario():
+        sink = MessageSink(async_session_factory, batch_size=10, batch_delay=0.05)
+        futures = [
+            sink.submit(question_id=question_id, user_id=user_id, message_type=MessageType.FOLLOW_UP,
+                        content=None if i == 2 else f"frame {i}")
+            for i in range(5)
+        ]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        await sink.flush()
+        return sink, results
+
+    sink, results = asyncio.run(scenario())
+    assert isinstance(results[2], IntegrityError)
+    ids = [result[0] for i, result in enumerate(results) if i != 2]
+    assert ids == sorted(ids) and sink.messages_written == 4 and sink.messages_failed == 1
+
+
+def test_websocket_rejects_invalid_content(client, make_user, database, test_sink):
+    session_factory, _ = database
+    user_id, _ = make_user("seeker")
+    db = session_factory()
+    question = Question(user_id=user_id, category="Love", title="Is this the right person?")
+    db.add(question)
+    db.commit()
+    question_id = question.id
+    db.close()
+
+    with client.websocket_connect(f"/ws/questions/{question_id}/{user_id}") as ws:
+        for i, content in enumerate([None, {"text": "hello"}, "hi", "hello there"]):
+            ws.send_json({"type": "message", "content": content, "client_id": f"c{i}"})
+        frames = [ws.receive_json() for _ in range(4)]
+
+    assert [(f["type"], f["client_id"]) for f in frames] == [
+        ("error", "c0"), ("error", "c1"), ("error", "c2"), ("message", "c3")
+    ]
+    db = session_factory()
+    assert [m.content for m in db.query(Message).filter(Message.question_id == question_id)] == ["hello there"]
+    db.close()
@@ -0,0 +1,53 @@
+"""
+Tests for request, database and WebSocket metrics
+"""
+
+import logging
+
+from backend import metrics
+from backend.metrics import Histogram, instrument_engine, request_latency, request_queries
+
+
+def test_requests_are_timed_by_route_with_query_counts(client, make_user, database):
+    session_factory, async_session_factory = database
+    instrument_engine(session_factory.kw["bind"])
+    instrument_engine(async_session_factory.kw["bind"].sync_engine)
+    user_id, headers = make_user("seeker")
+
+    labels = ("GET", "/api/users/{user_id}")
+    before = request_queries.count(*labels), request_queries.sum(*labels)
+    assert client.get(f"/api/users/{user_id}", headers=headers).status_code == 200
+    assert client.get("/api/users/999999", headers=headers).status_code == 404
+    assert request_queries.count(*labels) == before[0] + 2
+    assert request_queries.sum(*labels) > before[1]
+    assert request_latency.count("GET", "/api/users/{user_id}", "404") >= 1
+
+    body = client.get("/metrics").text
+    assert '# TYPE http_request_duration_seconds histogram' in body
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/api/users/{user_id}",status="200",le="+Inf"}' in body
+    assert "websocket_connections 0" in body
+    assert 'notification_queue_depth{queue="emails"} 0' in body
+
+
+def test_slow_queries_are_logged_with_their_stack(client, make_user, database, monkeypatch, caplog):
+    _, async_session_factory = database
+    instrument_engine(async_session_factory.kw["bind"].sync_engine)
+    _, headers = make_user("seeker")
+    monkeypatch.setattr(metrics, "SLOW_QUERY_MS", 0.000001)
+
+    with caplog.at_level(logging.WARNING, logger="backend.slow_query"):
+        client.get("/api/questions", headers=headers)
+    assert any("SELECT" in record.getMessage() and "main.py" in record.getMessage() for record in caplog.records)
+
+
+def test_histogram_text_format():
+    histogram = Histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, "/a")
+    histogram.observe(0.5, "/a")
+    assert histogram.samples() == [
+        'latency_seconds_bucket{route="/a",le="0.1"} 1',
+        'latency_seconds_bucket{route="/a",le="1.0"} 2',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 2',
+        'latency_seconds_sum{route="/a"} 0.55',
+        'latency_seconds_count{route="/a"} 2',
+    ]
@@ -0,0 +1,141 @@
+"""
+Tests for the Alembic revisions
+"""
+
+import os
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine, inspect, text
+
+from backend.database import Base
+
+
+def run_upgrade(url: str):
+    config = Config(os.path.join(os.path.dirname(__file__), "..", "alembic.ini"))
+    config.set_main_option("sqlalchemy.url", url)
+    command.upgrade(config, "head")
+
+
+def indexes(engine, table: str):
+    return {index["name"] for index in inspect(engine).get_indexes(table)}
+
+
+def test_upgrade_adds_indexes_missing_from_an_existing_database(tmp_path):
+    url = f"sqlite:///{tmp_path / 'old.db'}"
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    expected = {table: indexes(engine, table) for table in ("questions", "messages", "notifications", "users")}
+    with engine.begin() as connection:
+        for name in ("ix_questions_user_created_id", "ix_questions_queue", "ix_messages_question_created_id",
+                     "ix_notifications_user_read"):
+            connection.exec_driver_sql(f"DROP INDEX {name}")
+
+    run_upgrade(url)
+    run_upgrade(url)  # already at head
+
+    assert {table: indexes(engine, table) for table in expected} == expected
+    engine.dispose()
+
+
+def test_upgrade_leaves_a_fresh_database_alone(tmp_path):
+    url = f"sqlite:///{tmp_path / 'new.db'}"
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    before = {table: indexes(engine, table) for table in inspect(engine).get_table_names()}
+
+    run_upgrade(url)
+
+    assert {table: indexes(engine, table) for table in before} == before
+    assert "alembic_version" in inspect(engine).get_table_names()
+    engine.dispose()
+
+
+def test_upgrade_on_an_empty_database_leaves_table_creation_to_init_db(tmp_path):
+    url = f"sqlite:///{tmp_path / 'empty.db'}"
+    run_upgrade(url)
+    engine = create_engine(url)
+    assert inspect(engine).get_table_names() == ["alembic_version"]
+    engine.dispose()
+
+
+def test_upgrade_adds_rating_aggregates_and_one_rating_per_question(tmp_path):
+    url = f"sqlite:///{tmp_path / 'ratings.db'}"
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        # The schema before rating aggregates
+        connection.exec_driver_sql("DROP INDEX ix_users_role_verified_rating")
+        connection.exec_driver_sql("ALTER TABLE users DROP COLUMN rating_sum")
+        connection.exec_driver_sql("ALTER TABLE users DROP COLUMN rating_count")
+        connection.exec_driver_sql("DROP TABLE ratings")
+        connection.exec_driver_sql(
+            "CREATE TABLE ratings (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, astrologer_id INTEGER NOT NULL, "
+            "question_id INTEGER, rating INTEGER NOT NULL, review TEXT, created_at DATETIME)"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO users (id, username, email, password_hash, role, is_verified) VALUES "
+            "(1, 'seeker', 's@example.com', 'x', 'USER', 0), (2, 'guru', 'g@example.com', 'x', 'ASTROLOGER', 1)"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO ratings (user_id, astrologer_id, question_id, rating) VALUES "
+            "(1, 2, 10, 1), (1, 2, 10, 5), (1, 2, NULL, 3), (1, 2, NULL, 4)"
+        )
+
+    run_upgrade(url)
+
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT rating FROM ratings ORDER BY id")).scalars().all() == [5, 3, 4]
+        assert connection.execute(text("SELECT rating_sum, rating_count FROM users WHERE id = 2")).one() == (12, 3)
+    assert "ix_users_role_verified_rating" in indexes(engine, "users")
+    assert {c["name"] for c in inspect(engine).get_unique_constraints("ratings")} == {"uq_ratings_user_question"}
+    engine.dispose()
+
+
+def test_upgrade_creates_and_backfills_specialization_tags(tmp_path):
+    url = f"sqlite:///{tmp_path / 'tags.db'}"
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("DROP TABLE astrologer_specializations")
+        connection.exec_driver_sql("DROP TABLE specializations")
+        connection.exec_driver_sql(
+            "INSERT INTO users (id, username, email, password_hash, role, is_verified, rating_sum, rating_count, "
+            "specialization) VALUES (1, 'guru', 'g@example.com', 'x', 'ASTROLOGER', 1, 0, 0, 'Vedic Astrology, Love')"
+        )
+
+    run_upgrade(url)
+
+    with engine.connect() as connection:
+        tags = connection.execute(text(
+            "SELECT s.name FROM specializations s JOIN astrologer_specializations l ON l.specialization_id = s.id "
+            "WHERE l.user_id = 1 ORDER BY s.name"
+        )).scalars().all()
+    assert tags == ["astrology", "love", "vedic"]
+    assert "ix_astrologer_specializations_tag" in indexes(engine, "astrologer_specializations")
+    engine.dispose()
+
+
+def test_upgrade_adds_consultation_payment_status(tmp_path):
+    url = f"sqlite:///{tmp_path / 'payments.db'}"
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("DROP INDEX ix_consultations_payment_status")
+        connection.exec_driver_sql("ALTER TABLE consultations DROP COLUMN payment_status")
+        connection.exec_driver_sql(
+            "INSERT INTO users (id, username, email, password_hash, role, is_verified, rating_sum, rating_count) "
+            "VALUES (1, 'seeker', 's@example.com', 'x', 'USER', 0, 0, 0)"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO consultations (id, user_id, amount, payment_id) VALUES (1, 1, 50, 'PAY-1'), (2, 1, 50, NULL)"
+        )
+
+    run_upgrade(url)
+
+    with engine.connect() as connection:
+        assert connection.execute(
+            text("SELECT payment_status FROM consultations ORDER BY id")
+        ).scalars().all() == ["paid", "unpaid"]
+    assert "ix_consultations_payment_status" in indexes(engine, "consultations")
+    engine.dispose()
@@ -0,0 +1,138 @@
+"""
+Tests for the queued notification dispatcher
+"""
+
+import asyncio
+
+from backend.models import Notification, NotificationType, Question, User
+from backend.notifications import NotificationService, notifications_dropped
+from backend.testing.smtp_server import LocalSMTPServer
+
+
+def _service(monkeypatch, smtp: LocalSMTPServer, async_session_factory) -> NotificationService:
+    monkeypatch.setenv("SMTP_SERVER", smtp.host)
+    monkeypatch.setenv("SMTP_PORT", str(smtp.port))
+    monkeypatch.setenv("SMTP_USE_TLS", "false")
+    monkeypatch.setenv("EMAIL_USER", "mailer")
+    monkeypatch.setenv("EMAIL_PASSWORD", "secret")
+    service = NotificationService(async_session_factory)
+    service.dispatcher.retry_delay = 0.01
+    return service
+
+
+def _seed(session_factory, make_user):
+    user_id, _ = make_user("seeker")
+    db = session_factory()
+    question = Question(user_id=user_id, category="Love", title="Will we meet again?")
+    db.add(question)
+    db.commit()
+    db.refresh(question)
+    user = db.get(User, user_id)
+    db.expunge_all()
+    db.close()
+    return user, question
+
+
+def test_notify_enqueues_and_reuses_smtp_connections(database, make_user, monkeypatch):
+    """Rows are bulk-written and every email shares a few pooled connections"""
+    session_factory, async_session_factory = database
+    user, question = _seed(session_factory, make_user)
+
+    with LocalSMTPServer() as smtp:
+        service = _service(monkeypatch, smtp, async_session_factory)
+
+        async def scenario():
+            for _ in range(20):
+                service.notify_question_received(user, question)
+            # Nothing has been sent yet - the calls only queued work
+            assert service.dispatcher.stats()["queued_emails"] == 20
+            await service.dispatcher.stop()
+
+        asyncio.run(scenario())
+
+    assert len(smtp.messages) == 20
+    assert smtp.connections <= service.dispatcher.workers
+    assert all(rcpt == ["seeker@example.com"] for _, rcpt, _ in smtp.messages)
+
+    db = session_factory()
+    rows = db.query(Notification).filter(Notification.user_id == user.id).all()
+    db.close()
+    assert len(rows) == 20
+    assert {row.type for row in rows} == {NotificationType.QUESTION_RECEIVED}
+
+
+def test_failed_send_is_retried(database, make_user, monkeypatch):
+    """A transient SMTP failure is retried on a fresh connection"""
+    session_factory, async_session_factory = database
+    user, question = _seed(session_factory, make_user)
+
+    with LocalSMTPServer(fail_first=2) as smtp:
+        service = _service(monkeypatch, smtp, async_session_factory)
+
+        async def scenario():
+            service.notify_question_received(user, question)
+            await service.dispatcher.stop()
+
+        asyncio.run(scenario())
+
+    stats = service.dispatcher.stats()
+    assert len(smtp.messages) == 1
+    assert stats["emails_sent"] == 1
+    assert stats["email_retries"] == 2
+    assert stats["emails_failed"] == 0
+
+
+def test_full_email_queue_sheds_emails_but_keeps_rows(database, make_user, monkeypatch):
+    """Emails past queue_size are dropped and counted; every row is still written"""
+    session_factory, async_session_factory = database
+    user, question = _seed(session_factory, make_user)
+    dropped = notifications_dropped.value("email", "queue_full")
+
+    with LocalSMTPServer() as smtp:
+        service = _service(monkeypatch, smtp, async_session_factory)
+        service.dispatcher.queue_size = 5
+
+        async def scenario():
+            for _ in range(8):
+                service.notify_question_received(user, question)
+            await service.dispatcher.stop()
+
+        asyncio.run(scenario())
+
+    assert len(smtp.messages) == 5
+    assert service.dispatcher.stats()["emails_dropped"] == 3
+    assert notifications_dropped.value("email", "queue_full") == dropped + 3
+
+    db = session_factory()
+    assert db.query(Notification).filter(Notification.user_id == user.id).count() == 8
+    db.close()
+
+
+def test_failed_row_writes_are_retried(database, make_user, monkeypatch):
+    """A batch that fails to commit is written again after a backoff instead of being lost"""
+    session_factory, async_session_factory = database
+    user, question = _seed(session_factory, make_user)
+
+    with LocalSMTPServer() as smtp:
+        service = _service(monkeypatch, smtp, async_session_factory)
+        dispatcher = service.dispatcher
+        write_rows, failures = dispatcher.write_rows, [RuntimeError("database is locked")] * 2
+
+        async def flaky_write_rows(rows):
+            if failures:
+                raise failures.pop()
+            await write_rows(rows)
+
+        monkeypatch.setattr(dispatcher, "write_rows", flaky_write_rows)
+
+        async def scenario():
+            service.notify_question_received(user, question)
+            await dispatcher.stop()
+
+        asyncio.run(scenario())
+
+    stats = dispatcher.stats()
+    assert (stats["row_retries"], stats["rows_failed"], stats["rows_written"]) == (2, 0, 1)
+    db = session_factory()
+    assert db.query(Notification).filter(Notification.user_id == user.id).count() == 1
+    db.close()
@@ -0,0 +1,64 @@
+"""
+Tests for cursor pagination of the list endpoints
+"""
+
+from datetime import datetime, timedelta
+
+from backend.models import Notification, NotificationType, Question, User, UserRole
+
+
+def _walk(client, url, headers, key):
+    """Follow cursors until exhausted, returning every item key in order"""
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 3}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get(url, params=params, headers=headers)
+        assert response.status_code == 200
+        body = response.json()
+        if isinstance(body, list):
+            items, cursor = body, response.headers.get("X-Next-Cursor")
+        else:
+            items, cursor = body["items"], body["next_cursor"]
+        seen += [item[key] for item in items]
+        if not cursor:
+            return seen
+
+
+def test_every_list_endpoint_pages_with_cursors(client, make_user, database):
+    """Each endpoint returns every row exactly once in its documented order"""
+    session_factory, _ = database
+    user_id, headers = make_user("seeker")
+    astrologer_id, astrologer_headers = make_user("guru", role=UserRole.ASTROLOGER, is_verified=True)
+    for i in range(4):
+        make_user(f"sage{i}", role=UserRole.ASTROLOGER, is_verified=True)
+
+    db = session_factory()
+    start = datetime(2024, 1, 1)
+    for i in range(8):
+        db.add(Question(user_id=user_id, category="Work", title=f"Question number {i}",
+                        assigned_to=astrologer_id, priority=i % 2,
+                        created_at=start + timedelta(hours=i // 2)))
+        db.add(Notification(user_id=user_id, type=NotificationType.FOLLOW_UP, subject=f"n{i}",
+                            message="ping", created_at=start + timedelta(hours=i // 2)))
+    db.commit()
+    questions = db.query(Question).all()
+    notifications = db.query(Notification).all()
+    astrologer_ids = [u.id for u in db.query(User).filter(User.role == UserRole.ASTROLOGER).order_by(User.id)]
+    db.close()
+
+    newest_first = lambda rows: [r.id for r in sorted(rows, key=lambda r: (r.created_at, r.id), reverse=True)]
+    assert _walk(client, "/api/questions", headers, "id") == newest_first(questions)
+    assert _walk(client, "/api/notifications", headers, "id") == newest_first(notifications)
+    assert _walk(client, "/api/astrologers", {}, "id") == astrologer_ids
+
+    queue_order = sorted(questions, key=lambda q: (-q.priority, q.created_at, q.id))
+    assert _walk(client, "/api/astrologer/queue", astrologer_headers, "id") == [q.id for q in queue_order]
+
+
+def test_total_is_opt_in(client, make_user):
+    """The count query only runs when include_total is requested"""
+    _, headers = make_user("seeker")
+    assert client.get("/api/questions", headers=headers).json()["total"] is None
+    assert client.get("/api/questions?include_total=true", headers=headers).json()["total"] == 0
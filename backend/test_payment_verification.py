@@ -0,0 +1,269 @@
+"""
+Tests for the payment verification queue, its endpoints and the consultation payment states
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+
+import backend.payment_verification as payment_verification
+from backend.http_client import GatewayClient
+from backend.models import Consultation, Notification, NotificationType, PaymentVerification
+from backend.payment_verification import verification_queue
+from backend.payments import PaymentProcessor
+from backend.testing.fake_gateway import FakeGateway
+from backend.token_cache import AccessTokenCache
+
+
+@pytest.fixture
+def queue(database, monkeypatch):
+    """The global verification queue, on the test database and a fake gateway"""
+    _, async_session_factory = database
+    monkeypatch.setenv("PAYPAL_API_URL", "http://gateway.test")
+    monkeypatch.setenv("KHALTI_API_URL", "http://gateway.test/khalti")
+    monkeypatch.setenv("ESEWA_API_URL", "http://gateway.test/esewa")
+    fake = FakeGateway()
+    processor = PaymentProcessor(
+        GatewayClient(transport=httpx.ASGITransport(app=fake.app), backoff=0.001), AccessTokenCache()
+    )
+    monkeypatch.setattr(verification_queue, "session_factory", async_session_factory)
+    monkeypatch.setattr(verification_queue, "processor", processor)
+    monkeypatch.setattr(verification_queue, "backoff", 0)
+    monkeypatch.setattr(payment_verification, "WEBHOOK_SECRET", "hook-secret")
+    monkeypatch.setattr(verification_queue, "fake", fake, raising=False)
+    yield verification_queue
+    asyncio.run(processor.client.aclose())
+
+
+def _consultation(database, user_id, **fields):
+    session_factory, _ = database
+    db = session_factory()
+    try:
+        consultation = Consultation(user_id=user_id, amount=50.0, **fields)
+        db.add(consultation)
+        db.commit()
+        return consultation.id
+    finally:
+        db.close()
+
+
+def _load(database, model, id):
+    session_factory, _ = database
+    db = session_factory()
+    try:
+        return db.get(model, id)
+    finally:
+        db.close()
+
+
+def test_repeated_requests_queue_one_job_and_a_worker_pays_the_consultation(client, database, make_user, queue):
+    user_id, headers = make_user("seeker")
+    _, other_headers = make_user("other")
+    consultation_id = _consultation(database, user_id)
+    body = {
+        "gateway": "khalti", "transaction_id": "txn-1", "verification_data": {"token": "tok-1"},
+        "consultation_id": consultation_id
+    }
+
+    first = client.post("/api/payments/verify", json=body, headers={**headers, "Idempotency-Key": "k1"})
+    again = client.post("/api/payments/verify", json=body, headers={**headers, "Idempotency-Key": "k1"})
+    new_key = client.post("/api/payments/verify", json=body, headers={**headers, "Idempotency-Key": "k2"})
+    assert first.status_code == 202 and first.json()["status"] == "queued"
+    assert again.json()["id"] == new_key.json()["id"] == first.json()["id"]
+    assert _load(database, Consultation, consultation_id).payment_status == "pending"
+
+    assert client.post("/api/payments/verify", json=body, headers=other_headers).status_code == 404
+
+    assert asyncio.run(queue.run_next("worker-1"))
+    assert not asyncio.run(queue.run_next("worker-1"))
+
+    job = client.get(f"/api/payments/verifications/{first.json()['id']}", headers=headers).json()
+    assert job["status"] == "verified" and job["attempts"] == 1
+    assert client.get(f"/api/payments/verifications/{job['id']}", headers=other_headers).status_code == 404
+    consultation = _load(database, Consultation, consultation_id)
+    assert (consultation.payment_status, consultation.payment_id) == ("paid", "txn-1")
+    assert queue.fake.calls["/khalti/payment/verify/"] == 1
+
+    session_factory, _ = database
+    db = session_factory()
+    try:
+        notices = db.query(Notification).filter(Notification.user_id == user_id).all()
+        assert [notice.type for notice in notices] == [NotificationType.PAYMENT_CONFIRMED]
+    finally:
+        db.close()
+
+    # Paid - another payment for it is a conflict, not a second verification
+    other = {**body, "transaction_id": "txn-2"}
+    assert client.post("/api/payments/verify", json=other, headers=headers).status_code == 409
+    assert client.post("/api/payments/verify", json={**body, "gateway": "wallet"}, headers=headers).status_code == 422
+
+
+def test_unconfirmed_payments_back_off_then_fail(client, database, make_user, queue, monkeypatch):
+    monkeypatch.setattr(queue, "max_attempts", 3)
+    user_id, headers = make_user("seeker")
+    consultation_id = _consultation(database, user_id)
+    job_id = client.post("/api/payments/verify", json={
+        "gateway": "khalti", "transaction_id": "txn-1", "verification_data": {"token": "bad-token"},
+        "consultation_id": consultation_id
+    }, headers=headers).json()["id"]
+
+    monkeypatch.setattr(queue, "backoff", 60)
+    assert asyncio.run(queue.run_next("worker-1"))
+    job = _load(database, PaymentVerification, job_id)
+    assert job.status == "queued" and job.attempts == 1
+    assert job.next_attempt_at > datetime.utcnow() + timedelta(seconds=59)
+    # Not due yet
+    assert not asyncio.run(queue.run_next("worker-1"))
+
+    monkeypatch.setattr(queue, "backoff", 0)
+    _retry_now(database, job_id)
+    assert asyncio.run(queue.run_next("worker-1"))
+    _retry_now(database, job_id)
+    assert asyncio.run(queue.run_next("worker-1"))
+
+    job = _load(database, PaymentVerification, job_id)
+    assert job.status == "failed" and job.attempts == 3 and job.last_error
+    assert _load(database, Consultation, consultation_id).payment_status == "failed"
+
+    # A failed payment can be retried with a new one
+    retry = client.post("/api/payments/verify", json={
+        "gateway": "khalti", "transaction_id": "txn-2", "verification_data": {"token": "tok-2"},
+        "consultation_id": consultation_id
+    }, headers=headers)
+    assert retry.status_code == 202 and retry.json()["id"] != job_id
+    assert asyncio.run(queue.run_next("worker-1"))
+    assert _load(database, Consultation, consultation_id).payment_status == "paid"
+
+
+def _retry_now(database, job_id):
+    session_factory, _ = database
+    db = session_factory()
+    try:
+        db.get(PaymentVerification, job_id).next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_a_worker_that_lost_its_lease_cannot_finish_the_job(client, database, make_user, queue, monkeypatch):
+    user_id, headers = make_user("seeker")
+    consultation_id = _consultation(database, user_id)
+    client.post("/api/payments/verify", json={
+        "gateway": "khalti", "transaction_id": "txn-1", "verification_data": {"token": "tok-1"},
+        "consultation_id": consultation_id
+    }, headers=headers)
+
+    monkeypatch.setattr(queue, "lease", 60)
+
+    async def scenario():
+        queue.lease = -1
+        stalled = await queue.claim("stalled")
+        queue.lease = 60
+        assert await queue.run_next("healthy")
+        await queue._finish(stalled, "stalled", True, None)
+        return stalled
+
+    stalled = asyncio.run(scenario())
+    job = _load(database, PaymentVerification, stalled.id)
+    assert job.status == "verified" and job.attempts == 2 and job.locked_by is None
+    assert queue.lost_leases >= 1
+
+
+def test_webhooks_need_the_secret_and_only_make_the_job_due(client, database, make_user, queue, monkeypatch):
+    user_id, headers = make_user("seeker")
+    consultation_id = _consultation(database, user_id)
+    job_id = client.post("/api/payments/verify", json={
+        "gateway": "paypal", "transaction_id": "PAYID-1", "verification_data": {"paymentId": "PAYID-1"},
+        "consultation_id": consultation_id
+    }, headers=headers).json()["id"]
+
+    session_factory, _ = database
+    db = session_factory()
+    try:
+        db.get(PaymentVerification, job_id).next_attempt_at = datetime.utcnow() + timedelta(hours=1)
+        db.commit()
+    finally:
+        db.close()
+
+    hook = {"event_type": "PAYMENT.SALE.COMPLETED", "resource": {"parent_payment": "PAYID-1"}}
+    assert client.post("/api/payments/webhooks/paypal", json=hook).status_code == 401
+    assert client.post("/api/payments/webhooks/paypal", json=hook,
+                       headers={"X-Webhook-Token": "wrong"}).status_code == 401
+    assert client.post("/api/payments/webhooks/bitcoin", json=hook,
+                       headers={"X-Webhook-Token": "hook-secret"}).status_code == 404
+
+    response = client.post("/api/payments/webhooks/paypal", json=hook, headers={"X-Webhook-Token": "hook-secret"})
+    assert response.status_code == 202 and response.json() == {"verification_id": job_id}
+    unknown = client.get("/api/payments/webhooks/khalti?webhook_token=hook-secret&pidx=nothing")
+    assert unknown.json() == {"verification_id": None}
+
+    # Still unpaid until the gateway itself confirms - PAYID-1 was never created there
+    assert _load(database, Consultation, consultation_id).payment_status == "pending"
+    assert asyncio.run(queue.run_next("worker-1"))
+    job = _load(database, PaymentVerification, job_id)
+    assert job.status == "queued" and job.attempts == 1
+    assert _load(database, Consultation, consultation_id).payment_status == "pending"
+
+
+def test_reconciliation_repairs_interrupted_work(client, database, make_user, queue, monkeypatch):
+    user_id, headers = make_user("seeker")
+    interrupted = _consultation(database, user_id)
+    abandoned = _consultation(database, user_id, payment_id="txn-old", payment_status="pending",
+                              updated_at=datetime.utcnow() - timedelta(days=2))
+    fresh = _consultation(database, user_id, payment_id="txn-new", payment_status="pending")
+    job_id = client.post("/api/payments/verify", json={
+        "gateway": "khalti", "transaction_id": "txn-1", "verification_data": {"token": "tok-1"},
+        "consultation_id": interrupted
+    }, headers=headers).json()["id"]
+
+    # A worker verified the job but died before updating the consultation, and another holds an expired lease
+    session_factory, _ = database
+    db = session_factory()
+    try:
+        db.get(PaymentVerification, job_id).status = "verified"
+        db.add(PaymentVerification(
+            idempotency_key="khalti:txn-9", user_id=user_id, gateway="khalti", transaction_id="txn-9",
+            verification_data={"token": "tok-9"}, status="running", attempts=1, locked_by="gone",
+            locked_until=datetime.utcnow() - timedelta(seconds=1)
+        ))
+        db.commit()
+    finally:
+        db.close()
+
+    report = asyncio.run(queue.reconcile())
+    assert report == {"requeued": 1, "paid": 1, "failed": 0, "abandoned": 1}
+    assert _load(database, Consultation, interrupted).payment_status == "paid"
+    assert _load(database, Consultation, abandoned).payment_status == "failed"
+    assert _load(database, Consultation, fresh).payment_status == "pending"
+    assert asyncio.run(queue.reconcile()) == {"requeued": 0, "paid": 0, "failed": 0, "abandoned": 0}
+
+
+def test_workers_share_the_queue_and_verify_each_payment_once(database, make_user, queue, monkeypatch):
+    user_id, _ = make_user("seeker")
+    _, async_session_factory = database
+    monkeypatch.setattr(queue, "workers", 4)
+    monkeypatch.setattr(queue, "poll_interval", 0.01)
+    queue.fake.delay = 0.01
+
+    async def scenario():
+        async with async_session_factory() as db:
+            for n in range(20):
+                await payment_verification.enqueue_verification(
+                    db, user_id, payment_verification.PaymentGateway.KHALTI, f"txn-{n}", {"token": f"tok-{n}"}
+                )
+        target = queue.verified + 20
+        await queue.start()
+        queue.wake()
+        for _ in range(500):
+            if queue.verified >= target:
+                break
+            await asyncio.sleep(0.01)
+        await queue.stop()
+
+    verified_before = queue.verified
+    asyncio.run(scenario())
+    assert queue.verified - verified_before == 20
+    assert queue.fake.calls["/khalti/payment/verify/"] == 20
+    assert len(queue.fake.verified_tokens) == 20
@@ -0,0 +1,201 @@
+"""
+Tests for the payment processor and its pooled gateway client
+"""
+
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+
+from backend.http_client import CircuitBreaker, GatewayClient, GatewayPolicy, GatewayUnavailable, RetryBudget
+from backend.payments import PaymentGateway, PaymentProcessor
+from backend.testing.fake_gateway import FakeGateway
+from backend.token_cache import AccessTokenCache
+
+
+@pytest.fixture
+def gateway(monkeypatch):
+    """A fake gateway and a processor pointed at it"""
+    monkeypatch.setenv("PAYPAL_API_URL", "http://gateway.test")
+    monkeypatch.setenv("KHALTI_API_URL", "http://gateway.test/khalti")
+    monkeypatch.setenv("ESEWA_API_URL", "http://gateway.test/esewa")
+    fake = FakeGateway()
+    client = GatewayClient(transport=httpx.ASGITransport(app=fake.app), backoff=0.001)
+    return fake, PaymentProcessor(client, AccessTokenCache())
+
+
+def test_paypal_payment_is_created_and_executed(gateway):
+    fake, processor = gateway
+
+    async def scenario():
+        created = await processor.process_consultation_payment(1, 2, 25.0, PaymentGateway.PAYPAL, db=None)
+        executed = await processor.verify_payment(
+            PaymentGateway.PAYPAL, created["payment_id"], {"paymentId": created["payment_id"], "payerId": "P1"}
+        )
+        unknown = await processor.verify_payment(
+            PaymentGateway.PAYPAL, "missing", {"paymentId": "missing", "payerId": "P1"}
+        )
+        client = processor.client.client
+        await processor.client.aclose()
+        return created, executed, unknown, client
+
+    created, executed, unknown, client = asyncio.run(scenario())
+    assert created["success"] and created["approval_url"].endswith(created["payment_id"])
+    assert executed and not unknown
+    assert fake.payments[created["payment_id"]]["state"] == "approved"
+    assert fake.payments[created["payment_id"]]["body"]["transactions"][0]["amount"]["total"] == "25.00"
+
+
+def test_verification_retries_through_transient_gateway_errors(gateway):
+    fake, processor = gateway
+    fake.fail(2)
+
+    async def scenario():
+        results = [
+            await processor.verify_payment(PaymentGateway.KHALTI, "t1", {"token": "tok-1"}),
+            await processor.verify_payment(PaymentGateway.KHALTI, "t2", {"token": "bad-token"}),
+            await processor.verify_payment(PaymentGateway.ESEWA, "t3", {"pid": "t3", "amt": "100"}),
+        ]
+        await processor.client.aclose()
+        return results
+
+    assert asyncio.run(scenario()) == [True, False, True]
+    assert fake.calls["/khalti/payment/verify/"] == 4
+    assert fake.verified_tokens == {"tok-1"}
+
+
+def test_payment_creation_is_not_retried(gateway):
+    fake, processor = gateway
+
+    async def scenario():
+        fake.fail(1, path="/v1/payments/payment")
+        result = await processor.process_paypal_payment(10.0, user_id=1)
+        await processor.client.aclose()
+        return result
+
+    result = asyncio.run(scenario())
+    assert not result["success"]
+    assert fake.calls["/v1/payments/payment"] == 1
+    assert fake.payments == {}
+
+
+def test_open_circuit_fails_fast_and_recovers():
+    fake = FakeGateway()
+    policy = GatewayPolicy(timeout=1, max_retries=0, breaker=CircuitBreaker(failures=2, reset_timeout=0.05))
+    client = GatewayClient(transport=httpx.ASGITransport(app=fake.app), policies={"khalti": policy})
+    url = "http://gateway.test/khalti/payment/verify/"
+
+    async def scenario():
+        fake.fail(2)
+        statuses = [(await client.post("khalti", url, json={"token": "t"})).status_code for _ in range(2)]
+        with pytest.raises(GatewayUnavailable):
+            await client.post("khalti", url, json={"token": "t"})
+        calls_while_open = fake.calls["/khalti/payment/verify/"]
+        await asyncio.sleep(0.06)
+        statuses.append((await client.post("khalti", url, json={"token": "t"})).status_code)
+        await client.aclose()
+        return statuses, calls_while_open
+
+    statuses, calls_while_open = asyncio.run(scenario())
+    assert statuses == [503, 503, 200]
+    assert calls_while_open == 2
+    assert policy.breaker.state == "closed"
+
+
+def test_slow_gateway_times_out():
+    fake = FakeGateway()
+    fake.delay = 0.2
+    client = GatewayClient(
+        transport=httpx.ASGITransport(app=fake.app), policies={"esewa": GatewayPolicy(timeout=0.05)}
+    )
+
+    async def scenario():
+        try:
+            with pytest.raises(GatewayUnavailable):
+                await client.post("esewa", "http://gateway.test/esewa/transrec", data={"pid": "1"})
+        finally:
+            await client.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_retry_budget_caps_retries_to_a_share_of_requests():
+    budget = RetryBudget(ratio=0.25, min_per_second=0, capacity=2)
+    assert [budget.withdraw() for _ in range(3)] == [True, True, False]
+    for _ in range(4):
+        budget.deposit()
+    assert [budget.withdraw() for _ in range(2)] == [True, False]
+
+
+def test_paypal_token_is_fetched_once_for_concurrent_payments(gateway):
+    fake, processor = gateway
+    fake.delay = 0.02
+
+    async def scenario():
+        results = await asyncio.gather(*[processor.process_paypal_payment(5.0, user_id=i) for i in range(20)])
+        results.append(await processor.verify_paypal("x", {"paymentId": results[0]["payment_id"], "payerId": "P"}))
+        await processor.client.aclose()
+        return results
+
+    results = asyncio.run(scenario())
+    assert all(result["success"] for result in results[:-1]) and results[-1]
+    assert fake.calls["/v1/oauth2/token"] == 1
+
+
+def test_token_is_renewed_before_it_expires():
+    cache = AccessTokenCache(refresh_margin=0.05)
+    issued = []
+
+    async def fetch():
+        await asyncio.sleep(0.01)
+        issued.append(f"token-{len(issued)}")
+        return issued[-1], 0.1
+
+    async def scenario():
+        first = await cache.get("paypal", fetch)
+        await asyncio.sleep(0.06)
+        # Inside the refresh window: the valid token is served while a new one is fetched
+        during = await asyncio.gather(*[cache.get("paypal", fetch) for _ in range(5)])
+        await asyncio.sleep(0.02)
+        after = await cache.get("paypal", fetch)
+        return first, during, after
+
+    first, during, after = asyncio.run(scenario())
+    assert first == "token-0" and during == ["token-0"] * 5
+    assert after == "token-1" and len(issued) == 2
+
+
+def test_threads_share_one_token_request():
+    cache = AccessTokenCache()
+    requests = []
+
+    def fetch():
+        requests.append(threading.get_ident())
+        time.sleep(0.05)
+        return "token", 3600
+
+    tokens = []
+    threads = [threading.Thread(target=lambda: tokens.append(cache.get_sync("paypal", fetch))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert tokens == ["token"] * 8 and len(requests) == 1
+
+
+def test_paypal_execution_can_be_repeated_by_a_retried_verification(gateway):
+    fake, processor = gateway
+
+    async def scenario():
+        created = await processor.process_paypal_payment(10.0, user_id=1)
+        data = {"paymentId": created["payment_id"], "payerId": "P1"}
+        results = [await processor.verify_payment(PaymentGateway.PAYPAL, created["payment_id"], data) for _ in range(2)]
+        await processor.client.aclose()
+        return created["payment_id"], results
+
+    payment_id, results = asyncio.run(scenario())
+    assert results == [True, True]
+    assert fake.calls[f"/v1/payments/payment/{payment_id}/execute"] == 2
+    assert fake.payments[payment_id]["state"] == "approved"
@@ -0,0 +1,51 @@
+"""
+Tests for the cached authenticated-user lookup
+"""
+
+import pytest
+
+from backend.auth import get_tokens
+from backend.models import User, UserRole
+from backend.principal_cache import principal_cache
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    principal_cache.clear()
+    yield
+    principal_cache.clear()
+
+
+def test_repeat_requests_hit_cache(client, make_user):
+    """Only the first request resolves the user from the database"""
+    user_id, headers = make_user("seeker")
+    before = principal_cache.stats()
+
+    for _ in range(3):
+        response = client.get("/api/users/me", headers=headers)
+        assert response.status_code == 200
+        assert response.json()["id"] == user_id
+
+    after = principal_cache.stats()
+    assert after["misses"] - before["misses"] == 1
+    assert after["hits"] - before["hits"] == 2
+
+
+def test_role_and_active_changes_invalidate(client, make_user, database):
+    """Updating role or is_active is visible on the very next request"""
+    session_factory, _ = database
+    user_id, headers = make_user("seeker")
+    assert client.get("/api/astrologer/queue", headers=headers).status_code == 403
+
+    db = session_factory()
+    db.get(User, user_id).role = UserRole.ASTROLOGER
+    db.commit()
+    assert client.get("/api/astrologer/queue", headers=headers).status_code == 200
+
+    db.get(User, user_id).is_active = False
+    db.commit()
+    db.close()
+    # Deactivation revokes the tokens already issued; a newer one reaches the is_active check
+    assert client.get("/api/users/me", headers=headers).status_code == 401
+    fresh = get_tokens(user_id, "seeker", UserRole.ASTROLOGER.value).access_token
+    assert client.get("/api/users/me", headers={"Authorization": f"Bearer {fresh}"}).status_code == 403
@@ -0,0 +1,69 @@
+"""
+Tests for the paginated question thread
+"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from backend.models import Message, MessageType, Question
+
+
+def _seed_thread(session_factory, user_id, count):
+    db = session_factory()
+    question = Question(user_id=user_id, category="Love", title="Will we reconcile soon?")
+    db.add(question)
+    db.flush()
+    start = datetime(2024, 1, 1)
+    for i in range(count):
+        # Pairs share a timestamp so the id tiebreaker is exercised
+        db.add(Message(question_id=question.id, user_id=user_id, message_type=MessageType.FOLLOW_UP,
+                       content=f"message {i:03d}", created_at=start + timedelta(minutes=i // 2)))
+    db.commit()
+    question_id = question.id
+    db.close()
+    return question_id
+
+
+def test_thread_pages_cover_every_message_once(client, make_user, database):
+    """Walking the cursor returns the whole thread in order without duplicates"""
+    session_factory, _ = database
+    user_id, headers = make_user("seeker")
+    question_id = _seed_thread(session_factory, user_id, 25)
+
+    detail = client.get(f"/api/questions/{question_id}?message_limit=10", headers=headers).json()
+    contents = [m["content"] for m in detail["messages"]]
+    cursor = detail["next_message_cursor"]
+    while cursor:
+        page = client.get(f"/api/questions/{question_id}/messages",
+                          params={"limit": 10, "cursor": cursor}, headers=headers).json()
+        contents += [m["content"] for m in page["items"]]
+        cursor = page["next_cursor"]
+
+    assert contents == [f"message {i:03d}" for i in range(25)]
+    assert client.get(f"/api/questions/{question_id}/messages?cursor=not-a-cursor",
+                      headers=headers).status_code == 400
+
+
+def test_detail_query_count_is_constant(client, make_user, database):
+    """A long thread costs the same number of queries as a short one"""
+    session_factory, async_session_factory = database
+    user_id, headers = make_user("seeker")
+    short_id = _seed_thread(session_factory, user_id, 2)
+    long_id = _seed_thread(session_factory, user_id, 150)
+
+    statements = []
+    sync_engine = async_session_factory.kw["bind"].sync_engine
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(sync_engine, "before_cursor_execute", listener)
+    try:
+        counts = []
+        for question_id in (short_id, long_id):
+            client.get(f"/api/questions/{question_id}", headers=headers)  # warm the principal cache
+            statements.clear()
+            client.get(f"/api/questions/{question_id}", headers=headers)
+            counts.append(len(statements))
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", listener)
+
+    assert counts[0] == counts[1] == 2
@@ -0,0 +1,111 @@
+"""
+Tests for token-bucket rate limiting and admission control
+"""
+
+import asyncio
+
+from fastapi.testclient import TestClient
+from sqlalchemy.pool import QueuePool
+from sqlalchemy import create_engine
+
+from backend.models import Question
+from backend.rate_limit import (
+    AdmissionControlMiddleware, Budget, LocalBucketStore, RateLimiter, SharedBucketBackend, pool_exhausted,
+    rate_limiter
+)
+
+
+def test_budgets_refill_over_time():
+    budget = Budget.parse("2/second")
+    assert (budget.burst, budget.rate) == (2, 2)
+
+    limiter = RateLimiter(budgets={"login": Budget(2, 1000)}, enabled=True)
+
+    async def scenario():
+        results = [(await limiter.hit("login", "ip:1"))[0] for _ in range(3)]
+        results.append((await limiter.hit("login", "ip:2"))[0])
+        await asyncio.sleep(0.01)
+        results.append((await limiter.hit("login", "ip:1"))[0])
+        return results
+
+    assert asyncio.run(scenario()) == [True, True, False, True, True]
+
+
+def test_shared_backend_is_shared_between_workers():
+    store = LocalBucketStore()
+    budgets = {"send_message": Budget.parse("3/minute")}
+    workers = [RateLimiter(SharedBucketBackend(store), budgets, enabled=True) for _ in range(2)]
+
+    async def scenario():
+        return [(await workers[i % 2].hit("send_message", "user:7")) for i in range(4)]
+
+    results = asyncio.run(scenario())
+    assert [allowed for allowed, _ in results] == [True, True, True, False]
+    assert 0 < results[-1][1] <= 20
+
+    workers[0].reset()
+    assert asyncio.run(workers[1].hit("send_message", "user:7"))[0]
+
+
+def test_login_is_limited_per_ip(client, make_user, monkeypatch):
+    make_user("seeker")
+    monkeypatch.setitem(rate_limiter.budgets, "login", Budget.parse("2/minute"))
+    credentials = {"username": "seeker", "password": "password123"}
+
+    assert client.post("/api/auth/login", json=credentials).status_code == 200
+    assert client.post("/api/auth/login", json=credentials).status_code == 200
+    limited = client.post("/api/auth/login", json=credentials)
+    assert limited.status_code == 429
+    assert int(limited.headers["Retry-After"]) >= 1
+
+
+def test_websocket_messages_over_budget_are_rejected(client, make_user, database, test_sink, monkeypatch):
+    session_factory, _ = database
+    user_id, headers = make_user("seeker")
+    monkeypatch.setitem(rate_limiter.budgets, "ws_message", Budget.parse("1/minute"))
+    monkeypatch.setitem(rate_limiter.budgets, "create_question", Budget.parse("1/minute"))
+
+    question = {"category": "Love", "title": "Will we meet again?", "description": "Soon?"}
+    assert client.post("/api/questions", json=question, headers=headers).status_code == 200
+    assert client.post("/api/questions", json=question, headers=headers).status_code == 429
+
+    db = session_factory()
+    question_id = db.query(Question.id).scalar()
+    db.close()
+    with client.websocket_connect(f"/ws/questions/{question_id}/{user_id}") as ws:
+        ws.send_json({"type": "message", "content": "first", "client_id": "a"})
+        ws.send_json({"type": "message", "content": "second", "client_id": "b"})
+        frames = [ws.receive_json(), ws.receive_json()]
+    rejected = [frame for frame in frames if frame["type"] == "error"]
+    assert [frame["client_id"] for frame in rejected] == ["b"]
+
+
+def test_admission_control_sheds_when_the_pool_is_exhausted():
+    engine = create_engine("sqlite://", poolclass=QueuePool, pool_size=1, max_overflow=0)
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    client = TestClient(AdmissionControlMiddleware(app, engines=(engine,)))
+    assert client.get("/api/questions").status_code == 200
+
+    connection = engine.connect()
+    try:
+        shed = client.get("/api/questions")
+        assert shed.status_code == 503 and shed.headers["Retry-After"] == "1"
+        assert client.get("/health").status_code == 200
+    finally:
+        connection.close()
+    assert client.get("/api/questions").status_code == 200
+
+
+def test_unlimited_overflow_is_never_exhausted():
+    engine = create_engine("sqlite://", poolclass=QueuePool, pool_size=1, max_overflow=-1)
+    connections = [engine.connect() for _ in range(3)]
+    try:
+        assert not pool_exhausted(engine)
+    finally:
+        for connection in connections:
+            connection.close()
+        engine.dispose()
@@ -0,0 +1,130 @@
+"""
+Tests for the denormalized astrologer rating aggregates
+"""
+
+from sqlalchemy import insert
+
+import backend.ratings  # noqa: F401 - registers the aggregate hooks
+from backend.models import Consultation, Message, Question, Rating, User, UserRole
+
+
+def _questions(session_factory, user_id, count, **fields):
+    db = session_factory()
+    questions = [Question(user_id=user_id, category="Love", title=f"Question {i}", **fields) for i in range(count)]
+    db.add_all(questions)
+    db.commit()
+    ids = [question.id for question in questions]
+    db.close()
+    return ids
+
+
+def _aggregates(session_factory, astrologer_id):
+    db = session_factory()
+    user = db.get(User, astrologer_id)
+    db.close()
+    return user.rating_sum, user.rating_count, user.average_rating, user.total_consultations
+
+
+def test_ratings_maintain_running_aggregates(client, make_user, database):
+    """Creating, changing and deleting ratings keeps sum, count and average in step"""
+    session_factory, _ = database
+    user_id, headers = make_user("seeker")
+    astrologer_id, _ = make_user("guru", role=UserRole.ASTROLOGER, is_verified=True)
+    question_ids = _questions(session_factory, user_id, 3, assigned_to=astrologer_id)
+
+    ids = []
+    for score, question_id in zip((5, 4, 3), question_ids):
+        response = client.post("/api/ratings", headers=headers,
+                               json={"astrologer_id": astrologer_id, "question_id": question_id, "rating": score})
+        assert response.status_code == 200
+        ids.append(response.json()["id"])
+    assert _aggregates(session_factory, astrologer_id)[:3] == (12, 3, 4.0)
+
+    assert client.delete(f"/api/ratings/{ids[0]}", headers=headers).status_code == 200
+    assert _aggregates(session_factory, astrologer_id)[:3] == (7, 2, 3.5)
+
+    db = session_factory()
+    db.get(Rating, ids[1]).rating = 1
+    db.commit()
+    db.close()
+    assert _aggregates(session_factory, astrologer_id)[:3] == (4, 2, 2.0)
+
+
+def test_consultation_completion_counts(make_user, database):
+    session_factory, _ = database
+    user_id, _ = make_user("seeker")
+    astrologer_id, _ = make_user("guru", role=UserRole.ASTROLOGER)
+
+    db = session_factory()
+    consultation = Consultation(user_id=user_id, astrologer_id=astrologer_id, amount=50.0)
+    db.add(consultation)
+    db.commit()
+    assert _aggregates(session_factory, astrologer_id)[3] == 0
+
+    consultation.status = "completed"
+    db.commit()
+    assert _aggregates(session_factory, astrologer_id)[3] == 1
+
+    consultation.status = "cancelled"
+    db.commit()
+    db.close()
+    assert _aggregates(session_factory, astrologer_id)[3] == 0
+
+
+def test_reconcile_and_rating_sorted_listing(client, make_user, database):
+    """Rows written behind the ORM's back are fixed by reconciliation"""
+    session_factory, _ = database
+    user_id, _ = make_user("seeker")
+    _, admin_headers = make_user("root", role=UserRole.ADMIN)
+    astrologers = [
+        make_user(f"guru{i}", role=UserRole.ASTROLOGER, is_verified=True)[0]
+        for i in range(4)
+    ]
+
+    db = session_factory()
+    db.execute(insert(Rating.__table__), [
+        {"user_id": user_id, "astrologer_id": astrologer_id, "rating": score}
+        for astrologer_id, scores in zip(astrologers, [(2, 3), (5,), (4, 5), (1,)])
+        for score in scores
+    ])
+    db.commit()
+    db.close()
+    assert _aggregates(session_factory, astrologers[1])[:2] == (0, 0)
+
+    response = client.post("/api/admin/ratings/reconcile", headers=admin_headers)
+    assert response.json() == {"astrologers": 4}
+    assert _aggregates(session_factory, astrologers[2])[:3] == (9, 2, 4.5)
+
+    response = client.get("/api/astrologers?sort=rating&min_rating=2&limit=2")
+    assert [a["id"] for a in response.json()] == [astrologers[1], astrologers[2]]
+    response = client.get(f"/api/astrologers?sort=rating&min_rating=2&limit=2&cursor={response.headers['X-Next-Cursor']}")
+    assert [a["id"] for a in response.json()] == [astrologers[0]]
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_only_served_questions_can_be_rated_once(client, make_user, database):
+    """Ratings drive the directory ranking, so they need a question the astrologer worked on"""
+    session_factory, _ = database
+    user_id, headers = make_user("seeker")
+    other_id, _ = make_user("other")
+    astrologer_id, _ = make_user("guru", role=UserRole.ASTROLOGER, is_verified=True)
+    rival_id, _ = make_user("rival", role=UserRole.ASTROLOGER, is_verified=True)
+    unserved, answered = _questions(session_factory, user_id, 2)
+    theirs, = _questions(session_factory, other_id, 1, assigned_to=astrologer_id)
+
+    db = session_factory()
+    db.add(Message(question_id=answered, user_id=astrologer_id, astrologer_id=astrologer_id, content="Yes"))
+    db.commit()
+    db.close()
+
+    def rate(astrologer, question):
+        return client.post("/api/ratings", headers=headers,
+                           json={"astrologer_id": astrologer, "question_id": question, "rating": 5}).status_code
+
+    assert rate(astrologer_id, unserved) == 403
+    assert rate(astrologer_id, theirs) == 403
+    assert rate(rival_id, answered) == 403
+    assert client.post("/api/ratings", headers=headers, json={"astrologer_id": astrologer_id, "rating": 5}).status_code == 422
+    assert rate(astrologer_id, answered) == 200
+    assert rate(astrologer_id, answered) == 409
+    assert _aggregates(session_factory, astrologer_id)[:2] == (5, 1)
@@ -0,0 +1,77 @@
+"""
+Tests for full-text search over questions and messages
+"""
+
+from backend.models import Message, MessageType, Question, UserRole
+
+
+def _seed(session_factory, owner_id, other_id):
+    db = session_factory()
+    questions = [
+        Question(user_id=owner_id, category="Love", title="Will Venus bring love this year?",
+                 description="Venus transits my seventh house"),
+        Question(user_id=owner_id, category="Work", title="Career change in spring?",
+                 description="Saturn return and a new job offer"),
+        Question(user_id=other_id, category="Love", title="Is my partner my soulmate?",
+                 description="Venus and Mars conjunct in synastry"),
+    ]
+    db.add_all(questions)
+    db.commit()
+    db.add_all([
+        Message(question_id=questions[0].id, user_id=owner_id, message_type=MessageType.FOLLOW_UP,
+                content="My birth chart shows Venus retrograde"),
+        Message(question_id=questions[1].id, user_id=owner_id, message_type=MessageType.FOLLOW_UP,
+                content="The offer arrives with Jupiter"),
+    ])
+    db.commit()
+    ids = [q.id for q in questions]
+    db.close()
+    return ids
+
+
+def test_search_is_ranked_and_scoped_to_the_user(client, make_user, database):
+    session_factory, _ = database
+    owner_id, headers = make_user("seeker")
+    other_id, _ = make_user("other")
+    _, astrologer_headers = make_user("guru", role=UserRole.ASTROLOGER)
+    ids = _seed(session_factory, owner_id, other_id)
+
+    hits = client.get("/api/search?q=venus", headers=headers).json()["items"]
+    assert [hit["question_id"] for hit in hits] == [ids[0]]
+
+    hits = client.get("/api/search?q=venus", headers=astrologer_headers).json()["items"]
+    assert sorted(hit["question_id"] for hit in hits) == [ids[0], ids[2]]
+
+    # Stemming and prefix match on the last word
+    hits = client.get("/api/search?q=transiting sev", headers=headers).json()["items"]
+    assert [hit["question_id"] for hit in hits] == [ids[0]]
+
+    hits = client.get("/api/search?q=retrograde&scope=messages", headers=headers).json()["items"]
+    assert [hit["question_id"] for hit in hits] == [ids[0]]
+    assert "Venus retrograde" in hits[0]["snippet"]
+
+
+def test_search_index_follows_updates_and_paginates(client, make_user, database):
+    session_factory, _ = database
+    owner_id, headers = make_user("seeker")
+    ids = _seed(session_factory, owner_id, owner_id)
+
+    db = session_factory()
+    db.get(Question, ids[1]).title = "Venus and my career"
+    db.commit()
+    db.close()
+
+    seen = []
+    cursor = ""
+    while True:
+        page = client.get(f"/api/search?q=venus&limit=1&cursor={cursor}", headers=headers).json()
+        seen += [hit["question_id"] for hit in page["items"]]
+        if not page["next_cursor"]:
+            break
+        cursor = page["next_cursor"]
+    assert sorted(seen) == ids
+
+    page = client.get("/api/search?q=venus&sort=recent&limit=2", headers=headers).json()
+    assert [hit["question_id"] for hit in page["items"]] == [ids[2], ids[1]]
+
+    assert client.get("/api/search?q=%21%21", headers=headers).status_code == 400
@@ -0,0 +1,49 @@
+"""
+Tests for the row-tuple serializer behind the listing endpoints
+"""
+
+import json
+from datetime import datetime
+
+from backend.models import Message, MessageType, Notification, NotificationType, Question, UserRole
+from backend.schemas import MessageResponse, NotificationResponse
+from backend.serialization import dumps
+
+
+def test_row_listings_match_the_pydantic_schemas(client, make_user, database):
+    session_factory, _ = database
+    user_id, headers = make_user("seeker")
+    astrologer_id, astrologer_headers = make_user("guru", role=UserRole.ASTROLOGER, is_verified=True)
+
+    db = session_factory()
+    question = Question(user_id=user_id, category="Love", title="Will we meet again?",
+                        assigned_to=astrologer_id, created_at=datetime(2024, 1, 1, 9, 30, 0, 125000))
+    db.add(question)
+    db.flush()
+    db.add(Message(question_id=question.id, user_id=astrologer_id, astrologer_id=astrologer_id,
+                   message_type=MessageType.ANSWER, content="Venus says yes",
+                   created_at=datetime(2024, 1, 2, 8, 0)))
+    db.add(Notification(user_id=user_id, type=NotificationType.ANSWER_PROVIDED, subject="Answered",
+                        message="Your question was answered", related_question_id=question.id,
+                        created_at=datetime(2024, 1, 2, 8, 0, 1)))
+    db.commit()
+    expected_messages = [MessageResponse.model_validate(m).model_dump(mode="json") for m in db.query(Message)]
+    expected_notifications = [
+        NotificationResponse.model_validate(n).model_dump(mode="json") for n in db.query(Notification)
+    ]
+    question_id = question.id
+    db.close()
+
+    messages = client.get(f"/api/questions/{question_id}/messages", headers=headers).json()
+    assert messages == {"items": expected_messages, "next_cursor": None}
+    assert client.get("/api/notifications", headers=headers).json() == expected_notifications
+
+    queue = client.get("/api/astrologer/queue", headers=astrologer_headers).json()["items"]
+    assert queue[0]["id"] == question_id
+    assert queue[0]["created_at"] == "2024-01-01T09:30:00.125000"
+    assert queue[0]["status"] == "pending"
+
+
+def test_dumps_handles_enums_and_datetimes():
+    payload = {"type": MessageType.ANSWER, "at": datetime(2024, 5, 1, 12, 0)}
+    assert json.loads(dumps(payload)) == {"type": "answer", "at": "2024-05-01T12:00:00"}
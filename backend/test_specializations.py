@@ -0,0 +1,69 @@
+"""
+Tests for specialization tags and the cached astrologer directory
+"""
+
+from sqlalchemy import select
+
+from backend.models import Specialization, User, UserRole, astrologer_specializations
+from backend.http_cache import response_cache
+from backend.specializations import directory_cache, specialization_tags
+
+
+def _tags_of(session_factory, user_id):
+    db = session_factory()
+    tags = db.execute(
+        select(Specialization.name)
+        .join(astrologer_specializations, astrologer_specializations.c.specialization_id == Specialization.id)
+        .where(astrologer_specializations.c.user_id == user_id)
+        .order_by(Specialization.name)
+    ).scalars().all()
+    db.close()
+    return tags
+
+
+def test_specialization_is_split_into_linked_tags(make_user, database):
+    session_factory, _ = database
+    assert specialization_tags("Vedic Astrology, Love & Relationships") == [
+        "astrology", "love", "relationships", "vedic"
+    ]
+
+    astrologer_id, _ = make_user("guru", role=UserRole.ASTROLOGER, specialization="Vedic, Career")
+    assert _tags_of(session_factory, astrologer_id) == ["career", "vedic"]
+
+    db = session_factory()
+    db.get(User, astrologer_id).specialization = "Career and Money"
+    db.commit()
+    db.close()
+    assert _tags_of(session_factory, astrologer_id) == ["career", "money"]
+
+    db = session_factory()
+    assert db.query(Specialization).count() == 3
+    db.close()
+
+
+def test_directory_filters_by_tag_and_is_invalidated(client, make_user, database):
+    session_factory, _ = database
+    vedic_id, _ = make_user("vedic", role=UserRole.ASTROLOGER, is_verified=True, specialization="Vedic Astrology")
+    love_id, _ = make_user("love", role=UserRole.ASTROLOGER, is_verified=True,
+                           specialization="Love & Relationships, Vedic")
+    make_user("hidden", role=UserRole.ASTROLOGER, specialization="Vedic")
+
+    response = client.get("/api/astrologers?specialization=vedic")
+    assert [a["id"] for a in response.json()] == [vedic_id, love_id]
+    response = client.get("/api/astrologers?specialization=Love%20%26%20Vedic")
+    assert [a["id"] for a in response.json()] == [love_id]
+
+    # Skip the HTTP response cache so the request reaches the directory cache
+    response_cache.clear()
+    hits = directory_cache.hits
+    client.get("/api/astrologers?specialization=vedic")
+    assert directory_cache.hits == hits + 1
+
+    db = session_factory()
+    db.get(User, vedic_id).bio = "Thirty years of chart reading"
+    db.commit()
+    db.close()
+    assert len(directory_cache) == 0
+
+    response = client.get("/api/astrologers?specialization=vedic")
+    assert response.json()[0]["bio"] == "Thirty years of chart reading"
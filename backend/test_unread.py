@@ -0,0 +1,111 @@
+"""
+Tests for bulk mark-read and the cached unread counter
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from backend.models import Notification, NotificationType, Question
+from backend.unread import unread_counter
+
+
+def _add_notifications(session_factory, user_id, count, start=datetime(2024, 1, 1)):
+    db = session_factory()
+    db.add_all([
+        Notification(user_id=user_id, type=NotificationType.FOLLOW_UP, subject=f"n{i}", message="ping",
+                     created_at=start + timedelta(minutes=i))
+        for i in range(count)
+    ])
+    db.commit()
+    ids = [n.id for n in db.query(Notification).filter(Notification.user_id == user_id).order_by(Notification.id)]
+    db.close()
+    return ids
+
+
+def test_bulk_mark_read_is_one_update(client, make_user, database):
+    session_factory, async_session_factory = database
+    user_id, headers = make_user("seeker")
+    other_id, _ = make_user("other")
+    ids = _add_notifications(session_factory, user_id, 10)
+    _add_notifications(session_factory, other_id, 2)
+
+    statements = []
+    engine = async_session_factory.kw["bind"].sync_engine
+    record = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        response = client.post("/api/notifications/read", json={"ids": ids[:3]}, headers=headers)
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert response.json()["marked"] == 3
+    assert [s.split()[0] for s in statements if not s.startswith("SELECT")] == ["UPDATE"]
+
+    response = client.post("/api/notifications/read", json={"up_to_id": ids[5]}, headers=headers)
+    assert response.json() == {"status": "success", "marked": 3, "unread_count": 4}
+
+    response = client.post("/api/notifications/read", json={"before": "2024-01-01T00:08:00"}, headers=headers)
+    assert response.json()["marked"] == 3
+
+    assert client.post("/api/notifications/read", json={}, headers=headers).status_code == 400
+    assert client.post("/api/notifications/read-all", headers=headers).json()["marked"] == 1
+    assert client.get("/api/notifications?unread_only=true", headers=headers).json() == []
+
+    assert client.patch(f"/api/notifications/{ids[0]}/read", headers=headers).status_code == 200
+    assert client.patch("/api/notifications/999999/read", headers=headers).status_code == 404
+
+
+def test_unread_count_is_kept_current_and_pushed(client, make_user, database):
+    session_factory, _ = database
+    user_id, headers = make_user("seeker")
+    ids = _add_notifications(session_factory, user_id, 4)
+
+    assert client.get("/api/notifications/unread-count", headers=headers).json() == {"unread_count": 4}
+
+    # Later writes adjust the cached count without another COUNT query
+    _add_notifications(session_factory, user_id, 2)
+    db = session_factory()
+    db.get(Notification, ids[0]).is_read = True
+    db.commit()
+    db.close()
+    misses = unread_counter.stats()["misses"]
+    assert client.get("/api/notifications/unread-count", headers=headers).json() == {"unread_count": 5}
+    assert unread_counter.stats()["misses"] == misses
+
+    db = session_factory()
+    question = Question(user_id=user_id, category="Love", title="Is this the right person?")
+    db.add(question)
+    db.commit()
+    question_id = question.id
+    db.close()
+
+    with client.websocket_connect(f"/ws/questions/{question_id}/{user_id}") as ws:
+        client.post("/api/notifications/read", json={"ids": ids[1:3]}, headers=headers)
+        frame = ws.receive_json()
+    assert frame["type"] == "unread_count" and frame["count"] == 3
+
+
+def test_count_loaded_before_a_commit_is_not_cached_after_it(make_user, database):
+    """A notification committed while the count query is in flight must not leave a stale count"""
+    session_factory, async_session_factory = database
+    user_id, _ = make_user("seeker")
+    _add_notifications(session_factory, user_id, 2)
+
+    class CommitDuringQuery:
+        def __init__(self, db):
+            self.db = db
+
+        async def execute(self, statement):
+            result = await self.db.execute(statement)
+            # Another request commits a new notification before the count is stored
+            _add_notifications(session_factory, user_id, 1, start=datetime(2024, 2, 1))
+            return result
+
+    async def scenario():
+        async with async_session_factory() as db:
+            stale = await unread_counter.get_many(CommitDuringQuery(db), [user_id])
+            fresh = await unread_counter.get(db, user_id)
+        return stale[user_id], fresh
+
+    assert asyncio.run(scenario()) == (2, 3)
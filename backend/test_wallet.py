@@ -0,0 +1,110 @@
+"""
+Tests for the wallet ledger, including concurrent debits
+"""
+
+import asyncio
+
+import pytest
+from sqlalchemy import select
+
+from backend import wallet
+from backend.models import UserRole, WalletEntry
+from backend.payments import PaymentGateway, PaymentProcessor
+
+
+def test_postings_update_the_snapshot_and_repeat_by_reference(database, make_user):
+    user_id, _ = make_user("seeker")
+    _, async_session_factory = database
+
+    async def scenario():
+        async with async_session_factory() as db:
+            assert await wallet.balance(db, user_id) == 0
+            with pytest.raises(wallet.InsufficientFunds):
+                await wallet.debit(db, user_id, 100, "consultation", "c-0")
+
+            first = await wallet.credit(db, user_id, 5000, "topup", "topup-1")
+            again = await wallet.credit(db, user_id, 5000, "topup", "topup-1")
+            assert again.id == first.id
+            with pytest.raises(wallet.WalletError):
+                await wallet.credit(db, user_id, 700, "topup", "topup-1")
+
+            paid = await wallet.debit(db, user_id, 3000, "consultation", "c-1")
+            assert (paid.version, paid.amount, paid.balance_after) == (2, -3000, 2000)
+            with pytest.raises(wallet.InsufficientFunds):
+                await wallet.debit(db, user_id, 2001, "consultation", "c-2")
+
+            assert await wallet.snapshot(db, user_id) == (2000, 2)
+            assert [entry.reference for entry in await wallet.entries(db, user_id)] == ["c-1", "topup-1"]
+            assert [entry.reference for entry in await wallet.entries(db, user_id, before_version=2)] == ["topup-1"]
+            report = await wallet.audit(db, user_id)
+            assert report["consistent"] and report["ledger_balance"] == 2000
+
+            entry = await db.scalar(select(WalletEntry).where(WalletEntry.reference == "c-1"))
+            entry.amount = 0
+            with pytest.raises(wallet.WalletError):
+                await db.commit()
+
+    asyncio.run(scenario())
+
+
+def test_thousands_of_parallel_debits_never_overdraw(database, make_user):
+    user_id, _ = make_user("seeker")
+    _, async_session_factory = database
+    funds, debits = 800, 2000
+
+    async def debit(n):
+        async with async_session_factory() as db:
+            try:
+                await wallet.debit(db, user_id, 1, "consultation", f"c-{n}")
+                return True
+            except wallet.InsufficientFunds:
+                return False
+
+    async def scenario():
+        async with async_session_factory() as db:
+            await wallet.credit(db, user_id, funds, "topup", "topup-1")
+        results = await asyncio.gather(*(debit(n) for n in range(debits)))
+        async with async_session_factory() as db:
+            versions = list(await db.scalars(
+                select(WalletEntry.version).where(WalletEntry.user_id == user_id).order_by(WalletEntry.version)
+            ))
+            return results, versions, await wallet.audit(db, user_id)
+
+    results, versions, report = asyncio.run(scenario())
+    assert results.count(True) == funds
+    assert versions == list(range(1, funds + 2))
+    assert report == {"balance": 0, "version": funds + 1, "ledger_balance": 0, "entries": funds + 1,
+                      "consistent": True}
+
+
+def test_wallet_payments_and_admin_adjustments(client, database, make_user):
+    user_id, headers = make_user("seeker")
+    _, admin_headers = make_user("admin", role=UserRole.ADMIN)
+    _, async_session_factory = database
+
+    credit = client.post(f"/api/admin/wallets/{user_id}/adjustments",
+                         json={"amount": 40.0, "reference": "promo-1", "kind": "topup"}, headers=admin_headers)
+    assert credit.status_code == 200 and credit.json()["balance_after"] == 40.0
+    assert client.post(f"/api/admin/wallets/{user_id}/adjustments", json={"amount": 5.0, "reference": "x"},
+                       headers=headers).status_code == 403
+    assert client.post(f"/api/admin/wallets/{user_id}/adjustments", json={"amount": -50.0, "reference": "fix-1"},
+                       headers=admin_headers).status_code == 409
+
+    async def pay():
+        processor = PaymentProcessor()
+        async with async_session_factory() as db:
+            return [
+                await processor.process_consultation_payment(user_id, 2, 25.5, PaymentGateway.WALLET, db, "cons-1"),
+                await processor.process_consultation_payment(user_id, 2, 25.5, PaymentGateway.WALLET, db, "cons-1"),
+                await processor.process_consultation_payment(user_id, 2, 25.5, PaymentGateway.WALLET, db, "cons-2"),
+            ]
+
+    first, repeated, second = asyncio.run(pay())
+    assert first["success"] and first["balance"] == 14.5
+    assert repeated["transaction_id"] == first["transaction_id"]
+    assert second == {"success": False, "error": "Insufficient wallet balance"}
+
+    mine = client.get("/api/wallet", headers=headers).json()
+    assert mine["balance"] == 14.5 and mine["version"] == 2
+    assert [(entry["kind"], entry["amount"]) for entry in mine["entries"]] == [("consultation", -25.5), ("topup", 40.0)]
+    assert client.get(f"/api/admin/wallets/{user_id}/audit", headers=admin_headers).json()["consistent"]
@@ -0,0 +1,112 @@
+"""
+Local stand-in for the PayPal, Khalti and eSewa APIs
+
+Serves the endpoints PaymentProcessor calls, under one app:
+    /v1/...               PayPal   (PAYPAL_API_URL=http://127.0.0.1:8900)
+    /khalti/...           Khalti   (KHALTI_API_URL=http://127.0.0.1:8900/khalti)
+    /esewa/...            eSewa    (ESEWA_API_URL=http://127.0.0.1:8900/esewa)
+
+Tests drive it in-process through httpx.ASGITransport; run it as a real
+server with `python -m backend.testing.fake_gateway`. FakeGateway.fail()
+makes the next calls (or the next calls to one path) answer 503 and FakeGateway.delay slows every answer,
+for exercising timeouts, retries and the circuit breaker.
+"""
+
+import asyncio
+import uuid
+from collections import Counter
+from urllib.parse import parse_qs
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+
+class FakeGateway:
+    """The fake gateway app and what it has been asked"""
+
+    def __init__(self, token_lifetime: int = 32400):
+        self.token_lifetime = token_lifetime
+        self.delay = 0.0
+        self.calls = Counter()
+        self.payments = {}
+        self.executions = {}  # PayPal-Request-Id -> first answer, replayed for repeats
+        self.verified_tokens = set()
+        self._failures = Counter()
+        self.app = self._build()
+
+    def fail(self, times: int = 1, path: str = None):
+        """Answer the next `times` calls (to path, when given) with 503"""
+        self._failures[path] += times
+
+    def _build(self) -> FastAPI:
+        app = FastAPI(title="Fake payment gateway")
+
+        @app.middleware("http")
+        async def faults(request: Request, call_next):
+            self.calls[request.url.path] += 1
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            for key in (request.url.path, None):
+                if self._failures[key]:
+                    self._failures[key] -= 1
+                    return JSONResponse({"error": "unavailable"}, status_code=503)
+            return await call_next(request)
+
+        @app.post("/v1/oauth2/token")
+        async def paypal_token(request: Request):
+            if not request.headers.get("authorization", "").startswith("Basic "):
+                return JSONResponse({"error": "invalid_client"}, status_code=401)
+            return {
+                "access_token": f"A21.{uuid.uuid4().hex}",
+                "token_type": "Bearer",
+                "expires_in": self.token_lifetime
+            }
+
+        @app.post("/v1/payments/payment")
+        async def paypal_create(request: Request):
+            payment_id = f"PAYID-{uuid.uuid4().hex[:12].upper()}"
+            self.payments[payment_id] = {"state": "created", "body": await request.json()}
+            return JSONResponse({
+                "id": payment_id,
+                "state": "created",
+                "links": [{"rel": "approval_url", "href": f"https://paypal.test/approve/{payment_id}"}]
+            }, status_code=201)
+
+        @app.post("/v1/payments/payment/{payment_id}/execute")
+        async def paypal_execute(payment_id: str, request: Request):
+            request_id = request.headers.get("paypal-request-id")
+            if request_id in self.executions:
+                return JSONResponse(*self.executions[request_id])
+            payment = self.payments.get(payment_id)
+            if payment is None:
+                answer = ({"name": "INVALID_RESOURCE_ID"}, 404)
+            elif payment["state"] == "approved":
+                answer = ({"name": "PAYMENT_ALREADY_DONE"}, 400)
+            else:
+                payment["state"] = "approved"
+                answer = ({"id": payment_id, "state": "approved"}, 200)
+            if request_id:
+                self.executions[request_id] = answer
+            return JSONResponse(*answer)
+
+        @app.post("/khalti/payment/verify/")
+        async def khalti_verify(request: Request):
+            token = (await request.json()).get("token")
+            if not token or token.startswith("bad"):
+                return JSONResponse({"detail": "Invalid token"}, status_code=400)
+            self.verified_tokens.add(token)
+            return {"idx": token, "state": {"name": "Completed"}}
+
+        @app.post("/esewa/transrec")
+        async def esewa_transrec(request: Request):
+            form = parse_qs((await request.body()).decode())
+            code = "Failure" if form.get("pid", [""])[0].startswith("bad") else "Success"
+            return PlainTextResponse(f"<response><response_code>{code}</response_code></response>")
+
+        return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(FakeGateway().app, host="127.0.0.1", port=8900)
@@ -0,0 +1,129 @@
+"""
+Minimal in-process SMTP server, in the style of aiosmtpd's Controller
+
+    server = LocalSMTPServer()
+    server.start()
+    ... send mail to server.host:server.port ...
+    server.stop()
+    server.messages  # list of (mail_from, rcpt_tos, data)
+
+Supports EHLO/HELO, AUTH PLAIN/LOGIN (any credentials), MAIL, RCPT, DATA,
+RSET, NOOP and QUIT. STARTTLS is not offered.
+"""
+
+import asyncio
+import threading
+from typing import List, Tuple
+
+
+class LocalSMTPServer:
+    """Accept and record mail on localhost from a background event loop thread"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, fail_first: int = 0):
+        self.host = host
+        self.port = port
+        # Reply 451 to the first N DATA commands to exercise client retries
+        self.fail_first = fail_first
+        self.messages: List[Tuple[str, List[str], bytes]] = []
+        self.connections = 0
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        self._ready.wait(5)
+        return self
+
+    def stop(self):
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _serve(self):
+        self._loop = asyncio.new_event_loop()
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, self.host, self.port)
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            self._loop.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+
+        def reply(line: str):
+            writer.write(line.encode() + b"\r\n")
+
+        reply("220 localhost LocalSMTPServer ready")
+        mail_from, rcpt_tos = None, []
+        try:
+            while True:
+                raw = await reader.readline()
+                if not raw:
+                    break
+                command = raw.decode(errors="replace").strip()
+                verb = command.split(" ", 1)[0].upper()
+
+                if verb == "EHLO":
+                    writer.write(b"250-localhost\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n")
+                elif verb == "HELO":
+                    reply("250 localhost")
+                elif verb == "AUTH":
+                    parts = command.split()
+                    if parts[1].upper() == "LOGIN":
+                        for _ in range(2 - (len(parts) > 2)):
+                            reply("334 VXNlcm5hbWU6")
+                            await reader.readline()
+                    elif len(parts) == 2:
+                        reply("334 ")
+                        await reader.readline()
+                    reply("235 2.7.0 Authentication successful")
+                elif verb == "MAIL":
+                    mail_from, rcpt_tos = _address(command), []
+                    reply("250 OK")
+                elif verb == "RCPT":
+                    rcpt_tos.append(_address(command))
+                    reply("250 OK")
+                elif verb == "DATA":
+                    reply("354 End data with <CR><LF>.<CR><LF>")
+                    lines = []
+                    while True:
+                        line = await reader.readline()
+                        if line in (b".\r\n", b".\n", b""):
+                            break
+                        lines.append(line[1:] if line.startswith(b"..") else line)
+                    if self.fail_first > 0:
+                        self.fail_first -= 1
+                        reply("451 4.3.0 Try again later")
+                    else:
+                        self.messages.append((mail_from, rcpt_tos, b"".join(lines)))
+                        reply("250 OK queued")
+                elif verb in ("RSET", "NOOP"):
+                    reply("250 OK")
+                elif verb == "QUIT":
+                    reply("221 Bye")
+                    await writer.drain()
+                    break
+                else:
+                    reply("502 Command not implemented")
+                await writer.drain()
+        finally:
+            writer.close()
+
+
+def _address(command: str) -> str:
+    """Address from 'MAIL FROM:<a@b> SIZE=1' or 'RCPT TO:<a@b>'"""
+    return command.split(":", 1)[1].strip().split(" ")[0].strip("<>")
@@ -0,0 +1,132 @@
+"""
+Process-wide cache of OAuth client-credentials tokens
+
+A token is reused until shortly before it expires, then renewed while it
+is still valid, so callers never wait on a token request in steady state.
+Concurrent callers that do need a new token share one in-flight request
+instead of each asking the provider for their own.
+
+Tokens are keyed by whatever identifies the credentials, e.g.
+(token_url, client_id). Fetch callbacks return (access_token, expires_in)
+or None when the provider refused. The module has no dependencies outside
+the standard library so the desktop app can use it too.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+# Renew this many seconds before expiry, or halfway through short-lived tokens
+TOKEN_REFRESH_MARGIN = float(os.getenv("TOKEN_REFRESH_MARGIN", 300))
+
+Fetched = Optional[Tuple[str, float]]
+
+
+class CachedToken:
+    __slots__ = ("token", "expires_at", "refresh_at")
+
+    def __init__(self, token: str, expires_in: float, margin: float, now: float):
+        self.token = token
+        self.expires_at = now + expires_in
+        self.refresh_at = now + max(expires_in - margin, expires_in / 2)
+
+
+class AccessTokenCache:
+    """Tokens keyed by credentials, renewed ahead of expiry by one caller at a time"""
+
+    def __init__(self, refresh_margin: float = TOKEN_REFRESH_MARGIN):
+        self.refresh_margin = refresh_margin
+        self.hits = 0
+        self.refreshes = 0
+        self._tokens: Dict[Hashable, CachedToken] = {}
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._locks: Dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _store(self, key: Hashable, fetched: Fetched) -> Optional[str]:
+        if not fetched:
+            return self._valid(key)
+        token, expires_in = fetched
+        self._tokens[key] = CachedToken(token, float(expires_in), self.refresh_margin, time.monotonic())
+        self.refreshes += 1
+        return token
+
+    async def get(self, key: Hashable, fetch: Callable[[], Awaitable[Fetched]]) -> Optional[str]:
+        """The cached token, or one fetched with fetch() shared by every concurrent caller"""
+        cached = self._tokens.get(key)
+        now = time.monotonic()
+        if cached is not None and now < cached.expires_at:
+            self.hits += 1
+            if now >= cached.refresh_at:
+                # Still valid: renew in the background and keep serving this one
+                self._refresh(key, fetch)
+            return cached.token
+        # shield() so one cancelled caller does not cancel the fetch for the others
+        return await asyncio.shield(self._refresh(key, fetch))
+
+    def _refresh(self, key: Hashable, fetch: Callable[[], Awaitable[Fetched]]) -> asyncio.Task:
+        loop = asyncio.get_running_loop()
+        task = self._inflight.get(key)
+        if task is None or task.done() or task.get_loop() is not loop:
+            task = loop.create_task(self._fetch(key, fetch))
+            self._inflight[key] = task
+        return task
+
+    async def _fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Fetched]]) -> Optional[str]:
+        try:
+            return self._store(key, await fetch())
+        except Exception as e:
+            print(f"Token refresh failed for {key}: {e}")
+            return self._valid(key)
+        finally:
+            if self._inflight.get(key) is asyncio.current_task():
+                del self._inflight[key]
+
+    def get_sync(self, key: Hashable, fetch: Callable[[], Fetched]) -> Optional[str]:
+        """get() for threaded callers: one thread fetches while the others wait or keep the valid token"""
+        cached = self._tokens.get(key)
+        if cached is not None and time.monotonic() < cached.refresh_at:
+            self.hits += 1
+            return cached.token
+
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        still_valid = cached is not None and time.monotonic() < cached.expires_at
+        if not lock.acquire(blocking=not still_valid):
+            # Another thread is already renewing a token that has not expired yet
+            self.hits += 1
+            return cached.token
+        try:
+            cached = self._tokens.get(key)
+            if cached is not None and time.monotonic() < cached.refresh_at:
+                self.hits += 1
+                return cached.token
+            try:
+                return self._store(key, fetch())
+            except Exception as e:
+                print(f"Token refresh failed for {key}: {e}")
+                return self._valid(key)
+        finally:
+            lock.release()
+
+    def _valid(self, key: Hashable) -> Optional[str]:
+        """The cached token if it has not expired - a failed early renewal keeps using it"""
+        cached = self._tokens.get(key)
+        return cached.token if cached is not None and time.monotonic() < cached.expires_at else None
+
+    def invalidate(self, key: Hashable):
+        """Forget a token the provider rejected"""
+        self._tokens.pop(key, None)
+
+    def clear(self):
+        self._tokens.clear()
+        self._inflight.clear()
+
+    def stats(self) -> dict:
+        return {"tokens": len(self._tokens), "hits": self.hits, "refreshes": self.refreshes}
+
+
+# Global PayPal token cache
+paypal_tokens = AccessTokenCache()
@@ -0,0 +1,215 @@
+"""
+Cached per-user unread notification counts
+
+Counts are loaded from the database on first use and then adjusted in place
+by committed notification writes, so clients can read the badge from
+GET /api/notifications/unread-count or the "unread_count" WebSocket push
+instead of polling the notification list.
+
+Session hooks see ORM inserts, ORM-enabled bulk inserts and is_read changes
+on loaded notifications. ORM bulk update()/delete() statements cannot tell
+which users they touched, so they clear the cache unless they were run with
+execution_options(unread_counted=True) and the caller recorded the change
+with mark_unread_changed(). Other workers drop their copy of changed counts
+through the broadcaster.
+"""
+
+import os
+import threading
+from collections import Counter
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from backend.broadcast import broadcaster
+from backend.cache import TTLCache
+from backend.models import Notification
+from backend.websocket_manager import ConnectionManager, manager as default_manager
+
+UNREAD_CACHE_TTL = float(os.getenv("UNREAD_CACHE_TTL", 300))
+UNREAD_CACHE_SIZE = int(os.getenv("UNREAD_CACHE_SIZE", 50000))
+
+
+class UnreadCounter:
+    """Unread notification counts keyed by user id"""
+
+    def __init__(self, maxsize: int = UNREAD_CACHE_SIZE, ttl: float = UNREAD_CACHE_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        # user_id -> [loads in flight, changes seen since they started], so a count
+        # read before a commit is not stored after that commit's delta was skipped
+        self._loading: Dict[int, list] = {}
+        self._epoch = 0
+
+    async def get(self, db: AsyncSession, user_id: int) -> int:
+        return (await self.get_many(db, [user_id]))[user_id]
+
+    async def get_many(self, db: AsyncSession, user_ids: Iterable[int]) -> Dict[int, int]:
+        """Counts for user_ids - the uncached ones are loaded with one grouped query"""
+        counts, missing = {}, []
+        for user_id in user_ids:
+            count = self._cache.get(user_id)
+            if count is None:
+                missing.append(user_id)
+            else:
+                counts[user_id] = count
+
+        if missing:
+            with self._lock:
+                epoch = self._epoch
+                started = {}
+                for user_id in missing:
+                    loading = self._loading.setdefault(user_id, [0, 0])
+                    loading[0] += 1
+                    started[user_id] = loading[1]
+            loaded = None
+            try:
+                loaded = dict((await db.execute(
+                    select(Notification.user_id, func.count())
+                    .where(Notification.user_id.in_(missing), Notification.is_read == False)
+                    .group_by(Notification.user_id)
+                )).all())
+            finally:
+                with self._lock:
+                    for user_id in missing:
+                        loading = self._loading[user_id]
+                        if loaded is not None:
+                            counts[user_id] = loaded.get(user_id, 0)
+                            if epoch == self._epoch and loading[1] == started[user_id]:
+                                self._cache.set(user_id, counts[user_id])
+                        loading[0] -= 1
+                        if not loading[0]:
+                            del self._loading[user_id]
+        return counts
+
+    def apply(self, deltas: Dict[int, int]):
+        """Adjust the cached counts; uncached users are loaded on their next read"""
+        with self._lock:
+            for user_id, delta in deltas.items():
+                self._changed(user_id)
+                count = self._cache.get(user_id)
+                if count is not None:
+                    self._cache.set(user_id, max(count + delta, 0))
+
+    def invalidate(self, user_ids: Iterable[int]):
+        with self._lock:
+            for user_id in user_ids:
+                self._changed(user_id)
+                self._cache.invalidate(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._cache.clear()
+
+    def _changed(self, user_id: int):
+        loading = self._loading.get(user_id)
+        if loading is not None:
+            loading[1] += 1
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+async def push_unread_counts(db: AsyncSession, user_ids: Iterable[int],
+                             connection_manager: ConnectionManager = None):
+    """Send the current count to each user with an open socket"""
+    connection_manager = connection_manager or default_manager
+    # Another worker may hold the socket when broadcasting is distributed
+    online = [
+        user_id for user_id in dict.fromkeys(user_ids)
+        if connection_manager.broadcaster.distributed or connection_manager.get_user_active_questions(user_id)
+    ]
+    if not online:
+        return
+    counts = await unread_counter.get_many(db, online)
+    for user_id in online:
+        await connection_manager.send_to_user(user_id, {"type": "unread_count", "count": counts[user_id]})
+
+
+# ---- Keeping the counts current ----
+
+def mark_unread_changed(session: Optional[Session], user_id: int, delta: int):
+    """Adjust user_id's count by delta once session commits"""
+    if session is not None and delta:
+        deltas = session.info.setdefault("unread_deltas", Counter())
+        deltas[user_id] += delta
+
+
+@event.listens_for(Notification, "after_insert")
+def _notification_added(mapper, connection, target):
+    if not target.is_read:
+        mark_unread_changed(Session.object_session(target), target.user_id, 1)
+
+
+@event.listens_for(Notification, "after_update")
+def _notification_changed(mapper, connection, target):
+    history = inspect(target).attrs.is_read.history
+    if history.has_changes():
+        was_read = bool(history.deleted and history.deleted[0])
+        if was_read != bool(target.is_read):
+            mark_unread_changed(Session.object_session(target), target.user_id, 1 if was_read else -1)
+
+
+@event.listens_for(Notification, "after_delete")
+def _notification_deleted(mapper, connection, target):
+    if not target.is_read:
+        mark_unread_changed(Session.object_session(target), target.user_id, -1)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _bulk_notification_writes(orm_execute_state):
+    """Bulk statements skip mapper events"""
+    if orm_execute_state.bind_mapper is not inspect(Notification):
+        return
+    if orm_execute_state.is_insert:
+        rows = orm_execute_state.parameters or []
+        rows = [rows] if isinstance(rows, dict) else rows
+        if not rows or any("user_id" not in row for row in rows):
+            # insert().values(...) or from_select() - the users are unknown
+            orm_execute_state.session.info["unread_clear"] = True
+            return
+        for row in rows:
+            if not row.get("is_read"):
+                mark_unread_changed(orm_execute_state.session, row["user_id"], 1)
+    elif orm_execute_state.is_update or orm_execute_state.is_delete:
+        if not orm_execute_state.execution_options.get("unread_counted"):
+            orm_execute_state.session.info["unread_clear"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_after_commit(session):
+    deltas = session.info.pop("unread_deltas", None)
+    if session.info.pop("unread_clear", False):
+        unread_counter.clear()
+        if broadcaster.distributed:
+            broadcaster.publish_threadsafe("unread:clear", "")
+        return
+
+    if deltas:
+        unread_counter.apply(deltas)
+        if broadcaster.distributed:
+            broadcaster.publish_threadsafe("unread:invalidate", ",".join(str(user_id) for user_id in deltas))
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_after_rollback(session):
+    session.info.pop("unread_deltas", None)
+    session.info.pop("unread_clear", None)
+
+
+async def _on_unread_broadcast(channel: str, payload: str):
+    if channel == "unread:clear":
+        unread_counter.clear()
+    else:
+        # Also reaches the writing worker, which simply reloads its count
+        unread_counter.invalidate(int(user_id) for user_id in payload.split(","))
+
+
+broadcaster.subscribe("unread:", _on_unread_broadcast)
+
+
+# Global unread counter instance
+unread_counter = UnreadCounter()
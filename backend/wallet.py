@@ -0,0 +1,170 @@
+"""
+Wallet ledger and balances
+
+Every change to a wallet is an append-only WalletEntry. WalletAccount is
+each user's balance snapshot as of their latest entry, advanced in the same
+transaction as the entry, so reading a balance is one primary-key lookup
+and never a sum over the ledger. Amounts are integer minor units
+(paisa/cents); to_minor() converts the Float amounts used elsewhere.
+
+A posting is one conditional UPDATE of the account followed by the entry
+insert in the same transaction:
+
+    UPDATE wallet_accounts SET balance = balance + :amount, version = version + 1
+    WHERE user_id = :user_id AND balance + :amount >= 0
+    RETURNING balance, version
+
+The UPDATE takes the row lock (the write lock on SQLite), so concurrent
+debits serialize on the account and none can take it below zero. Each
+entry records the account version it produced, unique per user, so the
+ledger is a gap-free chain that audit() checks against the snapshot.
+
+Postings carry a reference, unique per user: posting a reference again
+returns the first entry instead of moving money twice.
+"""
+
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.models import WalletAccount, WalletEntry
+
+accounts = WalletAccount.__table__
+
+
+class WalletError(Exception):
+    """A wallet posting that cannot be made"""
+
+
+class InsufficientFunds(WalletError):
+    """The debit would take the balance below zero"""
+
+
+def to_minor(amount: float) -> int:
+    return int(round(amount * 100))
+
+
+def from_minor(amount: int) -> float:
+    return amount / 100
+
+
+async def _entry(db: AsyncSession, user_id: int, reference: str) -> Optional[WalletEntry]:
+    return await db.scalar(
+        select(WalletEntry).where(WalletEntry.user_id == user_id, WalletEntry.reference == reference)
+    )
+
+
+async def _open_account(db: AsyncSession, user_id: int):
+    if await db.scalar(select(accounts.c.user_id).where(accounts.c.user_id == user_id)) is not None:
+        return
+    try:
+        await db.execute(insert(accounts).values(user_id=user_id, balance=0, version=0, updated_at=datetime.utcnow()))
+        await db.commit()
+    except IntegrityError:
+        # Opened by a concurrent posting
+        await db.rollback()
+
+
+async def post(db: AsyncSession, user_id: int, amount: int, kind: str, reference: str) -> WalletEntry:
+    """Apply a signed amount to the wallet and record it; commits
+
+    Raises InsufficientFunds, leaving the wallet unchanged, if the balance
+    would go below zero.
+    """
+    existing = await _entry(db, user_id, reference)
+    if existing is not None:
+        if existing.amount != amount:
+            raise WalletError(f"Reference {reference} was already posted with a different amount")
+        return existing
+
+    if amount > 0:
+        await _open_account(db, user_id)
+
+    row = (await db.execute(
+        update(accounts)
+        .where(accounts.c.user_id == user_id, accounts.c.balance + amount >= 0)
+        .values(balance=accounts.c.balance + amount, version=accounts.c.version + 1, updated_at=datetime.utcnow())
+        .returning(accounts.c.balance, accounts.c.version)
+    )).first()
+    if row is None:
+        await db.rollback()
+        raise InsufficientFunds(f"Insufficient wallet balance for {from_minor(-amount):.2f}")
+
+    entry = WalletEntry(
+        user_id=user_id,
+        version=row.version,
+        amount=amount,
+        balance_after=row.balance,
+        kind=kind,
+        reference=reference,
+        created_at=datetime.utcnow()
+    )
+    db.add(entry)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # A concurrent posting of the same reference won; ours is rolled back whole
+        await db.rollback()
+        existing = await _entry(db, user_id, reference)
+        if existing is None:
+            raise
+        return existing
+    return entry
+
+
+async def credit(db: AsyncSession, user_id: int, amount: int, kind: str, reference: str) -> WalletEntry:
+    if amount <= 0:
+        raise WalletError("Credit amount must be positive")
+    return await post(db, user_id, amount, kind, reference)
+
+
+async def debit(db: AsyncSession, user_id: int, amount: int, kind: str, reference: str) -> WalletEntry:
+    if amount <= 0:
+        raise WalletError("Debit amount must be positive")
+    return await post(db, user_id, -amount, kind, reference)
+
+
+async def snapshot(db: AsyncSession, user_id: int) -> Tuple[int, int]:
+    """(balance, version) - one primary-key lookup"""
+    row = (await db.execute(
+        select(accounts.c.balance, accounts.c.version).where(accounts.c.user_id == user_id)
+    )).first()
+    return (row.balance, row.version) if row else (0, 0)
+
+
+async def balance(db: AsyncSession, user_id: int) -> int:
+    return (await snapshot(db, user_id))[0]
+
+
+async def entries(db: AsyncSession, user_id: int, limit: int = 20,
+                  before_version: Optional[int] = None) -> List[WalletEntry]:
+    """Latest entries first, paged by account version"""
+    query = select(WalletEntry).where(WalletEntry.user_id == user_id)
+    if before_version is not None:
+        query = query.where(WalletEntry.version < before_version)
+    return list(await db.scalars(query.order_by(WalletEntry.version.desc()).limit(limit)))
+
+
+async def audit(db: AsyncSession, user_id: int) -> Dict:
+    """Check the snapshot against the ledger it summarizes"""
+    balance, version = await snapshot(db, user_id)
+    ledger = (await db.execute(
+        select(func.coalesce(func.sum(WalletEntry.amount), 0), func.count(), func.coalesce(func.max(WalletEntry.version), 0))
+        .where(WalletEntry.user_id == user_id)
+    )).one()
+    return {
+        "balance": balance,
+        "version": version,
+        "ledger_balance": ledger[0],
+        "entries": ledger[1],
+        "consistent": balance == ledger[0] and version == ledger[1] == ledger[2]
+    }
+
+
+@event.listens_for(WalletEntry, "before_update")
+@event.listens_for(WalletEntry, "before_delete")
+def _append_only(mapper, connection, target):
+    raise WalletError("Wallet ledger entries are append-only; post a reversing entry instead")
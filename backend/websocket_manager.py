@@ -2,21 +2,112 @@
 WebSocket connection manager for real-time messaging
 """
 
-from typing import Dict, List, Set
+from typing import Dict, List, Optional, Set
 from fastapi import WebSocket
-import json
+import os
 import asyncio
 from datetime import datetime
 
+from backend.broadcast import Broadcaster, broadcaster as default_broadcaster
+from backend.serialization import dumps
+
+# Outbound back-pressure settings
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", 100))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", 5))
+# "drop_oldest" discards the oldest queued frame, "disconnect" closes the slow socket
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "drop_oldest")
+
+
+class OutboundConnection:
+    """A WebSocket with its own bounded send queue drained by a writer task"""
+    
+    def __init__(self, websocket: WebSocket, question_id: int, user_id: int, manager: "ConnectionManager"):
+        self.websocket = websocket
+        self.question_id = question_id
+        self.user_id = user_id
+        self.manager = manager
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=manager.queue_size)
+        self.dropped = 0
+        self.writer = asyncio.create_task(self._write_loop())
+    
+    def enqueue(self, payload: str):
+        """Queue an already-serialized frame without waiting on the socket"""
+        if not self.queue.full():
+            self.queue.put_nowait(payload)
+            return
+        
+        if self.manager.slow_consumer_policy == "disconnect":
+            self.manager.slow_consumer_disconnects += 1
+            self.manager.disconnect(self.question_id, self.user_id)
+            asyncio.create_task(self._close(code=1013))
+            return
+        
+        # drop_oldest - the client is behind, keep the most recent frames
+        self.queue.get_nowait()
+        self.queue.put_nowait(payload)
+        self.dropped += 1
+        self.manager.dropped_messages += 1
+    
+    async def _write_loop(self):
+        while True:
+            payload = await self.queue.get()
+            try:
+                await asyncio.wait_for(self.websocket.send_text(payload), timeout=self.manager.send_timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error sending to user {self.user_id}: {e!r}")
+                self.manager.disconnect(self.question_id, self.user_id)
+                return
+    
+    async def _close(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+    
+    def cancel(self):
+        if self.writer is not asyncio.current_task():
+            self.writer.cancel()
+
 
 class ConnectionManager:
-    """Manage WebSocket connections for live chat"""
+    """Manage WebSocket connections for live chat
+    
+    Sends are published through a Broadcaster so that every worker delivers
+    them to the sockets it holds locally. Each socket is written by its own
+    task from a bounded queue, so one slow client never delays the others.
+    """
     
-    def __init__(self):
-        # Store active connections: {question_id: {user_id: websocket, ...}}
-        self.active_connections: Dict[int, Dict[int, WebSocket]] = {}
+    def __init__(
+        self,
+        broadcaster: Broadcaster = None,
+        queue_size: int = WS_SEND_QUEUE_SIZE,
+        send_timeout: float = WS_SEND_TIMEOUT,
+        slow_consumer_policy: str = WS_SLOW_CONSUMER_POLICY
+    ):
+        # Store active connections: {question_id: {user_id: connection, ...}}
+        self.active_connections: Dict[int, Dict[int, OutboundConnection]] = {}
         # Store connected user IDs for quick lookup
         self.user_connections: Dict[int, Set[int]] = {}
+        
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.slow_consumer_policy = slow_consumer_policy
+        self.dropped_messages = 0
+        self.slow_consumer_disconnects = 0
+        
+        self.broadcaster = broadcaster or default_broadcaster
+        self.broadcaster.subscribe("question:", self._on_question_message)
+        self.broadcaster.subscribe("user:", self._on_user_message)
+        self.broadcaster.subscribe("question_user:", self._on_question_user_message)
+    
+    async def start(self):
+        """Start receiving broadcasts published by other workers"""
+        await self.broadcaster.start()
+    
+    async def stop(self):
+        await self.broadcaster.stop()
     
     async def connect(self, websocket: WebSocket, question_id: int, user_id: int):
         """Accept and register a new WebSocket connection"""
@@ -25,7 +116,10 @@ class ConnectionManager:
         if question_id not in self.active_connections:
             self.active_connections[question_id] = {}
         
-        self.active_connections[question_id][user_id] = websocket
+        previous = self.active_connections[question_id].get(user_id)
+        if previous:
+            previous.cancel()
+        self.active_connections[question_id][user_id] = OutboundConnection(websocket, question_id, user_id, self)
         
         if user_id not in self.user_connections:
             self.user_connections[user_id] = set()
@@ -36,7 +130,9 @@ class ConnectionManager:
     def disconnect(self, question_id: int, user_id: int):
         """Remove a disconnected user"""
         if question_id in self.active_connections:
-            self.active_connections[question_id].pop(user_id, None)
+            connection = self.active_connections[question_id].pop(user_id, None)
+            if connection:
+                connection.cancel()
             
             if not self.active_connections[question_id]:
                 del self.active_connections[question_id]
@@ -49,52 +145,46 @@ class ConnectionManager:
         print(f"User {user_id} disconnected from question {question_id}")
     
     async def broadcast_to_question(self, question_id: int, message: dict):
-        """Send message to all users in a question thread"""
-        if question_id not in self.active_connections:
-            return
-        
-        message["timestamp"] = datetime.utcnow().isoformat()
-        disconnected_users = []
-        
-        for user_id, websocket in self.active_connections[question_id].items():
-            try:
-                await websocket.send_json(message)
-            except Exception as e:
-                print(f"Error sending to user {user_id}: {e}")
-                disconnected_users.append(user_id)
-        
-        # Clean up disconnected users
-        for user_id in disconnected_users:
-            self.disconnect(question_id, user_id)
+        """Send message to all users in a question thread, on every worker"""
+        await self.broadcaster.publish(f"question:{question_id}", self._encode(message))
     
     async def send_to_user(self, user_id: int, message: dict):
-        """Send message to all connected sessions of a user"""
-        if user_id not in self.user_connections:
-            return
-        
-        message["timestamp"] = datetime.utcnow().isoformat()
-        disconnected_questions = []
-        
-        for question_id in list(self.user_connections[user_id]):
-            if question_id in self.active_connections and user_id in self.active_connections[question_id]:
-                try:
-                    await self.active_connections[question_id][user_id].send_json(message)
-                except Exception as e:
-                    print(f"Error sending to user {user_id}: {e}")
-                    disconnected_questions.append(question_id)
-        
-        # Clean up disconnected
-        for question_id in disconnected_questions:
-            self.disconnect(question_id, user_id)
+        """Send message to all connected sessions of a user, on every worker"""
+        await self.broadcaster.publish(f"user:{user_id}", self._encode(message))
     
     async def send_to_astrologer(self, question_id: int, astrologer_id: int, message: dict):
         """Send message to astrologer handling specific question"""
         # This would connect to the astrologer's dashboard
-        if question_id in self.active_connections and astrologer_id in self.active_connections[question_id]:
-            try:
-                await self.active_connections[question_id][astrologer_id].send_json(message)
-            except Exception as e:
-                print(f"Error sending to astrologer {astrologer_id}: {e}")
+        await self.broadcaster.publish(f"question_user:{question_id}:{astrologer_id}", self._encode(message))
+    
+    @staticmethod
+    def _encode(message: dict) -> str:
+        """Serialize once - every recipient is sent the same text frame"""
+        message["timestamp"] = datetime.utcnow().isoformat()
+        return dumps(message).decode()
+    
+    # ---- Local delivery, called for broadcasts from any worker ----
+    
+    async def _on_question_message(self, channel: str, payload: str):
+        question_id = int(channel.split(":")[1])
+        for connection in list(self.active_connections.get(question_id, {}).values()):
+            connection.enqueue(payload)
+    
+    async def _on_user_message(self, channel: str, payload: str):
+        user_id = int(channel.split(":")[1])
+        for question_id in list(self.user_connections.get(user_id, ())):
+            connection = self._get_connection(question_id, user_id)
+            if connection:
+                connection.enqueue(payload)
+    
+    async def _on_question_user_message(self, channel: str, payload: str):
+        _, question_id, user_id = channel.split(":")
+        connection = self._get_connection(int(question_id), int(user_id))
+        if connection:
+            connection.enqueue(payload)
+    
+    def _get_connection(self, question_id: int, user_id: int) -> Optional[OutboundConnection]:
+        return self.active_connections.get(question_id, {}).get(user_id)
     
     def get_active_users_in_question(self, question_id: int) -> List[int]:
         """Get list of active user IDs in a question"""
@@ -110,16 +200,21 @@ class ConnectionManager:
     
     def is_user_connected(self, user_id: int, question_id: int) -> bool:
         """Check if user is connected to specific question"""
-        return (question_id in self.active_connections and 
+        return (question_id in self.active_connections and
                 user_id in self.active_connections[question_id])
     
     def get_connection_count(self) -> dict:
         """Get connection statistics"""
-        total_connections = sum(len(users) for users in self.active_connections.values())
+        connections = [c for users in self.active_connections.values() for c in users.values()]
+        depths = [c.queue.qsize() for c in connections]
         return {
-            "total_connections": total_connections,
+            "total_connections": len(connections),
             "active_questions": len(self.active_connections),
-            "active_users": len(self.user_connections)
+            "active_users": len(self.user_connections),
+            "queued_messages": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "dropped_messages": self.dropped_messages,
+            "slow_consumer_disconnects": self.slow_consumer_disconnects
         }
 
 